@@ -0,0 +1,73 @@
+"""
+Benchmark of part header parsing
+
+Compares `tornado.httputil.HTTPHeaders.parse` plus ``_parse_header`` (what the
+parser used to do for every part) with `streamparser.headers.parse_part_headers`,
+and runs the parser over a form with many parts with both header shapes::
+
+    python benchmarks/bench_headers.py
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tornado.httputil import HTTPHeaders  # noqa: E402
+from tornado.httputil import _parse_header  # noqa: E402
+
+from streamparser import headers as part_headers  # noqa: E402
+from bench_streamparser import run  # noqa: E402
+from bench_streamparser import tiny_fields_body  # noqa: E402
+
+HEADER_BLOCKS = [
+    'Content-Disposition: form-data; name="field{0}"'.format(i).encode() for i in range(1000)
+] + [
+    'Content-Disposition: form-data; name="files"; filename="photo{0}.jpg"\r\n'
+    'Content-Type: image/jpeg'.format(i).encode() for i in range(1000)
+]
+
+
+def tornado_headers():
+    for block in HEADER_BLOCKS:
+        headers = HTTPHeaders.parse(block.decode("utf-8"))
+        _parse_header(headers.get("Content-Disposition", ""))
+
+
+def part_headers_uncached():
+    for block in HEADER_BLOCKS:
+        part_headers._cache.clear()
+        part_headers.parse_part_headers(block)
+
+
+def part_headers_cache_hits():
+    block = HEADER_BLOCKS[0]
+    for _ in HEADER_BLOCKS:
+        part_headers.parse_part_headers(block)
+
+
+def part_headers_as_http_headers():
+    for block in HEADER_BLOCKS:
+        part_headers.parse_part_headers(block).to_http_headers()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    print("{:<36} {:>14}".format("header blocks", "blocks/s"))
+    for func in (tornado_headers, part_headers_uncached, part_headers_cache_hits, part_headers_as_http_headers):
+        elapsed = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print("{:<36} {:>14.0f}".format(func.__name__, len(HEADER_BLOCKS) / elapsed))
+
+    body = tiny_fields_body(4 * 1024 * 1024)
+    print("\n{:<36} {:>14}".format("form with many parts", "MB/s"))
+    for http_headers in (True, False):
+        _, elapsed = run(body, 64 * 1024, http_headers=http_headers)
+        print("{:<36} {:>14.1f}".format("http_headers={}".format(http_headers), len(body) / 1e6 / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Throughput benchmark for `StreamingFormDataParser.data_received`
+
+Runs the parser over synthetic bodies in chunks of different sizes and
+reports throughput, peak RSS and delegate calls per part. Every engine, layout and
+chunk size is run in a process of its own, so the peak RSS is the run's::
+
+    python benchmarks/bench_streamparser.py
+    python benchmarks/bench_streamparser.py --engine python --layout adversarial --chunk-size 1024
+"""
+import argparse
+import gc
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tornado.httputil import HTTPHeaders  # noqa: E402
+
+from streamparser import StreamingFormDataParser  # noqa: E402
+from streamparser import StreamingFormDataParserDelegate  # noqa: E402
+from streamparser import _scanner  # noqa: E402
+from streamparser import core  # noqa: E402
+from streamparser.metrics import StatsMetrics  # noqa: E402
+
+try:
+    from streamparser import _speedups
+except ImportError:
+    _speedups = None
+
+BOUNDARY = "----benchmarkboundary7MA4YWxkTrZu0gW"
+CHUNK_SIZES = [1, 64, 1024, 16 * 1024, 64 * 1024, 1024 * 1024]
+# bodies fed in small chunks are cut down so that every run takes about as long
+MAX_CHUNKS = 200000
+
+
+class CountingDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.parts = 0
+        self.calls = 0
+        self.bytes = 0
+
+    def start_file(self, headers, disp_params):
+        self.parts += 1
+        self.calls += 1
+
+    def file_data_received(self, file_data):
+        self.calls += 1
+        self.bytes += len(file_data)
+
+    def finish_file(self):
+        self.calls += 1
+
+
+def part(name, data, filename=None):
+    disposition = 'form-data; name="{}"'.format(name)
+    if filename:
+        disposition += '; filename="{}"'.format(filename)
+    return "--{}\r\nContent-Disposition: {}\r\n\r\n".format(BOUNDARY, disposition).encode() + data + b"\r\n"
+
+
+def huge_file_body(size):
+    return part("file", os.urandom(size), "huge.bin") + "--{}--\r\n".format(BOUNDARY).encode()
+
+
+def tiny_fields_body(size):
+    parts = []
+    total = 0
+    i = 0
+    while total < size:
+        parts.append(part("field{}".format(i), "value{}".format(i).encode()))
+        total += len(parts[-1])
+        i += 1
+    return b"".join(parts) + "--{}--\r\n".format(BOUNDARY).encode()
+
+
+def adversarial_body(size):
+    # the body is full of CRLF-- sequences followed by almost the whole boundary
+    near_boundary = "\r\n--{}".format(BOUNDARY[:-1]).encode()
+    data = (near_boundary + b"x") * (size // (len(near_boundary) + 1))
+    return part("file", data, "adversarial.bin") + "--{}--\r\n".format(BOUNDARY).encode()
+
+
+LAYOUTS = {
+    "huge-file": huge_file_body,
+    "tiny-fields": tiny_fields_body,
+    "adversarial": adversarial_body,
+}
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / 1024.0 / 1024.0
+    return rss / 1024.0
+
+
+def run(body, chunk_size, parser_class=StreamingFormDataParser, **parser_kwargs):
+    headers = HTTPHeaders()
+    headers.add("Content-Type", "multipart/form-data; boundary={}".format(BOUNDARY))
+    delegate = CountingDelegate()
+    parser = parser_class(delegate, headers, **parser_kwargs)
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+    gc.collect()
+    started = time.perf_counter()
+    for chunk in chunks:
+        parser.data_received(chunk)
+    elapsed = time.perf_counter() - started
+    return delegate, elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--engine", choices=["speedups", "python"], action="append",
+                            help="scanning engine, both by default")
+    arg_parser.add_argument("--layout", choices=sorted(LAYOUTS), action="append",
+                            help="body layout, all by default")
+    arg_parser.add_argument("--chunk-size", type=int, action="append",
+                            help="chunk size in bytes, 1 byte to 1 MB by default")
+    arg_parser.add_argument("--collect-fields", action="store_true",
+                            help="create the parser with collect_fields=True")
+    arg_parser.add_argument("--metrics", action="store_true",
+                            help="create the parser with StatsMetrics")
+    arg_parser.add_argument("--size", type=int, default=32 * 1024 * 1024,
+                            help="body size in bytes (default: 32 MB)")
+    arg_parser.add_argument("--row", action="store_true", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.row:
+        print_row(args.engine[0], args.layout[0], args.chunk_size[0], args)
+        return
+
+    engines = args.engine or ["speedups", "python"]
+    if _speedups is None and "speedups" in engines:
+        print("C scanning engine is not built, run `make build-ext`")
+        engines.remove("speedups")
+
+    print("{:<10} {:<12} {:>10} {:>10} {:>10} {:>10} {:>12}".format(
+        "engine", "layout", "chunk", "body MB", "MB/s", "RSS MB", "calls/part"))
+    sys.stdout.flush()
+    for engine in engines:
+        for layout in args.layout or sorted(LAYOUTS):
+            for chunk_size in args.chunk_size or CHUNK_SIZES:
+                command = [sys.executable, os.path.abspath(__file__), "--row", "--engine", engine,
+                           "--layout", layout, "--chunk-size", str(chunk_size), "--size", str(args.size)]
+                if args.collect_fields:
+                    command.append("--collect-fields")
+                if args.metrics:
+                    command.append("--metrics")
+                subprocess.check_call(command)
+
+
+def print_row(engine, layout, chunk_size, args):
+    """Runs the parser once and prints the result, the peak RSS is that of the process"""
+    core.scanner = _speedups if engine == "speedups" else _scanner
+    body = LAYOUTS[layout](min(args.size, chunk_size * MAX_CHUNKS))
+    delegate, elapsed = run(body, chunk_size, collect_fields=args.collect_fields,
+                            metrics=StatsMetrics() if args.metrics else None)
+    print("{:<10} {:<12} {:>10} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.1f}".format(
+        engine, layout, chunk_size, len(body) / 1e6, len(body) / 1e6 / elapsed,
+        peak_rss_mb(), delegate.calls / float(max(delegate.parts, 1))))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
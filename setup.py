@@ -1,8 +1,35 @@
+from distutils.command.build_ext import build_ext
+from distutils.core import Extension
 from distutils.core import setup
+from distutils.errors import CCompilerError
+from distutils.errors import DistutilsExecError
+from distutils.errors import DistutilsPlatformError
+import platform
 
 with open('requirements.txt') as f:
     required = f.read().splitlines()
 
+
+class optional_build_ext(build_ext):
+    """The C scanning engine is optional, the pure Python one is used without it"""
+
+    def run(self):
+        try:
+            build_ext.run(self)
+        except DistutilsPlatformError as e:
+            self.warn("building C extensions failed: {}".format(e))
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except (CCompilerError, DistutilsExecError, DistutilsPlatformError) as e:
+            self.warn("building {} failed: {}".format(ext.name, e))
+
+
+ext_modules = []
+if platform.python_implementation() == 'CPython':
+    ext_modules.append(Extension('streamparser._speedups', ['streamparser/_speedups.c']))
+
 setup(
     name='tornado-streaming-parser',
     version='0.1',
@@ -10,5 +37,7 @@ setup(
     packages=[
         'streamparser'
     ],
+    ext_modules=ext_modules,
+    cmdclass={'build_ext': optional_build_ext},
     install_requires=required
 )
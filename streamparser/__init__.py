@@ -1,2 +1,26 @@
-from .streamparser import StreamingFormDataParser
-from .streamparser import StreamingFormDataParserDelegate
+import sys
+
+from .core import MultipartError
+from .core import MultipartLimitError
+from .core import MultipartParser
+
+try:
+    import tornado
+except ImportError:
+    # only streamparser.core can be used without Tornado
+    tornado = None
+
+if tornado is not None:
+    from .streamparser import StreamingFormDataParser
+    from .streamparser import StreamingFormDataParserDelegate
+    from .streamparser import StreamingRawBodyParser
+    from .delegates import PartProcessor
+    from .delegates import ProcessPoolDelegate
+    from .delegates import RouterDelegate
+    from .delegates import SpooledFileDelegate
+    from .delegates import SpooledPart
+    from .delegates import ThreadPoolDelegate
+    from .handlers import StreamingUploadMixin
+
+    if sys.version_info >= (3, 5):
+        from .asyncparser import AsyncStreamingFormDataParser
@@ -0,0 +1,10 @@
+from tornado.gen import is_future
+
+try:
+    from inspect import isawaitable as _isawaitable
+
+    def isawaitable(result):
+        return result is not None and (is_future(result) or _isawaitable(result))
+except ImportError:
+    # py2
+    isawaitable = is_future
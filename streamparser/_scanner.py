@@ -0,0 +1,54 @@
+"""
+Pure Python multipart scanning engine
+
+`streamparser._speedups` implements the same functions in C and is used
+instead of this module when it has been built.
+"""
+
+# scan_body results
+BODY_DATA = 0
+BODY_PART_END = 1
+BODY_FORM_END = 2
+
+
+def find_headers_end(buffer, start):
+    """
+    Returns the index of the blank line ending the part headers in
+    ``buffer[start:]`` or -1 if it has not been received yet
+    """
+    return buffer.find(b"\r\n\r\n", start)
+
+
+def scan_body(buffer, delimiter, start):
+    """
+    Scans part body data in ``buffer[start:]`` for ``delimiter`` (CRLF--boundary)
+
+    Returns a ``(result, data_end, next_offset)`` tuple where ``buffer[start:data_end]``
+    is file data and ``next_offset`` is where parsing continues. ``result`` is
+    `BODY_DATA` when no complete delimiter was found (only a tail that may start
+    one is left unconsumed), `BODY_PART_END` when the delimiter is followed by
+    CRLF and `BODY_FORM_END` when it is the close delimiter.
+    """
+    buffer_end = len(buffer)
+    delimiter_start = buffer.find(delimiter, start)
+    while delimiter_start != -1:
+        marker_start = delimiter_start + len(delimiter)
+        if buffer_end - marker_start < 2:
+            # wait for the bytes telling a delimiter from the close delimiter
+            return BODY_DATA, delimiter_start, delimiter_start
+        marker = buffer[marker_start:marker_start + 2]
+        if marker == b"\r\n":
+            return BODY_PART_END, delimiter_start, marker_start + 2
+        if marker == b"--":
+            return BODY_FORM_END, delimiter_start, buffer_end
+        delimiter_start = buffer.find(delimiter, delimiter_start + 1)
+
+    # keep back only a tail that could be the start of a delimiter
+    data_end = buffer_end
+    prefix_start = buffer.find(b"\r", max(start, buffer_end - len(delimiter) + 1))
+    while prefix_start != -1:
+        if delimiter.startswith(buffer[prefix_start:]):
+            data_end = prefix_start
+            break
+        prefix_start = buffer.find(b"\r", prefix_start + 1)
+    return BODY_DATA, data_end, data_end
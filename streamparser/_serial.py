@@ -0,0 +1,140 @@
+import collections
+import functools
+
+from tornado.concurrent import Future
+from tornado.gen import convert_yielded
+from tornado.ioloop import IOLoop
+
+from ._compat import isawaitable
+
+
+class SerialExecutor(object):
+    """
+    Runs functions on an executor one at a time, in submission order
+
+    Without an executor functions are called on the IOLoop, a function returning
+    an awaitable is done when the awaitable is.
+
+    Must be used from the IOLoop thread, futures returned by its methods are
+    resolved on that IOLoop. The first error of a function is kept in ``error``
+    and raised by `wait_for_capacity` and `flush`, so errors of functions whose
+    futures are not awaited are not lost. Functions queued after the one that failed
+    are not called, their futures fail with that error, and so do later submissions.
+    """
+
+    def __init__(self, executor, max_pending=None):
+        """
+        :arg executor: a `concurrent.futures.Executor` or None to call functions on the IOLoop
+        :arg max_pending: number of submitted functions above which
+            `wait_for_capacity` returns a future
+        """
+        self.executor = executor
+        self.max_pending = max_pending
+        self.error = None
+        self._queue = collections.deque()
+        self._running = False
+        self._capacity_waiters = []
+        self._flush_waiters = []
+
+    @property
+    def pending(self):
+        """Number of submitted functions that are not done yet"""
+        return len(self._queue) + self._running
+
+    def submit(self, fn, *args):
+        """Queues ``fn(*args)``, returns a future of its result"""
+        future = Future()
+        if self.error is not None:
+            future.set_exception(self.error)
+            return future
+        self._queue.append((future, fn, args))
+        if not self._running:
+            self._run_next()
+        return future
+
+    def post(self, fn, *args):
+        """Queues ``fn(*args)`` without a future, its error is only kept in ``error``"""
+        if self.error is not None:
+            return
+        self._queue.append((None, fn, args))
+        if not self._running:
+            self._run_next()
+
+    def wait_for_capacity(self):
+        """
+        Returns a future resolved when no more than ``max_pending`` functions are
+        pending, None if that is the case already
+        """
+        if self.error is not None:
+            raise self.error
+        if self.max_pending is None or self.pending <= self.max_pending:
+            return None
+        future = Future()
+        self._capacity_waiters.append(future)
+        return future
+
+    def flush(self):
+        """Returns a future resolved when all submitted functions are done, None if they are"""
+        if self.error is not None:
+            raise self.error
+        if not self.pending:
+            return None
+        future = Future()
+        self._flush_waiters.append(future)
+        return future
+
+    def _run_next(self):
+        future, fn, args = self._queue.popleft()
+        self._running = True
+        if self.executor is not None:
+            IOLoop.current().add_future(
+                self.executor.submit(fn, *args), functools.partial(self._done, future)
+            )
+            return
+
+        call_future = Future()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            call_future.set_exception(e)
+        else:
+            if isawaitable(result):
+                IOLoop.current().add_future(convert_yielded(result), functools.partial(self._done, future))
+                return
+            call_future.set_result(result)
+        self._done(future, call_future)
+
+    def _done(self, future, executor_future):
+        self._running = False
+        error = executor_future.exception()
+        if error is not None and self.error is None:
+            self.error = error
+        if future is not None:
+            if error is None:
+                future.set_result(executor_future.result())
+            else:
+                future.set_exception(error)
+        if self.error is not None:
+            self._drop_queue()
+        elif self._queue:
+            self._run_next()
+
+        if self.max_pending is None or self.pending <= self.max_pending or self.error is not None:
+            self._wake(self._capacity_waiters)
+        if not self.pending or self.error is not None:
+            self._wake(self._flush_waiters)
+
+    def _drop_queue(self):
+        """Fails the queued functions without calling them"""
+        while self._queue:
+            future, _, _ = self._queue.popleft()
+            if future is not None:
+                future.set_exception(self.error)
+
+    def _wake(self, waiters):
+        while waiters:
+            waiter = waiters.pop(0)
+            if self.error is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(self.error)
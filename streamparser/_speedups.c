@@ -0,0 +1,137 @@
+/*
+ * C implementation of the multipart scanning engine in streamparser/_scanner.py
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <string.h>
+
+#define BODY_DATA 0
+#define BODY_PART_END 1
+#define BODY_FORM_END 2
+
+static Py_ssize_t
+find(const char *haystack, Py_ssize_t start, Py_ssize_t end,
+     const char *needle, Py_ssize_t needle_len)
+{
+    const char *p, *last;
+
+    if (needle_len == 0)
+        return start <= end ? start : -1;
+    if (end - start < needle_len)
+        return -1;
+    last = haystack + end - needle_len;
+    p = haystack + start;
+    while (p <= last) {
+        p = memchr(p, needle[0], last - p + 1);
+        if (p == NULL)
+            return -1;
+        if (memcmp(p + 1, needle + 1, needle_len - 1) == 0)
+            return p - haystack;
+        p++;
+    }
+    return -1;
+}
+
+static PyObject *
+find_headers_end(PyObject *self, PyObject *args)
+{
+    Py_buffer buffer;
+    Py_ssize_t start, index;
+
+    if (!PyArg_ParseTuple(args, "y*n:find_headers_end", &buffer, &start))
+        return NULL;
+    if (start < 0)
+        start = 0;
+    index = find(buffer.buf, start, buffer.len, "\r\n\r\n", 4);
+    PyBuffer_Release(&buffer);
+    return PyLong_FromSsize_t(index);
+}
+
+static PyObject *
+scan_body(PyObject *self, PyObject *args)
+{
+    Py_buffer buffer, delimiter;
+    Py_ssize_t start, end, delimiter_start, marker_start, prefix_start;
+    const char *buf, *delim;
+    int result = BODY_DATA;
+    Py_ssize_t data_end, next_offset;
+
+    if (!PyArg_ParseTuple(args, "y*y*n:scan_body", &buffer, &delimiter, &start))
+        return NULL;
+    buf = buffer.buf;
+    delim = delimiter.buf;
+    end = buffer.len;
+    if (start < 0)
+        start = 0;
+
+    delimiter_start = find(buf, start, end, delim, delimiter.len);
+    while (delimiter_start != -1) {
+        marker_start = delimiter_start + delimiter.len;
+        if (end - marker_start < 2) {
+            data_end = next_offset = delimiter_start;
+            goto done;
+        }
+        if (buf[marker_start] == '\r' && buf[marker_start + 1] == '\n') {
+            result = BODY_PART_END;
+            data_end = delimiter_start;
+            next_offset = marker_start + 2;
+            goto done;
+        }
+        if (buf[marker_start] == '-' && buf[marker_start + 1] == '-') {
+            result = BODY_FORM_END;
+            data_end = delimiter_start;
+            next_offset = end;
+            goto done;
+        }
+        delimiter_start = find(buf, delimiter_start + 1, end, delim, delimiter.len);
+    }
+
+    data_end = end;
+    prefix_start = end - delimiter.len + 1;
+    if (prefix_start < start)
+        prefix_start = start;
+    for (; prefix_start < end; prefix_start++) {
+        if (buf[prefix_start] == '\r'
+                && memcmp(buf + prefix_start, delim, end - prefix_start) == 0) {
+            data_end = prefix_start;
+            break;
+        }
+    }
+    next_offset = data_end;
+
+done:
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&delimiter);
+    return Py_BuildValue("(inn)", result, data_end, next_offset);
+}
+
+static PyMethodDef speedups_methods[] = {
+    {"find_headers_end", find_headers_end, METH_VARARGS,
+     "Returns the index of the blank line ending the part headers or -1"},
+    {"scan_body", scan_body, METH_VARARGS,
+     "Scans part body data for the delimiter, see streamparser._scanner.scan_body"},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef speedups_module = {
+    PyModuleDef_HEAD_INIT,
+    "streamparser._speedups",
+    "C implementation of the multipart scanning engine",
+    -1,
+    speedups_methods
+};
+
+PyMODINIT_FUNC
+PyInit__speedups(void)
+{
+    PyObject *module = PyModule_Create(&speedups_module);
+    if (module == NULL)
+        return NULL;
+    if (PyModule_AddIntConstant(module, "BODY_DATA", BODY_DATA) < 0
+            || PyModule_AddIntConstant(module, "BODY_PART_END", BODY_PART_END) < 0
+            || PyModule_AddIntConstant(module, "BODY_FORM_END", BODY_FORM_END) < 0) {
+        Py_DECREF(module);
+        return NULL;
+    }
+    return module;
+}
@@ -0,0 +1,40 @@
+"""
+Vectored writes of buffers to file descriptors
+"""
+import os
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:
+    # the POSIX minimum
+    IOV_MAX = 16
+
+# py2 and Windows have no os.writev
+_writev = getattr(os, "writev", None)
+
+
+def write_buffers(fd, buffers):
+    """
+    Writes all of ``buffers`` to ``fd`` at its current position, with one `os.writev` call
+    per `IOV_MAX` buffers where it is available and one `os.write` call per buffer otherwise.
+    Partial writes are continued.
+    :arg fd: file descriptor open for writing in blocking mode
+    :arg buffers: list of `bytes` or `memoryview`, partially written items are replaced
+    """
+    if _writev is None:
+        for buffer in buffers:
+            view = memoryview(buffer)
+            while len(view):
+                view = view[os.write(fd, view):]
+        return
+
+    start = 0
+    while start < len(buffers):
+        written = _writev(fd, buffers[start:start + IOV_MAX])
+        while start < len(buffers) and written >= len(buffers[start]):
+            written -= len(buffers[start])
+            start += 1
+        if written:
+            buffers[start] = memoryview(buffers[start])[written:]
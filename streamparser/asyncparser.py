@@ -0,0 +1,49 @@
+from tornado.gen import convert_yielded
+
+from .streamparser import StreamingFormDataParser
+
+
+class AsyncStreamingFormDataParser(StreamingFormDataParser):
+    """
+    `.StreamingFormDataParser` built on native coroutines
+
+    `data_received` returns None when no delegate method returned an awaitable, so
+    a `.RequestHandler` decorated with stream_request_body can return its result
+    from ``data_received`` and skip coroutine machinery for chunks that need no waiting::
+
+        def data_received(self, chunk):
+            return self.parser.data_received(chunk)
+
+    Delegate methods may be ``async def``.
+    """
+
+    def data_received(self, chunk):
+        """
+        Receive chunk of multipart/form-data
+        :arg chunk: chunk of data
+        :returns: None or an awaitable to wait on before passing the next chunk
+        """
+        self._receive(chunk)
+
+        result = self._parse()
+        if result is None:
+            return None
+        return self._resume(result)
+
+    def finish(self):
+        """
+        Call once the whole body has been received, a body that ended too early
+        is reported like invalid data
+        :returns: None or an awaitable to wait on
+        """
+        self._finish()
+
+        result = self._parse()
+        if result is None:
+            return None
+        return self._resume(result)
+
+    async def _resume(self, result):
+        while result is not None:
+            await convert_yielded(result)
+            result = self._parse()
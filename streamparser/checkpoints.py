@@ -0,0 +1,77 @@
+"""
+Storage of parser checkpoints for resumable uploads
+"""
+import os
+import re
+import tempfile
+
+_UPLOAD_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,128}\Z")
+
+# py2 has no os.replace
+_replace = getattr(os, "replace", os.rename)
+
+
+class LocalCheckpointStore(object):
+    """
+    Keeps checkpoints returned by `.StreamingFormDataParser.checkpoint` in files
+    of a local directory, one per upload id
+
+    Checkpoints are written to a temporary file renamed over the previous one,
+    so a crash never leaves a partially written checkpoint behind.
+    """
+
+    def __init__(self, directory, suffix=".checkpoint"):
+        """
+        :arg directory: directory of the checkpoint files, created if it does not exist
+        :arg suffix: suffix of checkpoint file names
+        """
+        self.directory = directory
+        self.suffix = suffix
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, upload_id):
+        """
+        Returns the path of the checkpoint file of ``upload_id``
+
+        :raises: ValueError for an upload id that is not 1 to 128 letters, digits, ``_`` or ``-``
+        """
+        if not _UPLOAD_ID_RE.match(upload_id):
+            raise ValueError("invalid upload id")
+        return os.path.join(self.directory, upload_id + self.suffix)
+
+    def save(self, upload_id, checkpoint):
+        """
+        Stores ``checkpoint`` of ``upload_id``, replacing the previous one
+        :arg upload_id: id of the upload
+        :arg checkpoint: `bytes` returned by `.StreamingFormDataParser.checkpoint`
+        """
+        path = self.path(upload_id)
+        fd, tmp_path = tempfile.mkstemp(prefix=upload_id, suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(checkpoint)
+                f.flush()
+                os.fsync(f.fileno())
+            _replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def load(self, upload_id):
+        """Returns the checkpoint of ``upload_id``, None if there is none"""
+        try:
+            with open(self.path(upload_id), "rb") as f:
+                return f.read()
+        except IOError:
+            if os.path.exists(self.path(upload_id)):
+                raise
+            return None
+
+    def remove(self, upload_id):
+        """Removes the checkpoint of ``upload_id`` if there is one"""
+        try:
+            os.remove(self.path(upload_id))
+        except OSError:
+            if os.path.exists(self.path(upload_id)):
+                raise
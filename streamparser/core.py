@@ -0,0 +1,638 @@
+"""
+Framework-free incremental multipart/form-data parser
+
+`MultipartParser` turns chunks of a body into a list of events::
+
+    parser = MultipartParser(boundary)
+    for chunk in chunks:
+        for event in parser.feed(chunk):
+            if isinstance(event, PartStart):
+                ...
+            elif isinstance(event, PartData):
+                ...
+
+It does no I/O and calls nothing back, `.StreamingFormDataParser` is a Tornado
+adapter passing its events to a `.StreamingFormDataParserDelegate`.
+"""
+
+import base64
+import json
+
+from . import _scanner
+from .headers import PartHeaders
+from .headers import parse_part_headers
+from ._scanner import BODY_DATA
+from ._scanner import BODY_PART_END
+
+try:
+    from . import _speedups as scanner
+except ImportError:
+    scanner = _scanner
+
+
+PHASE_BOUNDARY = 1
+PHASE_HEADERS = 2
+PHASE_BODY = 3
+PHASE_FINISHED = 4
+PHASE_ERROR = 5
+
+PHASE_NAMES = {
+    PHASE_BOUNDARY: "boundary",
+    PHASE_HEADERS: "headers",
+    PHASE_BODY: "body",
+    PHASE_FINISHED: "finished",
+    PHASE_ERROR: "error",
+}
+
+CHECKPOINT_VERSION = 1
+
+# consumed bytes are dropped from the front of the buffer only once there
+# are at least this many of them and they make up half of the buffer
+BUFFER_COMPACT_SIZE = 64 * 1024
+
+
+class MultipartError(ValueError):
+    """
+    Raised or reported by the parsers for a body they do not accept
+
+    ``offset`` is the offset in the body at which the error was detected and
+    ``phase`` the parser phase (one of the ``PHASE_*`` constants) at that point.
+    """
+
+    def __init__(self, message, offset=None, phase=None):
+        super(MultipartError, self).__init__(message)
+        self.message = message
+        self.offset = offset
+        self.phase = phase
+
+    def __str__(self):
+        if self.offset is None:
+            return self.message
+        return "{} (at offset {} in {} phase)".format(self.message, self.offset, PHASE_NAMES.get(self.phase))
+
+
+class MultipartLimitError(MultipartError):
+    """Raised or reported by the parsers when the body exceeds one of their limits"""
+
+    def __init__(self, limit_name, limit, offset=None, phase=None):
+        super(MultipartLimitError, self).__init__(
+            "{} of {} exceeded".format(limit_name, limit), offset, phase
+        )
+        self.limit_name = limit_name
+        self.limit = limit
+
+
+def get_boundary(content_type):
+    """
+    Extracts boundary from Content-Type of a multipart body
+    """
+    if content_type.lower().startswith("multipart/"):
+        fields = content_type.split(";")
+        for field in fields:
+            k, sep, v = field.strip().partition("=")
+            if k == "boundary" and v:
+                return v
+        else:
+            raise ValueError("multipart boundary not found")
+
+
+def _encode_bytes(data):
+    return base64.b64encode(bytes(data)).decode("ascii")
+
+
+def _decode_bytes(data):
+    return base64.b64decode(data.encode("ascii"))
+
+
+def get_multipart_subtype(content_type):
+    """
+    Returns the lowercase subtype of a multipart Content-Type, like ``"form-data"``, None for another type
+    """
+    media_type = content_type.partition(";")[0].strip().lower()
+    if media_type.startswith("multipart/"):
+        return media_type[len("multipart/"):]
+    return None
+
+
+class Event(object):
+    """Base class of the events returned by `MultipartParser.feed`"""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            "{}={!r}".format(name, getattr(self, name)) for name in self.__slots__
+        ))
+
+
+class PartStart(Event):
+    """A part begins, ``headers`` are `.headers.PartHeaders`, ``disp_params`` a dict"""
+
+    __slots__ = ("headers", "disp_params")
+
+    def __init__(self, headers, disp_params):
+        self.headers = headers
+        self.disp_params = disp_params
+
+
+class PartData(Event):
+    """
+    A chunk of the current part's data, a `memoryview` over the parser buffer
+    (or `bytes` for a parser created with ``copy_data=True``)
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class PartEnd(Event):
+    """The current part has been received"""
+
+    __slots__ = ()
+
+
+class FormEnd(Event):
+    """The close delimiter has been received, ``fields`` are the collected fields"""
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+
+class ParseError(Event):
+    """The parser stopped at ``error``, a `MultipartError`, it is always the last event"""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+class MultipartParser(object):
+    """
+    Incremental multipart parser
+
+    A multipart/form-data body (the default ``subtype``) is parsed as RFC 7578 has it,
+    every part needs a ``form-data`` Content-Disposition. Parts of other subtypes,
+    like ``mixed`` or ``related``, may have any headers or none at all.
+
+    `feed` never raises for a body it does not accept, it returns a `ParseError`
+    event after the events of the data preceding the error and sets ``error``,
+    further data is ignored. The parser is done when ``finished`` is True.
+
+    With ``collect_fields`` parts without a filename up to ``max_field_size`` bytes
+    produce no events, they are collected into ``fields`` (a dict of names to lists
+    of `bytes` values) and returned with `FormEnd`. A larger one is reported as a
+    regular part once it exceeds the size.
+    """
+
+    def __init__(self, boundary, copy_data=False, collect_fields=False, max_field_size=64 * 1024,
+                 max_header_size=None, max_parts=None, max_part_size=None, max_body_size=None,
+                 subtype="form-data"):
+        """
+        :arg boundary: the multipart boundary, as returned by `get_boundary`
+        :arg copy_data: return `bytes` in `PartData` instead of `memoryview` slices
+        :arg collect_fields: collect parts without a filename into ``fields``
+        :arg max_field_size: size in bytes above which a collected part is reported as a part after all
+        :arg max_header_size: limit of the size in bytes of a part's header block
+        :arg max_parts: limit of the number of parts
+        :arg max_part_size: limit of the size in bytes of a part's data
+        :arg max_body_size: limit of the size in bytes of the whole body
+        :arg subtype: the multipart subtype, as returned by `get_multipart_subtype`
+
+        :raises: ValueError
+        """
+        if not boundary:
+            raise ValueError("Invalid multipart/{}".format(subtype))
+        if boundary.startswith('"') and boundary.endswith('"'):
+            boundary = boundary[1:-1]
+        self.boundary = boundary
+        self.subtype = subtype
+        self._form_data = subtype == "form-data"
+        self.phase = PHASE_BOUNDARY
+        self.finished = False
+        self.error = None
+
+        self.copy_data = copy_data
+        self.collect_fields = collect_fields
+        self.max_field_size = max_field_size
+        self.max_header_size = max_header_size
+        self.max_parts = max_parts
+        self.max_part_size = max_part_size
+        self.max_body_size = max_body_size
+        self.fields = {}
+        self.bytes_received = 0
+        self.parts_received = 0
+        self._field = None
+        self._part_headers = None
+        self._part_size = 0
+        self._part_data_start = 0
+
+        # The buffer is read from `_buffer_offset` onwards. A frozen buffer is
+        # either an adopted `bytes` chunk or a `bytearray` with memoryview slices
+        # handed out in events, so it is never mutated in place.
+        self._buffer = b""
+        self._buffer_offset = 0
+        self._buffer_frozen = True
+        self._boundary_delimiter = "--{}\r\n".format(boundary).encode()
+        self._end_boundary = "\r\n--{}--\r\n".format(boundary).encode()
+        self._part_delimiter = "\r\n--{}".format(boundary).encode()
+
+    @property
+    def buffered(self):
+        """Number of received bytes not parsed yet"""
+        return len(self._buffer) - self._buffer_offset
+
+    @property
+    def current_part(self):
+        """``(headers, size)`` of the part whose data is being received, None between parts or for a field"""
+        if self.phase != PHASE_BODY or self._field is not None:
+            return None
+        return self._part_headers, self._part_size
+
+    def checkpoint(self):
+        """
+        Returns the parser state as `bytes` (JSON), `restore` continues parsing from it
+
+        Data received so far is included in the state, so parsing continues with
+        the data from offset ``bytes_received`` of the body on.
+
+        :raises: ValueError if the parser has stopped at an error
+        """
+        if self.error is not None:
+            raise ValueError("a parser stopped at an error can not be checkpointed")
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "boundary": self.boundary,
+            "phase": self.phase,
+            "finished": self.finished,
+            "bytes_received": self.bytes_received,
+            "parts_received": self.parts_received,
+            "part_headers": self._part_headers.items() if self._part_headers is not None else None,
+            "part_size": self._part_size,
+            "part_data_start": self._part_data_start,
+            "field": _encode_bytes(self._field[1]) if self._field is not None else None,
+            "fields": dict((name, [_encode_bytes(value) for value in values]) for name, values in self.fields.items()),
+            "buffer": _encode_bytes(self._buffer[self._buffer_offset:]),
+        }
+        return json.dumps(state, sort_keys=True).encode("utf-8")
+
+    @classmethod
+    def restore(cls, checkpoint, **kwargs):
+        """
+        Returns a parser continuing from a state returned by `checkpoint`
+        :arg checkpoint: the state
+        :arg kwargs: arguments of the parser other than ``boundary``
+
+        :raises: ValueError for an invalid checkpoint
+        """
+        try:
+            state = json.loads(checkpoint.decode("utf-8"))
+            if state["version"] != CHECKPOINT_VERSION:
+                raise ValueError("unsupported checkpoint version {}".format(state["version"]))
+            parser = cls(state["boundary"], **kwargs)
+            parser.phase = state["phase"]
+            parser.finished = state["finished"]
+            parser.bytes_received = state["bytes_received"]
+            parser.parts_received = state["parts_received"]
+            if state["part_headers"] is not None:
+                parser._part_headers = PartHeaders(tuple(item) for item in state["part_headers"])
+            parser._part_size = state["part_size"]
+            parser._part_data_start = state["part_data_start"]
+            if state["field"] is not None:
+                parser._field = (parser._part_headers, bytearray(_decode_bytes(state["field"])))
+            for name, values in state["fields"].items():
+                parser.fields[name] = [_decode_bytes(value) for value in values]
+            parser._buffer = _decode_bytes(state["buffer"])
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError("invalid checkpoint: {!r}".format(e))
+        return parser
+
+    def feed(self, data):
+        """
+        Parses a chunk of the body
+        :arg data: `bytes` or another buffer
+        :returns: a list of `Event`
+        """
+        events = []
+        if self.error is not None:
+            return events
+        self.bytes_received += len(data)
+        if self.max_body_size is not None and self.bytes_received > self.max_body_size:
+            self._fail(MultipartLimitError("max_body_size", self.max_body_size, self.max_body_size), events)
+            return events
+        self._append_to_buffer(data)
+        self._parse(events)
+        return events
+
+    def finish(self):
+        """
+        Called once the whole body has been fed
+        :returns: a list of events, a `ParseError` if the body ended before the close delimiter
+        """
+        events = []
+        if self.error is None and not self.finished:
+            self._fail(MultipartError("Truncated multipart/{}".format(self.subtype), self.bytes_received), events)
+        return events
+
+    def fail(self, error):
+        """
+        Stops the parser at ``error`` detected around it, for example by a decoder
+        :arg error: a `MultipartError`
+        :returns: a list of events, the `ParseError` or nothing if the parser has stopped already
+        """
+        events = []
+        if self.error is None:
+            self._fail(error, events)
+        return events
+
+    def _append_to_buffer(self, chunk):
+        if self._buffer_offset == len(self._buffer) and isinstance(chunk, bytes):
+            # nothing is pending, so the chunk itself becomes the buffer
+            self._buffer = chunk
+            self._buffer_offset = 0
+            self._buffer_frozen = True
+            return
+
+        if self._buffer_frozen:
+            self._buffer = bytearray(memoryview(self._buffer)[self._buffer_offset:])
+            self._buffer_offset = 0
+            self._buffer_frozen = False
+        elif self._buffer_offset >= BUFFER_COMPACT_SIZE and self._buffer_offset * 2 >= len(self._buffer):
+            del self._buffer[:self._buffer_offset]
+            self._buffer_offset = 0
+        self._buffer += chunk
+
+    def _data(self, buffer, start, end):
+        if self.copy_data:
+            return bytes(buffer[start:end])
+        if buffer is self._buffer:
+            self._buffer_frozen = True
+        return memoryview(buffer)[start:end]
+
+    def _body_offset(self, buffer_offset):
+        """Returns the offset in the body of ``buffer_offset``, the buffer always ends with the last chunk"""
+        return self.bytes_received - len(self._buffer) + buffer_offset
+
+    def _fail(self, error, events):
+        if error.phase is None:
+            error.phase = self.phase
+        self.error = error
+        self.phase = PHASE_ERROR
+        events.append(ParseError(error))
+
+    def _fail_invalid(self, message, buffer_offset, events):
+        self._fail(MultipartError(message, self._body_offset(buffer_offset)), events)
+
+    def _part_data(self, data, events):
+        """Appends the events of part data, returns False if it exceeds ``max_part_size``"""
+        self._part_size += len(data)
+        if self.max_part_size is not None and self._part_size > self.max_part_size:
+            self._fail(MultipartLimitError(
+                "max_part_size", self.max_part_size, self._part_data_start + self.max_part_size
+            ), events)
+            return False
+        if self._field is None:
+            events.append(PartData(data))
+            return True
+
+        headers, value = self._field
+        value += data
+        if len(value) > self.max_field_size:
+            # too large for a field, report it as a part
+            self._field = None
+            events.append(PartStart(headers, headers.disp_params))
+            events.append(PartData(self._data(value, 0, len(value))))
+        return True
+
+    def _part_end(self, events):
+        if self._field is None:
+            events.append(PartEnd())
+            return
+        headers, value = self._field
+        self._field = None
+        self.fields.setdefault(headers.disp_params.get("name", ""), []).append(bytes(value))
+
+    def _form_end(self, events):
+        self.finished = True
+        events.append(FormEnd(self.fields))
+
+    def _parse(self, events):
+        while True:
+            buffer = self._buffer
+            offset = self._buffer_offset
+
+            if self.phase == PHASE_BOUNDARY:
+                if len(buffer) - offset > len(self._boundary_delimiter):
+                    if buffer.startswith(self._boundary_delimiter, offset):
+                        self.phase = PHASE_HEADERS
+                        offset += len(self._boundary_delimiter)
+                        self._buffer_offset = offset
+                    elif buffer.startswith(self._end_boundary, offset):
+                        self.phase = PHASE_FINISHED
+                        self._form_end(events)
+                        continue
+                    else:
+                        self._fail_invalid("Invalid multipart/{}".format(self.subtype), offset, events)
+                        return
+                else:
+                    # wait for next chunk
+                    return
+
+            if self.phase == PHASE_HEADERS:
+                headers_end = scanner.find_headers_end(buffer, offset)
+                if not self._form_data and buffer.startswith(b"\r\n", offset):
+                    # a part without headers, the delimiter line ends with the blank line's CRLF
+                    headers_end = offset - 2
+                if self.max_header_size is not None:
+                    header_size = (len(buffer) if headers_end == -1 else headers_end) - offset
+                    if header_size > self.max_header_size:
+                        self._fail(MultipartLimitError(
+                            "max_header_size", self.max_header_size, self._body_offset(offset) + self.max_header_size
+                        ), events)
+                        return
+                if headers_end == -1:
+                    # wait for all headers for current part
+                    return
+                self.parts_received += 1
+                if self.max_parts is not None and self.parts_received > self.max_parts:
+                    self._fail(MultipartLimitError("max_parts", self.max_parts, self._body_offset(offset)), events)
+                    return
+                if headers_end == offset:
+                    self._fail_invalid("multipart/{} missing headers".format(self.subtype), offset, events)
+                    return
+                headers = parse_part_headers(buffer[offset:headers_end])
+                if self._form_data and headers.disposition != "form-data":
+                    self._fail_invalid("Invalid multipart/form-data", offset, events)
+                    return
+
+                offset = headers_end + 4
+                self._buffer_offset = offset
+                self.phase = PHASE_BODY
+                self._part_headers = headers
+                self._part_size = 0
+                self._part_data_start = self._body_offset(offset)
+                if self.collect_fields and "filename" not in headers.disp_params:
+                    self._field = (headers, bytearray())
+                else:
+                    events.append(PartStart(headers, headers.disp_params))
+
+            if self.phase == PHASE_BODY:
+                scan_result, data_end, next_offset = scanner.scan_body(buffer, self._part_delimiter, offset)
+                self._buffer_offset = next_offset
+                if scan_result == BODY_DATA:
+                    if data_end > offset:
+                        self._part_data(self._data(buffer, offset, data_end), events)
+                    return
+
+                if not self._part_data(self._data(buffer, offset, data_end), events):
+                    return
+                if scan_result == BODY_PART_END:
+                    self.phase = PHASE_HEADERS
+                    self._part_end(events)
+                    continue
+                self.phase = PHASE_FINISHED
+                self._part_end(events)
+                self._form_end(events)
+                continue
+
+            if self.phase == PHASE_FINISHED:
+                # ignore the epilogue
+                self._buffer_offset = len(buffer)
+                return
+
+            return
+
+
+class RawParser(object):
+    """
+    Incremental parser of a body that is not multipart, like an application/octet-stream upload
+
+    The body is reported as a single part with ``headers``, it ends once ``length``
+    bytes have been fed or when `finish` is called. The events, attributes and
+    checkpoints are those of `MultipartParser`.
+    """
+
+    def __init__(self, headers=None, length=None, copy_data=False, max_body_size=None):
+        """
+        :arg headers: `.headers.PartHeaders` of the part, like the Content-Type of the request
+        :arg length: length of the body if it is known in advance, like the Content-Length
+        :arg copy_data: return `bytes` in `PartData` instead of `memoryview` of the chunks
+        :arg max_body_size: limit of the size in bytes of the body
+        """
+        self.headers = headers if headers is not None else PartHeaders(())
+        self.length = length
+        self.copy_data = copy_data
+        self.max_body_size = max_body_size
+        self.phase = PHASE_BOUNDARY
+        self.finished = False
+        self.error = None
+        self.fields = {}
+        self.bytes_received = 0
+        self.parts_received = 0
+        self.buffered = 0
+
+    @property
+    def current_part(self):
+        """``(headers, size)`` of the body if its data is being received, None otherwise"""
+        if self.phase != PHASE_BODY:
+            return None
+        return self.headers, self.bytes_received
+
+    def feed(self, data):
+        """
+        Passes on a chunk of the body
+        :arg data: `bytes` or another buffer
+        :returns: a list of `Event`
+        """
+        events = []
+        if self.error is not None or self.finished:
+            return events
+        self.bytes_received += len(data)
+        if self.max_body_size is not None and self.bytes_received > self.max_body_size:
+            self._fail(MultipartLimitError("max_body_size", self.max_body_size, self.max_body_size), events)
+            return events
+        if self.length is not None and self.bytes_received > self.length:
+            self._fail(MultipartError("Body longer than {} bytes".format(self.length), self.length), events)
+            return events
+        self._start(events)
+        if len(data):
+            if not isinstance(data, bytes):
+                # the caller may reuse its buffer
+                data = bytes(data)
+            events.append(PartData(data if self.copy_data else memoryview(data)))
+        if self.length is not None and self.bytes_received == self.length:
+            self._end(events)
+        return events
+
+    def finish(self):
+        """
+        Called once the whole body has been fed
+        :returns: a list of events, a `ParseError` if it is shorter than ``length``
+        """
+        events = []
+        if self.error is not None or self.finished:
+            return events
+        if self.length is not None and self.bytes_received < self.length:
+            self._fail(MultipartError("Truncated body", self.bytes_received), events)
+            return events
+        self._start(events)
+        self._end(events)
+        return events
+
+    def fail(self, error):
+        """See `MultipartParser.fail`"""
+        events = []
+        if self.error is None:
+            self._fail(error, events)
+        return events
+
+    def checkpoint(self):
+        """See `MultipartParser.checkpoint`"""
+        if self.error is not None:
+            raise ValueError("a parser stopped at an error can not be checkpointed")
+        return json.dumps({
+            "version": CHECKPOINT_VERSION,
+            "raw": True,
+            "phase": self.phase,
+            "finished": self.finished,
+            "bytes_received": self.bytes_received,
+        }, sort_keys=True).encode("utf-8")
+
+    @classmethod
+    def restore(cls, checkpoint, **kwargs):
+        """See `MultipartParser.restore`"""
+        try:
+            state = json.loads(checkpoint.decode("utf-8"))
+            if state["version"] != CHECKPOINT_VERSION or not state.get("raw"):
+                raise ValueError("unsupported checkpoint")
+            parser = cls(**kwargs)
+            parser.phase = state["phase"]
+            parser.finished = state["finished"]
+            parser.bytes_received = state["bytes_received"]
+            parser.parts_received = 1 if parser.phase != PHASE_BOUNDARY else 0
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError("invalid checkpoint: {!r}".format(e))
+        return parser
+
+    def _start(self, events):
+        if self.phase == PHASE_BOUNDARY:
+            self.phase = PHASE_BODY
+            self.parts_received = 1
+            events.append(PartStart(self.headers, self.headers.disp_params))
+
+    def _end(self, events):
+        self.phase = PHASE_FINISHED
+        self.finished = True
+        events.append(PartEnd())
+        events.append(FormEnd(self.fields))
+
+    def _fail(self, error, events):
+        if error.phase is None:
+            error.phase = self.phase
+        self.error = error
+        self.phase = PHASE_ERROR
+        events.append(ParseError(error))
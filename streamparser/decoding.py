@@ -0,0 +1,255 @@
+"""
+Incremental decoders of HTTP content codings
+
+A decoder is fed encoded data and returns iterators of decoded pieces of at most
+`DECODE_CHUNK_SIZE` bytes, a piece is only decoded once the previous one has been
+consumed, so decoding takes constant memory however large the output gets.
+"""
+
+import collections
+import struct
+import zlib
+
+from .core import MultipartError
+from .core import MultipartLimitError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DECODE_CHUNK_SIZE = 64 * 1024
+
+# input read by a zstd decompressor at once
+ZSTD_INPUT_SIZE = 8 * 1024
+# largest zstd window accepted, the decompressor allocates a buffer of the window size
+ZSTD_MAX_WINDOW_SIZE = 8 * 1024 * 1024
+
+
+class Decoder(object):
+    """
+    Base class of the decoders
+
+    ``max_size`` limits the size in bytes of the decoded data and ``max_ratio`` the
+    ratio of decoded to encoded bytes received so far, exceeding either raises
+    `.MultipartLimitError`. Invalid data raises `.MultipartError`.
+
+    Subclasses implement ``_decode(data)`` and ``_finish()``, generators behind
+    `decode` and `finish` passing every decoded piece through `_decoded`.
+    """
+
+    name = None
+
+    def __init__(self, max_size=None, max_ratio=None):
+        """
+        :arg max_size: limit of the size in bytes of the decoded data
+        :arg max_ratio: limit of the ratio of decoded to encoded bytes
+        """
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def decode(self, data):
+        """
+        Returns an iterator of the pieces of ``data`` decoded
+        :arg data: encoded data
+        """
+        self.bytes_in += len(data)
+        return self._decode(data)
+
+    def finish(self):
+        """
+        Returns an iterator of the remaining decoded pieces once all data has been fed,
+        raises `.MultipartError` from it if the encoded data is truncated
+        """
+        return self._finish()
+
+    def _decoded(self, piece):
+        """Counts a decoded piece and returns it, raises `.MultipartLimitError` if it exceeds a limit"""
+        self.bytes_out += len(piece)
+        if self.max_size is not None and self.bytes_out > self.max_size:
+            raise MultipartLimitError("max_decoded_size", self.max_size)
+        if self.max_ratio is not None and self.bytes_out > self.bytes_in * self.max_ratio:
+            raise MultipartLimitError("max_decompression_ratio", self.max_ratio)
+        return piece
+
+
+class ZlibDecoder(Decoder):
+    """Decoder of the ``gzip`` and ``deflate`` codings"""
+
+    WBITS = {"gzip": 16 + zlib.MAX_WBITS, "x-gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+    def __init__(self, name, max_size=None, max_ratio=None):
+        super(ZlibDecoder, self).__init__(max_size, max_ratio)
+        self.name = name
+        self._decompressor = zlib.decompressobj(self.WBITS[name])
+
+    def _decode(self, data):
+        decompressor = self._decompressor
+        while not decompressor.eof:
+            try:
+                piece = decompressor.decompress(data, DECODE_CHUNK_SIZE)
+            except zlib.error as e:
+                raise MultipartError("Invalid {} data: {}".format(self.name, e))
+            data = decompressor.unconsumed_tail
+            if piece:
+                yield self._decoded(piece)
+            if not data and len(piece) < DECODE_CHUNK_SIZE:
+                # the input is consumed and no output is pending
+                return
+
+    def _finish(self):
+        for piece in self._decode(b""):
+            yield piece
+        if not self._decompressor.eof:
+            raise MultipartError("Truncated {} data".format(self.name))
+
+
+class _Starved(Exception):
+    """Raised by `_ZstdInput` when all data fed so far has been read"""
+
+
+class _ZstdInput(object):
+    """
+    Source of a zstd stream reader fed data as it is received, it raises `_Starved`
+    instead of returning the empty `bytes` that would end the stream
+    """
+
+    def __init__(self):
+        self._pieces = collections.deque()
+
+    def append(self, data):
+        if len(data):
+            self._pieces.append(data)
+
+    def read(self, size):
+        if not self._pieces:
+            raise _Starved()
+        piece = self._pieces.popleft()
+        if len(piece) > size:
+            self._pieces.appendleft(piece[size:])
+            piece = piece[:size]
+        return bytes(piece)
+
+
+class _ZstdFrame(object):
+    """
+    Follows the header and block headers of a zstd frame through the encoded data to
+    tell where the frame ends, the stream reader does not tell it
+    """
+
+    MAGIC = b"\x28\xb5\x2f\xfd"
+
+    def __init__(self):
+        self.eof = False
+        self._header = bytearray()
+        self._need = 5
+        self._skip = 0
+        self._state = "magic"
+        self._checksum = False
+
+    def feed(self, data):
+        """Returns the number of bytes of ``data`` up to the end of the frame"""
+        view = memoryview(data)
+        position = 0
+        while position < len(view) and not self.eof:
+            if self._skip:
+                skipped = min(self._skip, len(view) - position)
+                self._skip -= skipped
+                position += skipped
+                if not self._skip and self._state == "checksum":
+                    self.eof = True
+                continue
+            taken = min(self._need - len(self._header), len(view) - position)
+            self._header += view[position:position + taken]
+            position += taken
+            if len(self._header) == self._need:
+                self._header_done()
+        return position
+
+    def _header_done(self):
+        header = bytes(self._header)
+        self._header = bytearray()
+        if self._state == "magic":
+            if header[:4] != self.MAGIC:
+                # the reader raises for it
+                self._state = "invalid"
+                self._need = 1
+                return
+            descriptor = bytearray(header)[4]
+            single_segment = descriptor >> 5 & 1
+            self._checksum = bool(descriptor >> 2 & 1)
+            size = ((0 if single_segment else 1) + (0, 1, 2, 4)[descriptor & 3] +
+                    (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6])
+            self._skip = size
+            self._need = 3
+            self._state = "block"
+        elif self._state == "block":
+            block = struct.unpack("<I", header + b"\0")[0]
+            block_type = block >> 1 & 3
+            self._skip = 1 if block_type == 1 else block >> 3
+            if block & 1:
+                self._state = "checksum"
+                self._skip += 4 if self._checksum else 0
+                if not self._skip:
+                    self.eof = True
+
+
+class ZstdDecoder(Decoder):
+    """
+    Decoder of the ``zstd`` coding, requires the zstandard package
+
+    Every read of the stream reader is bounded to `DECODE_CHUNK_SIZE` bytes of output, so
+    the limits are checked before more is decoded. Frames with a window larger than
+    `ZSTD_MAX_WINDOW_SIZE` are rejected as invalid data. Data after the first frame
+    is ignored.
+    """
+
+    name = "zstd"
+
+    def __init__(self, max_size=None, max_ratio=None):
+        super(ZstdDecoder, self).__init__(max_size, max_ratio)
+        self._input = _ZstdInput()
+        self._frame = _ZstdFrame()
+        decompressor = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW_SIZE)
+        self._reader = decompressor.stream_reader(self._input, read_size=ZSTD_INPUT_SIZE)
+
+    def _decode(self, data):
+        if not self._frame.eof:
+            self._input.append(data[:self._frame.feed(data)])
+        while True:
+            try:
+                piece = self._reader.read1(DECODE_CHUNK_SIZE)
+            except _Starved:
+                return
+            except zstandard.ZstdError as e:
+                raise MultipartError("Invalid zstd data: {}".format(e))
+            if not piece:
+                return
+            yield self._decoded(piece)
+
+    def _finish(self):
+        for piece in self._decode(b""):
+            yield piece
+        if not self._frame.eof:
+            raise MultipartError("Truncated zstd data")
+
+
+def get_decoder(encoding, max_size=None, max_ratio=None):
+    """
+    Returns a `Decoder` of a Content-Encoding header value, None for ``identity``
+    :arg encoding: the content coding name
+    :arg max_size: see `Decoder`
+    :arg max_ratio: see `Decoder`
+
+    :raises: ValueError for a coding that is not supported
+    """
+    encoding = encoding.strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ZlibDecoder.WBITS:
+        return ZlibDecoder(encoding, max_size, max_ratio)
+    if encoding == "zstd" and zstandard is not None:
+        return ZstdDecoder(max_size, max_ratio)
+    raise ValueError("unsupported Content-Encoding {}".format(encoding))
@@ -0,0 +1,598 @@
+import collections
+import functools
+import io
+import os
+import tempfile
+
+from tornado.concurrent import Future
+from tornado.gen import convert_yielded
+from tornado.gen import coroutine
+from tornado.gen import multi
+from tornado.ioloop import IOLoop
+
+from ._compat import isawaitable
+from ._serial import SerialExecutor
+from .streamparser import StreamingFormDataParserDelegate
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    # py37-
+    SharedMemory = None
+
+
+def _write_all(fd, data):
+    """Writes the whole of ``data`` to the file descriptor ``fd``"""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+class SpooledPart(object):
+    """
+    A part received by `.SpooledFileDelegate`
+
+    Its data is kept in memory while it is small, ``path`` is the temporary file
+    it was spilled to otherwise. ``digests`` are the digests passed to ``finish_file``
+    by a parser created with ``hashers``.
+    """
+
+    def __init__(self, headers, disp_params):
+        self.headers = headers
+        self.disp_params = disp_params
+        self.size = 0
+        self.path = None
+        self.digests = None
+        self._data = bytearray()
+
+    @property
+    def name(self):
+        return self.disp_params.get("name")
+
+    @property
+    def filename(self):
+        return self.disp_params.get("filename")
+
+    @property
+    def in_memory(self):
+        return self.path is None
+
+    def open(self):
+        """Returns a binary file object to read the part data from"""
+        if self.path is None:
+            return io.BytesIO(self._data)
+        return open(self.path, "rb")
+
+    def read(self):
+        """Returns the part data as bytes"""
+        if self.path is None:
+            return bytes(self._data)
+        with self.open() as f:
+            return f.read()
+
+    def remove(self):
+        """Removes the temporary file of a spilled part"""
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SpooledFileDelegate(StreamingFormDataParserDelegate):
+    """
+    `.StreamingFormDataParserDelegate` keeping parts in memory until they get larger
+    than ``max_memory_size``, then spilling them to temporary files
+
+    Received parts are appended to ``parts`` as `.SpooledPart` objects. Temporary files
+    are not removed by the delegate, call `cleanup` when they are no longer needed.
+    """
+
+    def __init__(self, max_memory_size=1024 * 1024, dir=None, prefix="streamparser-"):
+        """
+        :arg max_memory_size: size in bytes up to which a part is kept in memory
+        :arg dir: directory for temporary files, see `tempfile.mkstemp`
+        :arg prefix: prefix of temporary file names
+        """
+        self.max_memory_size = max_memory_size
+        self.dir = dir
+        self.prefix = prefix
+        self.parts = []
+        self.current_part = None
+        self._fd = None
+
+    def start_file(self, headers, disp_params):
+        self._close_file()
+        self.current_part = SpooledPart(headers, disp_params)
+
+    def file_data_received(self, file_data):
+        part = self.current_part
+        if part is None:
+            return
+        if self._fd is None and part.size + len(file_data) > self.max_memory_size:
+            self._fd, part.path = tempfile.mkstemp(prefix=self.prefix, dir=self.dir)
+            _write_all(self._fd, part._data)
+            part._data = bytearray()
+
+        if self._fd is None:
+            part._data += file_data
+        else:
+            _write_all(self._fd, file_data)
+        part.size += len(file_data)
+
+    def finish_file(self, digests=None):
+        if self.current_part is None:
+            return
+        self.current_part.digests = digests
+        self._close_file()
+        self.parts.append(self.current_part)
+        self.current_part = None
+
+    def cleanup(self):
+        """Removes temporary files of all parts"""
+        self._close_file()
+        for part in self.parts:
+            part.remove()
+        if self.current_part is not None:
+            self.current_part.remove()
+
+    def _close_file(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class ThreadPoolDelegate(StreamingFormDataParserDelegate):
+    """
+    Calls methods of a delegate doing blocking work, like writing to local files,
+    on a thread pool so that they do not block the IOLoop
+
+    Methods of the wrapped delegate are called one at a time in the order the
+    parser calls them. `file_data_received` returns None while no more than
+    ``max_pending`` calls are queued and a future resolved when the queue has room
+    again otherwise, so a slow disk pauses the parser instead of growing memory.
+    `finish_file` returns a future resolved when the wrapped ``finish_file`` is done.
+    Once a call fails the queued calls are dropped, so no data is written past the
+    failed write, and the error is raised to the parser.
+
+    `resume_file`, `on_error` and `form_fields_received` are queued like the other calls.
+    `~.StreamingFormDataParserDelegate.file_descriptor` is not passed on, a descriptor
+    would be written to by the parser while calls are still queued.
+    """
+
+    DEFAULT_THREADS = 4
+
+    _default_executor = None
+
+    def __init__(self, delegate, executor=None, max_pending=16):
+        """
+        :arg delegate: the wrapped `.StreamingFormDataParserDelegate`
+        :arg executor: a `concurrent.futures.ThreadPoolExecutor`, an executor with
+            `DEFAULT_THREADS` threads shared by all instances by default
+        :arg max_pending: number of queued calls above which the parser is paused
+        """
+        if executor is None:
+            executor = self.default_executor()
+        self.delegate = delegate
+        self._serial = SerialExecutor(executor, max_pending)
+
+    @classmethod
+    def default_executor(cls):
+        if cls._default_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            ThreadPoolDelegate._default_executor = ThreadPoolExecutor(cls.DEFAULT_THREADS)
+        return cls._default_executor
+
+    @property
+    def pending(self):
+        """Number of queued calls of the wrapped delegate"""
+        return self._serial.pending
+
+    def start_file(self, headers, disp_params):
+        self._serial.post(self.delegate.start_file, headers, disp_params)
+        return self._serial.wait_for_capacity()
+
+    def file_data_received(self, file_data):
+        self._serial.post(self.delegate.file_data_received, file_data)
+        return self._serial.wait_for_capacity()
+
+    def finish_file(self, **kwargs):
+        self._serial.post(functools.partial(self.delegate.finish_file, **kwargs))
+        return self._serial.flush()
+
+    def resume_file(self, headers, disp_params, size):
+        self._serial.post(self.delegate.resume_file, headers, disp_params, size)
+        return self._serial.wait_for_capacity()
+
+    def on_error(self, error):
+        self._serial.post(self.delegate.on_error, error)
+
+    def form_fields_received(self, fields):
+        self._serial.post(self.delegate.form_fields_received, fields)
+        return self._serial.flush()
+
+
+class PartProcessor(object):
+    """
+    CPU-bound work on a part's data run by `.ProcessPoolDelegate` in worker processes
+
+    The processor is pickled to a worker process with every batch of data and the
+    updated processor is pickled back, so all of its state must be picklable.
+    """
+
+    def process(self, data):
+        """
+        Called in a worker process with the next batch of the part's data
+        :arg data: a `memoryview` (or `bytearray`), only valid during the call
+        """
+        pass
+
+    def finish(self):
+        """
+        Called in a worker process once the part has been received
+        :returns: the picklable result passed to the delegate's ``finish_file``
+        """
+        pass
+
+
+def _process_batch(processor, batch):
+    if not isinstance(batch, tuple):
+        processor.process(batch)
+        return processor
+
+    name, size = batch
+    block = SharedMemory(name=name)
+    try:
+        view = block.buf[:size]
+        try:
+            processor.process(view)
+        finally:
+            view.release()
+    finally:
+        block.close()
+    return processor
+
+
+def _finish_processor(processor):
+    return processor.finish()
+
+
+class ProcessPoolDelegate(StreamingFormDataParserDelegate):
+    """
+    Runs CPU-bound work on parts, like compression or scanning, on a process pool
+    while passing them on to a delegate
+
+    ``processor_factory`` is called with the headers and content disposition parameters
+    of every part and returns a `.PartProcessor` (or None to leave the part alone).
+    The part's data is gathered into batches of ``batch_size`` bytes which are processed
+    one at a time, in order, on ``executor``. Batches are passed in shared memory when
+    `multiprocessing.shared_memory` is available and pickled otherwise.
+
+    The wrapped delegate gets every call as usual. Once all batches of a part with a
+    processor are done its ``finish_file`` is called with a ``result`` keyword argument,
+    the result of `.PartProcessor.finish`, parts without a processor are finished without
+    it. A part resumed from a checkpoint has no processor, as the data received before
+    the checkpoint can not be processed anymore. `file_data_received` returns a future
+    when more than ``max_pending`` batches are queued, pausing the parser.
+
+    When the parser stops at an error `on_error` drops the batches of the current part
+    and releases their shared memory before passing the error on. Call `close` to do the
+    same for an upload abandoned otherwise, like when the connection is closed.
+    """
+
+    DEFAULT_BATCH_SIZE = 1024 * 1024
+
+    _default_executor = None
+
+    def __init__(self, delegate, processor_factory, executor=None, batch_size=DEFAULT_BATCH_SIZE,
+                 max_pending=4, shared_memory=True):
+        """
+        :arg delegate: the wrapped `.StreamingFormDataParserDelegate`
+        :arg processor_factory: callable returning a `.PartProcessor` or None for
+            ``(headers, disp_params)`` of a part
+        :arg executor: a `concurrent.futures.ProcessPoolExecutor`, one shared by all
+            instances by default
+        :arg batch_size: size in bytes of the data passed to a worker at once
+        :arg max_pending: number of queued batches above which the parser is paused
+        :arg shared_memory: pass batches in shared memory when it is available
+        """
+        if executor is None:
+            executor = self.default_executor()
+        self.delegate = delegate
+        self.processor_factory = processor_factory
+        self.executor = executor
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.shared_memory = shared_memory and SharedMemory is not None
+        self.error = None
+        self._processor = None
+        self._block = None
+        self._batch = None
+        self._batch_size = 0
+        self._batches = collections.deque()
+        self._running = None
+        self._waiters = []
+
+    @classmethod
+    def default_executor(cls):
+        if cls._default_executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            ProcessPoolDelegate._default_executor = ProcessPoolExecutor()
+        return cls._default_executor
+
+    @property
+    def pending(self):
+        """Number of queued batches of the current part"""
+        return len(self._batches) + (self._running is not None)
+
+    def start_file(self, headers, disp_params):
+        self._processor = self.processor_factory(headers, disp_params)
+        return self.delegate.start_file(headers, disp_params)
+
+    def resume_file(self, headers, disp_params, size):
+        # the processor would miss the data received before the checkpoint
+        self._processor = None
+        return self.delegate.resume_file(headers, disp_params, size)
+
+    def file_data_received(self, file_data):
+        result = self.delegate.file_data_received(file_data)
+        if self._processor is None:
+            return result
+
+        view = memoryview(file_data)
+        while view:
+            if self._batch is None:
+                self._new_batch()
+            size = min(len(view), self.batch_size - self._batch_size)
+            self._batch[self._batch_size:self._batch_size + size] = view[:size]
+            self._batch_size += size
+            view = view[size:]
+            if self._batch_size == self.batch_size:
+                self._queue_batch()
+
+        waiting = self._wait_for_batches(self.max_pending)
+        if waiting is None:
+            return result
+        if not isawaitable(result):
+            return waiting
+        return multi([convert_yielded(result), waiting])
+
+    @coroutine
+    def finish_file(self, **kwargs):
+        if self._processor is not None:
+            if self._batch_size:
+                self._queue_batch()
+            self._release_batch()
+            waiting = self._wait_for_batches(0)
+            if waiting is not None:
+                yield waiting
+            processor = self._processor
+            self._processor = None
+            kwargs["result"] = yield self.executor.submit(_finish_processor, processor)
+        finished = self.delegate.finish_file(**kwargs)
+        if isawaitable(finished):
+            yield finished
+
+    def on_error(self, error):
+        self.close()
+        self.delegate.on_error(error)
+
+    def form_fields_received(self, fields):
+        return self.delegate.form_fields_received(fields)
+
+    def close(self):
+        """
+        Drops the current part's batches that are not being processed, releasing their
+        shared memory, the one being processed is released when it is done
+        """
+        self._processor = None
+        self._release_batch()
+        self._drop_batches()
+
+    def _new_batch(self):
+        if self.shared_memory:
+            self._block = SharedMemory(create=True, size=self.batch_size)
+            self._batch = self._block.buf
+        else:
+            self._batch = bytearray(self.batch_size)
+        self._batch_size = 0
+
+    def _release_batch(self):
+        if self._block is not None:
+            self._batch.release()
+            self._block.close()
+            self._block.unlink()
+        self._block = None
+        self._batch = None
+        self._batch_size = 0
+
+    def _queue_batch(self):
+        if self._block is not None:
+            self._batches.append((self._block, (self._block.name, self._batch_size)))
+            self._batch.release()
+        else:
+            batch = self._batch
+            if self._batch_size < len(batch):
+                batch = batch[:self._batch_size]
+            self._batches.append((None, batch))
+        self._block = None
+        self._batch = None
+        self._batch_size = 0
+        if self._running is None:
+            self._run_next()
+
+    def _run_next(self):
+        self._running = self._batches.popleft()
+        block, batch = self._running
+        IOLoop.current().add_future(self.executor.submit(_process_batch, self._processor, batch), self._batch_done)
+
+    def _batch_done(self, future):
+        block, _ = self._running
+        self._running = None
+        if block is not None:
+            block.close()
+            block.unlink()
+        if future.exception() is not None:
+            if self.error is None:
+                self.error = future.exception()
+            self._drop_batches()
+        elif self._processor is not None:
+            # the processor is None if the part was dropped by `close`
+            self._processor = future.result()
+            if self._batches:
+                self._run_next()
+
+        waiters = self._waiters
+        self._waiters = []
+        for max_pending, waiter in waiters:
+            if self.error is not None:
+                waiter.set_exception(self.error)
+            elif self.pending <= max_pending:
+                waiter.set_result(None)
+            else:
+                self._waiters.append((max_pending, waiter))
+
+    def _drop_batches(self):
+        while self._batches:
+            block, _ = self._batches.popleft()
+            if block is not None:
+                block.close()
+                block.unlink()
+
+    def _wait_for_batches(self, max_pending):
+        """Returns a future resolved when no more than ``max_pending`` batches are queued, None if they are not"""
+        if self.error is not None:
+            raise self.error
+        if self.pending <= max_pending:
+            return None
+        waiter = Future()
+        self._waiters.append((max_pending, waiter))
+        return waiter
+
+
+class RouterDelegate(StreamingFormDataParserDelegate):
+    """
+    Passes every part to a sink, a `.StreamingFormDataParserDelegate`, chosen by its
+    name or content type, each sink with a queue of its own
+
+    Calls of a sink are made one at a time, in order, awaiting the futures it returns.
+    The parser only waits for a sink when more than ``max_pending`` of its calls are
+    queued, `finish_file` never waits, so the next part streams to its sink while
+    the sink of the previous one is still busy. Call `flush` once the form has been
+    parsed to wait until all sinks are done.
+
+    A part is routed by its name in ``names``, else by its content type in
+    ``content_types`` (``"image/png"`` or ``"image/*"``), else to ``default``.
+    Parts without a sink are skipped, a resumed part is routed like a started one.
+    Collected fields are passed to ``default``. The first error of a sink is raised
+    from the next call of the router. A parse error is queued to every sink that got
+    a part, after the calls queued before it.
+    """
+
+    def __init__(self, names=None, content_types=None, default=None, max_pending=16):
+        """
+        :arg names: dict of part names to sinks
+        :arg content_types: dict of content types or ``type/*`` patterns to sinks
+        :arg default: sink of the parts not routed otherwise, None to skip them
+        :arg max_pending: number of queued calls of a sink above which the parser is paused
+        """
+        self.names = names or {}
+        self.content_types = content_types or {}
+        self.default = default
+        self.max_pending = max_pending
+        self._queues = {}
+        self._routed = {}
+        self._sink = None
+        self._queue = None
+
+    @property
+    def pending(self):
+        """Number of queued calls of all sinks"""
+        return sum(queue.pending for queue in self._queues.values())
+
+    @property
+    def error(self):
+        """The first error of a sink or None"""
+        for queue in self._queues.values():
+            if queue.error is not None:
+                return queue.error
+        return None
+
+    def route(self, headers, disp_params):
+        """Returns the sink of a part, None to skip it"""
+        sink = self.names.get(disp_params.get("name"))
+        if sink is not None:
+            return sink
+        content_type = (headers.get("Content-Type") or "").partition(";")[0].strip().lower()
+        if content_type:
+            sink = self.content_types.get(content_type)
+            if sink is None:
+                sink = self.content_types.get(content_type.partition("/")[0] + "/*")
+            if sink is not None:
+                return sink
+        return self.default
+
+    def start_file(self, headers, disp_params):
+        return self._route_file(headers, disp_params, "start_file", headers, disp_params)
+
+    def resume_file(self, headers, disp_params, size):
+        return self._route_file(headers, disp_params, "resume_file", headers, disp_params, size)
+
+    def file_data_received(self, file_data):
+        if self._queue is None:
+            return None
+        self._queue.post(self._sink.file_data_received, file_data)
+        return self._queue.wait_for_capacity()
+
+    def finish_file(self, **kwargs):
+        if self._queue is not None:
+            self._queue.post(functools.partial(self._sink.finish_file, **kwargs))
+            self._sink = None
+            self._queue = None
+        self._raise_error()
+
+    def on_error(self, error):
+        for key, queue in self._queues.items():
+            sink = self._routed[key]
+            if queue.error is None:
+                queue.post(sink.on_error, error)
+            else:
+                # the sink's queued calls have been dropped already
+                sink.on_error(error)
+
+    def form_fields_received(self, fields):
+        self._raise_error()
+        if self.default is None:
+            return None
+        queue = self._queue_of(self.default)
+        queue.post(self.default.form_fields_received, fields)
+        return queue.wait_for_capacity()
+
+    @coroutine
+    def flush(self):
+        """Returns a future resolved when the calls of all sinks are done, raising the first error of a sink"""
+        for queue in list(self._queues.values()):
+            waiting = queue.flush()
+            if waiting is not None:
+                yield waiting
+
+    def _route_file(self, headers, disp_params, method, *args):
+        """Routes a part started or resumed with ``method`` of its sink"""
+        self._raise_error()
+        self._sink = self.route(headers, disp_params)
+        if self._sink is None:
+            self._queue = None
+            return None
+        self._queue = self._queue_of(self._sink)
+        self._queue.post(getattr(self._sink, method), *args)
+        return self._queue.wait_for_capacity()
+
+    def _queue_of(self, sink):
+        queue = self._queues.get(id(sink))
+        if queue is None:
+            queue = self._queues[id(sink)] = SerialExecutor(None, self.max_pending)
+            self._routed[id(sink)] = sink
+        return queue
+
+    def _raise_error(self):
+        error = self.error
+        if error is not None:
+            raise error
@@ -0,0 +1,162 @@
+"""
+Request handler mixin streaming uploads to `.StreamingFormDataParser`
+"""
+from tornado.gen import Return
+from tornado.gen import coroutine
+from tornado.gen import is_future
+
+from .core import MultipartError
+from .core import MultipartLimitError
+from .streamparser import StreamingFormDataParser
+from .streamparser import StreamingFormDataParserDelegate
+
+
+class StreamingUploadMixin(StreamingFormDataParserDelegate):
+    """
+    Parses the body of a `tornado.web.RequestHandler` decorated with
+    `tornado.web.stream_request_body` as it is received, the handler is the
+    `.StreamingFormDataParserDelegate` unless `get_upload_delegate` returns another one::
+
+        @stream_request_body
+        class UploadHandler(StreamingUploadMixin, RequestHandler):
+
+            upload_max_body_size = 1024 ** 3
+
+            def start_file(self, headers, disp_params):
+                ...
+
+            @coroutine
+            def post(self):
+                if (yield self.finish_upload()):
+                    self.write({"result": "ok"})
+
+    `prepare` sets the connection's body size limit to ``upload_max_body_size`` (Tornado's
+    ``max_body_size`` of 100 MB applies otherwise) and rejects a larger Content-Length before
+    reading the body, Tornado closes the connection of a chunked body exceeding it.
+    ``upload_max_buffer_size`` bounds the file data of pending
+    `~.StreamingFormDataParserDelegate.file_data_received` calls (the parser's
+    ``max_bytes_in_flight``), which are still made one at a time and in order, so an
+    ``async def file_data_received`` awaiting before it writes is safe. `data_received`
+    returns the parser's future while the parser waits for the delegate, so the
+    connection reads no more of the body until it resolves.
+
+    A request is rejected with `reject_upload`, which sends the error response right away:
+    with 415 when the parser can not be created for the request headers, with 413 when
+    a limit is exceeded and with 400 for an invalid or truncated body. The connection is
+    closed without reading the rest of the body then, the handler method is not called and
+    further data is ignored. Override `write_error` to shape the response, it gets the
+    error as the ``upload_error`` keyword argument.
+
+    Other errors raised by the delegate are handled by Tornado like errors of any
+    handler method.
+    """
+
+    #: request methods with a body to parse
+    upload_methods = ("POST", "PUT")
+    #: parser class, `.StreamingFormDataParser` or a subclass
+    upload_parser_class = StreamingFormDataParser
+    #: other keyword arguments of the parser
+    upload_parser_options = {}
+    #: limit of the size in bytes of the body, Tornado's ``max_body_size`` if None
+    upload_max_body_size = None
+    #: limit of the file data in bytes pending in the delegate
+    upload_max_buffer_size = None
+
+    upload_parser = None
+    upload_rejected = False
+
+    def prepare(self):
+        """Creates the parser or rejects the request, call it when overriding ``prepare``"""
+        if self.request.method not in self.upload_methods:
+            return
+        max_body_size = self.upload_max_body_size
+        if max_body_size is not None:
+            set_max_body_size = getattr(self.request.connection, "set_max_body_size", None)
+            if set_max_body_size is not None:
+                set_max_body_size(max_body_size)
+            length = self.request.headers.get("Content-Length")
+            if length is not None and int(length) > max_body_size:
+                self.reject_upload(413, MultipartLimitError("max_body_size", max_body_size))
+                return
+        try:
+            self.upload_parser = self.create_upload_parser()
+        except (KeyError, ValueError) as e:
+            self.reject_upload(415, MultipartError("unsupported request: {}".format(e)))
+
+    def get_upload_delegate(self):
+        """Returns the `.StreamingFormDataParserDelegate` of the parser, the handler by default"""
+        return self
+
+    def create_upload_parser(self):
+        """
+        Returns the parser of the request body
+
+        :raises: KeyError or ValueError for request headers the parser does not support
+        """
+        options = dict(self.upload_parser_options)
+        options.setdefault("max_body_size", self.upload_max_body_size)
+        options.setdefault("max_bytes_in_flight", self.upload_max_buffer_size)
+        return self.upload_parser_class(self.get_upload_delegate(), self.request.headers, **options)
+
+    def reject_upload(self, status_code, error=None):
+        """
+        Rejects the request with ``status_code`` unless it has been rejected already
+        :arg status_code: HTTP status code of the response
+        :arg error: the `.MultipartError` the request is rejected for
+        """
+        if self.upload_rejected:
+            return
+        self.upload_rejected = True
+        self.send_error(status_code, upload_error=error)
+
+    def data_received(self, chunk):
+        """Passes ``chunk`` to the parser, returns a future while the parser waits for the delegate"""
+        if self.upload_parser is None or self.upload_rejected:
+            return None
+        try:
+            result = self.upload_parser.data_received(chunk)
+            if is_future(result) and result.done():
+                result.result()
+                result = None
+        except MultipartError as e:
+            self._reject_upload_error(e)
+            return None
+        if result is None:
+            self._check_upload()
+            return None
+        return self._wait_for_upload(result)
+
+    @coroutine
+    def _wait_for_upload(self, result):
+        try:
+            yield result
+        except MultipartError as e:
+            self._reject_upload_error(e)
+            return
+        self._check_upload()
+
+    @coroutine
+    def finish_upload(self):
+        """
+        Finishes the parser once the whole body has been received, call it from the handler
+        method. Resolves to True if the body has been parsed, to False if the request has been
+        rejected and the response sent.
+        """
+        if self.upload_parser is None or self.upload_rejected:
+            raise Return(False)
+        try:
+            yield self.upload_parser.finish()
+        except MultipartError as e:
+            self._reject_upload_error(e)
+        else:
+            self._check_upload()
+        raise Return(not self.upload_rejected)
+
+    def _check_upload(self):
+        """Rejects the request if the parser stopped at invalid data"""
+        error = self.upload_parser.error
+        if error is not None:
+            self._reject_upload_error(error)
+
+    def _reject_upload_error(self, error):
+        self.reject_upload(413 if isinstance(error, MultipartLimitError) else 400, error)
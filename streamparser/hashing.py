@@ -0,0 +1,52 @@
+import hashlib
+import struct
+import zlib
+
+
+class Crc32(object):
+    """CRC-32 with the `hashlib` hash object interface"""
+
+    name = "crc32"
+    digest_size = 4
+
+    def __init__(self, data=b""):
+        self.value = zlib.crc32(data) & 0xffffffff
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value) & 0xffffffff
+
+    def digest(self):
+        return struct.pack(">I", self.value)
+
+    def hexdigest(self):
+        return "{:08x}".format(self.value)
+
+
+HASHERS = {
+    "crc32": Crc32,
+}
+
+
+def hasher_factories(hashers):
+    """
+    Returns a list of ``(name, factory)`` pairs for ``hashers``
+
+    :arg hashers: a dict of names to factories of hash objects (anything with
+        ``update`` and ``hexdigest`` methods, e.g. from the ``crc32c`` package) or
+        a sequence of names of `hashlib` algorithms or ``"crc32"``
+    :raises: ValueError
+    """
+    if isinstance(hashers, dict):
+        return sorted(hashers.items())
+
+    factories = []
+    for name in hashers:
+        if name in HASHERS:
+            factories.append((name, HASHERS[name]))
+            continue
+        try:
+            hashlib.new(name)
+        except ValueError:
+            raise ValueError("unsupported hash algorithm: {}".format(name))
+        factories.append((name, lambda name=name: hashlib.new(name)))
+    return factories
@@ -0,0 +1,197 @@
+"""
+Parser of multipart part headers working on bytes
+
+It replaces `tornado.httputil.HTTPHeaders.parse` and the private
+``tornado.httputil._parse_header`` for part headers.
+"""
+import re
+
+try:
+    from urllib.parse import unquote
+except ImportError:
+    # py2
+    from urllib import unquote
+
+# parsed header blocks are cached by their bytes, the cache is cleared when it gets full
+CACHE_SIZE = 256
+# larger header blocks are not cached, so clients can not pin large blocks in memory
+CACHE_MAX_BLOCK_SIZE = 1024
+
+_cache = {}
+
+_QUOTED_STRING_RE = re.compile(r'("(?:[^"\\]|\\.)*")')
+
+
+class PartHeaders(object):
+    """
+    Read-only headers of a multipart part
+
+    Header names are case-insensitive, values of repeated headers are joined with
+    commas like in `tornado.httputil.HTTPHeaders`. Parsed headers are cached and shared
+    by parts and requests, so ``disp_params`` returns a new dict on every access.
+    """
+
+    __slots__ = ("_items", "_index", "disposition", "_disp_params")
+
+    def __init__(self, items):
+        """
+        :arg items: list of ``(name, value)`` pairs
+        """
+        self._items = tuple(items)
+        self._index = {}
+        for name, value in self._items:
+            key = name.lower()
+            if key in self._index:
+                self._index[key] += "," + value
+            else:
+                self._index[key] = value
+        self.disposition, self._disp_params = parse_content_disposition(self._index.get("content-disposition", ""))
+
+    def get(self, name, default=None):
+        return self._index.get(name.lower(), default)
+
+    def __getitem__(self, name):
+        return self._index[name.lower()]
+
+    def __contains__(self, name):
+        return name.lower() in self._index
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return (name for name, _ in self._items)
+
+    def items(self):
+        """Returns ``(name, value)`` pairs in the order they were received"""
+        return list(self._items)
+
+    @property
+    def disp_params(self):
+        """Returns a dict of the content disposition parameters"""
+        return dict(self._disp_params)
+
+    @property
+    def content_type(self):
+        return self._index.get("content-type")
+
+    def to_http_headers(self):
+        """Returns the headers as `tornado.httputil.HTTPHeaders`"""
+        from tornado.httputil import HTTPHeaders
+        headers = HTTPHeaders()
+        for name, value in self._items:
+            headers.add(name, value)
+        return headers
+
+    def __eq__(self, other):
+        if isinstance(other, PartHeaders):
+            return self._items == other._items
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, list(self._items))
+
+
+def parse_part_headers(data):
+    """
+    Parses a header block (without the blank line ending it) into `.PartHeaders`
+
+    Header values are decoded as UTF-8, which browsers use for file names,
+    falling back to Latin-1. Results for blocks of up to `CACHE_MAX_BLOCK_SIZE` bytes are cached.
+    """
+    data = bytes(data)
+    headers = _cache.get(data)
+    if headers is not None:
+        return headers
+
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        text = data.decode("latin-1")
+
+    items = []
+    for line in text.split("\r\n"):
+        if line[:1] in (" ", "\t") and items:
+            # obsolete line folding
+            name, value = items[-1]
+            items[-1] = (name, value + " " + line.strip())
+            continue
+        name, sep, value = line.partition(":")
+        if sep:
+            items.append((name.strip(), value.strip()))
+
+    headers = PartHeaders(items)
+    if len(data) <= CACHE_MAX_BLOCK_SIZE:
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+        _cache[data] = headers
+    return headers
+
+
+def _split_params(value):
+    """Splits a header value on semicolons outside of quoted strings"""
+    if '"' not in value:
+        return value.split(";")
+    parts = [""]
+    for i, piece in enumerate(_QUOTED_STRING_RE.split(value)):
+        if i % 2:
+            parts[-1] += piece
+        else:
+            pieces = piece.split(";")
+            parts[-1] += pieces[0]
+            parts.extend(pieces[1:])
+    return parts
+
+
+def _decode_extended_value(value):
+    """Decodes an RFC 5987 ``charset'language'value`` extended parameter value"""
+    charset, sep, rest = value.partition("'")
+    _, sep2, encoded = rest.partition("'")
+    if not sep or not sep2:
+        return None
+    try:
+        return unquote(encoded, encoding=charset or "utf-8", errors="strict")
+    except TypeError:
+        # py2 unquote has no encoding
+        return unquote(encoded.encode("latin-1")).decode(charset or "utf-8")
+    except LookupError:
+        return None
+    except UnicodeDecodeError:
+        return None
+
+
+def parse_content_disposition(value):
+    """
+    Parses a Content-Disposition header value into the disposition type and a dict
+    of parameters with lowercase names
+
+    Like ``tornado.httputil._parse_header`` quoted values are unescaped and RFC 5987/7578
+    extended parameters (``filename*=UTF-8''...``) are decoded and take precedence
+    over the plain parameter of the same name.
+    """
+    parts = _split_params(value)
+    disposition = parts[0].strip().lower()
+    params = {}
+    extended = {}
+    for part in parts[1:]:
+        name, sep, param_value = part.partition("=")
+        if not sep:
+            continue
+        name = name.strip().lower()
+        param_value = param_value.strip()
+        if name.endswith("*"):
+            decoded = _decode_extended_value(param_value.strip('"'))
+            if decoded is not None:
+                extended[name[:-1]] = decoded
+            continue
+        if len(param_value) >= 2 and param_value[0] == param_value[-1] == '"':
+            param_value = param_value[1:-1].replace("\\\\", "\\").replace('\\"', '"')
+        params[name] = param_value
+    params.update(extended)
+    return disposition, params
@@ -0,0 +1,145 @@
+import functools
+import time
+
+from tornado.gen import convert_yielded
+from tornado.ioloop import IOLoop
+
+from ._compat import isawaitable
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    # py2
+    clock = time.time
+
+
+class ParserMetrics(object):
+    """
+    Interface of metrics collected by a `.StreamingFormDataParser` created with ``metrics``
+
+    Parsers without ``metrics`` do not measure anything. Methods of this class do
+    nothing, implement the ones you need or use `.StatsMetrics`.
+    """
+
+    def bytes_received(self, size):
+        """Called with the size of every chunk passed to the parser"""
+        pass
+
+    def buffer_size(self, size):
+        """Called with the number of bytes buffered when the parser starts scanning"""
+        pass
+
+    def parts_parsed(self, count):
+        """Called with the number of part headers parsed"""
+        pass
+
+    def parse_time(self, seconds):
+        """Called with time spent in the parser itself, without delegate methods"""
+        pass
+
+    def wait_time(self, seconds):
+        """Called with time the parser was paused waiting for an awaitable of the delegate"""
+        pass
+
+    def callback_time(self, name, seconds):
+        """
+        Called with the time a delegate method took, until its awaitable
+        was done if it returned one
+        """
+        pass
+
+
+class StatsMetrics(ParserMetrics):
+    """
+    `.ParserMetrics` keeping totals, usually shared by all parsers of a process
+
+    `snapshot` returns them as a dict which can be exported to a monitoring
+    system, e.g. periodically with `tornado.ioloop.PeriodicCallback`.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.bytes = 0
+        self.chunks = 0
+        self.parts = 0
+        self.buffer_high_watermark = 0
+        self.parse_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.callbacks = {}
+
+    def bytes_received(self, size):
+        self.bytes += size
+        self.chunks += 1
+
+    def buffer_size(self, size):
+        if size > self.buffer_high_watermark:
+            self.buffer_high_watermark = size
+
+    def parts_parsed(self, count):
+        self.parts += count
+
+    def parse_time(self, seconds):
+        self.parse_seconds += seconds
+
+    def wait_time(self, seconds):
+        self.wait_seconds += seconds
+
+    def callback_time(self, name, seconds):
+        stats = self.callbacks.get(name)
+        if stats is None:
+            stats = self.callbacks[name] = {"count": 0, "seconds": 0.0, "max_seconds": 0.0}
+        stats["count"] += 1
+        stats["seconds"] += seconds
+        if seconds > stats["max_seconds"]:
+            stats["max_seconds"] = seconds
+
+    def snapshot(self, reset=False):
+        """
+        Returns the totals as a dict
+        :arg reset: start new totals after taking the snapshot
+        """
+        snapshot = {
+            "bytes": self.bytes,
+            "chunks": self.chunks,
+            "parts": self.parts,
+            "buffer_high_watermark": self.buffer_high_watermark,
+            "parse_seconds": self.parse_seconds,
+            "wait_seconds": self.wait_seconds,
+            "callbacks": dict((name, dict(stats)) for name, stats in self.callbacks.items()),
+        }
+        if reset:
+            self.reset()
+        return snapshot
+
+
+class TimedDelegate(object):
+    """Proxy of a parser delegate passing the time its methods take to `.ParserMetrics`"""
+
+    def __init__(self, delegate, metrics):
+        self.delegate = delegate
+        self.metrics = metrics
+        # time spent in synchronous parts of delegate methods, see `.StreamingFormDataParser`
+        self.sync_seconds = 0.0
+
+    def __getattr__(self, name):
+        method = getattr(self.delegate, name)
+        if not callable(method):
+            return method
+        return functools.partial(self._call, name, method)
+
+    def _call(self, name, method, *args, **kwargs):
+        started = clock()
+        result = method(*args, **kwargs)
+        elapsed = clock() - started
+        self.sync_seconds += elapsed
+        if result is None:
+            self.metrics.callback_time(name, elapsed)
+            return None
+        if not isawaitable(result):
+            self.metrics.callback_time(name, elapsed)
+            return result
+        future = convert_yielded(result)
+        IOLoop.current().add_future(future, lambda f: self.metrics.callback_time(name, clock() - started))
+        return future
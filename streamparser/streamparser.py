@@ -1,28 +1,41 @@
+import collections
+import functools
+
 from tornado.web import RequestHandler
+from tornado.concurrent import Future
+from tornado.gen import convert_yielded
 from tornado.gen import coroutine
-from tornado.gen import is_future
-from tornado.httputil import HTTPHeaders
-from tornado.httputil import _parse_header
+from tornado.gen import multi
+from tornado.ioloop import IOLoop
 from tornado.log import gen_log
 
-
-PHASE_BOUNDARY = 1
-PHASE_HEADERS = 2
-PHASE_BODY = 3
-
-
-def get_boundary(content_type):
-    """
-    Extracts boundary from Content-Type
-    """
-    if content_type.startswith("multipart/form-data"):
-        fields = content_type.split(";")
-        for field in fields:
-            k, sep, v = field.strip().partition("=")
-            if k == "boundary" and v:
-                return v
-        else:
-            raise ValueError("multipart boundary not found")
+from ._compat import isawaitable
+from ._serial import SerialExecutor
+from ._writev import IOV_MAX
+from ._writev import write_buffers
+from .core import FormEnd
+from .core import MultipartError
+from .core import MultipartLimitError
+from .core import MultipartParser
+from .core import PartData
+from .core import PartEnd
+from .core import ParseError
+from .core import PartStart
+from .core import RawParser
+from .core import PHASE_BODY
+# the other phases are re-exported for code importing them from this module
+from .core import PHASE_BOUNDARY  # noqa: F401
+from .core import PHASE_ERROR  # noqa: F401
+from .core import PHASE_FINISHED  # noqa: F401
+from .core import PHASE_HEADERS  # noqa: F401
+from .core import PHASE_NAMES  # noqa: F401
+from .core import get_boundary
+from .core import get_multipart_subtype
+from .decoding import get_decoder
+from .hashing import hasher_factories
+from .headers import PartHeaders
+from .metrics import TimedDelegate
+from .metrics import clock
 
 
 class StreamingFormDataParserDelegate:
@@ -33,7 +46,8 @@ class StreamingFormDataParserDelegate:
     def start_file(self, headers, disp_params):
         """
         Called when a new file is coming
-        :arg headers: dict of headers
+        :arg headers: dict of headers, `tornado.httputil.HTTPHeaders` or `.headers.PartHeaders`
+            for a parser created with ``http_headers=False``
         :arg disp_params: dict of content disposition parameters
         """
         pass
@@ -41,15 +55,71 @@ class StreamingFormDataParserDelegate:
     def file_data_received(self, file_data):
         """
         Called when a chunk of data has been received (for a current file)
-        :arg file_data: chunk of file data
+        :arg file_data: chunk of file data, a `memoryview` over the parser buffer
+            (or `bytes` if the parser was created with ``copy_file_data=True``)
+        """
+        pass
+
+    def finish_file(self, **kwargs):
+        """
+        Called when a file has been received
+
+        A parser created with ``hashers`` passes a ``digests`` keyword argument,
+        a dict of hash names to hex digests of the file data.
         """
         pass
 
-    def finish_file(self):
-        """Called when a file has been received"""
+    def file_descriptor(self):
+        """
+        Called by a parser created with ``direct_write=True`` before the first data of
+        a file, after `start_file` (or `resume_file`) is done
+        :returns: a file descriptor open for writing in blocking mode the parser writes the
+            file data to instead of calling `file_data_received`, or None to receive it
+        """
+        return None
+
+    def resume_file(self, headers, disp_params, size):
+        """
+        Called instead of `start_file` for a file whose data was being received when
+        the checkpoint a parser was resumed from was taken
+        :arg headers: headers of the file like in `start_file`
+        :arg disp_params: dict of content disposition parameters
+        :arg size: size in bytes of the file data received before the checkpoint
+        """
+        pass
+
+    def on_error(self, error):
+        """
+        Called once when the parser stops at invalid data or an exceeded limit,
+        further data is ignored. It is called synchronously and its result is not awaited.
+        The bundled wrapper delegates pass it on to the delegates they wrap.
+        :arg error: a `.MultipartError`
+        """
+        pass
+
+    def form_fields_received(self, fields):
+        """
+        Called when the form has been parsed by a parser created with ``collect_fields``
+        :arg fields: dict of field names to lists of `bytes` values
+        """
         pass
 
 
+# `StreamingFormDataParser._file_fd` of a file whose descriptor has not been asked for yet
+_ASK_FD = object()
+
+
+class _ResumeFile(object):
+    """Event of a parser resumed in the middle of a file, it is never returned by the core parser"""
+
+    __slots__ = ("headers", "disp_params", "size")
+
+    def __init__(self, headers, disp_params, size):
+        self.headers = headers
+        self.disp_params = disp_params
+        self.size = size
+
+
 class StreamingFormDataParser:
     """
     Streaming multipart/form-data parser
@@ -58,13 +128,107 @@ class StreamingFormDataParser:
     decorated with stream_request_body using self as the delegate and pass a chunk of data
     to `data_received` method.
 
-    `.StreamingFormDataParser` invokes methods of `.StreamingFormDataParserDelegate`
+    `.StreamingFormDataParser` invokes methods of `.StreamingFormDataParserDelegate`,
+    it is a Tornado adapter over the framework-free `.core.MultipartParser` passing
+    the parser's events to the delegate.
+
+    By default the parser waits for every future returned by the delegate. With
+    ``max_bytes_in_flight`` it keeps parsing while futures returned by
+    `~.StreamingFormDataParserDelegate.file_data_received` are pending, queueing the
+    file data. The calls are still made one at a time, in order, each one once the
+    future of the previous one is done, so only the parser runs ahead of the delegate.
+    `data_received` only returns an unresolved future (pausing the request body stream)
+    when the data of pending writes exceeds ``max_bytes_in_flight``, it resolves once it
+    drops to ``resume_bytes_in_flight``. All pending writes are done before
+    `~.StreamingFormDataParserDelegate.finish_file` is called.
+
+    With ``hashers`` every part's data is hashed as it passes to
+    `~.StreamingFormDataParserDelegate.file_data_received` and ``finish_file`` is
+    called with a ``digests`` keyword argument, a dict of names to hex digests. Given
+    a ``hash_executor`` the hashes are updated on it (`hashlib` releases the GIL for
+    large data), at most ``hash_max_pending`` updates are queued before the parser waits.
+
+    The parser is done when ``finished`` is True. If it stops at invalid data instead,
+    ``error`` is set to a `.MultipartError`, the error is logged and passed to
+    `~.StreamingFormDataParserDelegate.on_error` and further data is ignored.
+
+    Exceeding one of the ``max_header_size``, ``max_parts``, ``max_part_size`` or
+    ``max_body_size`` limits raises `.MultipartLimitError` from `data_received` as
+    soon as the chunk exceeding it is received, without passing its data to the delegate.
+    It is reported to `~.StreamingFormDataParserDelegate.on_error` like invalid data.
+
+    With ``collect_fields`` parts without a filename (plain form fields) up to
+    ``max_field_size`` bytes are not passed to the delegate. They are collected
+    into ``fields``, a dict of names to lists of values like
+    `tornado.httputil.HTTPServerRequest.body_arguments`, which is passed to
+    `~.StreamingFormDataParserDelegate.form_fields_received` once the form has been parsed.
+
+    Bodies of other multipart subtypes, like multipart/mixed or multipart/related, are
+    parsed too, their parts may have any headers or none at all.
+
+    A body with a gzip, deflate or zstd Content-Encoding header is decoded before it is
+    parsed (unless ``decode_body`` is False), ``max_body_size`` limits the decoded body.
+    With ``decode_parts`` the data of parts with such a Content-Encoding header is decoded
+    before it is passed to the delegate, ``max_part_size`` limits the decoded data. Data is
+    decoded in pieces of at most `.decoding.DECODE_CHUNK_SIZE` bytes, each one passed on
+    before the next is decoded, and ``max_decompression_ratio`` stops decompression bombs.
+    Collected fields are not decoded.
+
+    Between chunks `checkpoint` returns the parser state as `bytes`, a parser created with
+    that ``checkpoint`` continues the body from offset ``bytes_received`` on, calling
+    `~.StreamingFormDataParserDelegate.resume_file` for a file received partially.
+    The delegate is responsible for its own state, like the data it has written so far.
+    A parser with ``hashers`` can not resume a file received partially, as the hashes
+    of its data before the checkpoint are gone.
+
+    With ``direct_write`` the data of files for which
+    `~.StreamingFormDataParserDelegate.file_descriptor` returns a file descriptor is
+    written to it by the parser, `~.StreamingFormDataParserDelegate.file_data_received`
+    is not called for them. The data is collected as slices of the parser buffer and
+    written with one `os.writev` call per ``write_batch_size`` bytes, without copying
+    it to `bytes` first. The writes are synchronous, so use it for local files. Pending
+    data is written before `~.StreamingFormDataParserDelegate.finish_file` and
+    `~.StreamingFormDataParserDelegate.on_error` are called and by `checkpoint`.
 
     """
-    def __init__(self, parser_delegate, headers=None):
+    def __init__(self, parser_delegate, headers=None, copy_file_data=False,
+                 max_bytes_in_flight=None, resume_bytes_in_flight=None,
+                 hashers=None, hash_executor=None, hash_max_pending=16,
+                 collect_fields=False, max_field_size=64 * 1024, http_headers=True,
+                 max_header_size=None, max_parts=None, max_part_size=None, max_body_size=None,
+                 metrics=None, decode_body=True, decode_parts=False, max_decompression_ratio=None,
+                 checkpoint=None, direct_write=False, write_batch_size=1024 * 1024):
         """
-        :arg parser_delegate: a `.StreamingFormDataParserDelegate`
+        :arg parser_delegate: a `.StreamingFormDataParserDelegate`, or a `.RequestHandler`
+            only implementing its ``start_file``, ``file_data_received`` and ``finish_file``
         :arg headers: dict of headers
+        :arg copy_file_data: pass `bytes` instead of `memoryview` slices to
+            `~.StreamingFormDataParserDelegate.file_data_received`
+        :arg max_bytes_in_flight: high watermark of file data passed to pending
+            `~.StreamingFormDataParserDelegate.file_data_received` calls
+        :arg resume_bytes_in_flight: low watermark, half of ``max_bytes_in_flight`` by default
+        :arg hashers: hash algorithms for part data, see `.hashing.hasher_factories`
+        :arg hash_executor: a `concurrent.futures.Executor` to update hashes on
+        :arg hash_max_pending: number of queued hash updates above which the parser waits
+        :arg collect_fields: collect parts without a filename into ``fields`` instead
+            of passing them to the delegate
+        :arg max_field_size: size in bytes above which a collected part is passed to
+            the delegate as a file after all
+        :arg http_headers: pass part headers to `~.StreamingFormDataParserDelegate.start_file`
+            as `tornado.httputil.HTTPHeaders`, if False the lighter, read-only
+            `.headers.PartHeaders` are passed instead
+        :arg max_header_size: limit of the size in bytes of a part's header block
+        :arg max_parts: limit of the number of parts
+        :arg max_part_size: limit of the size in bytes of a part's data
+        :arg max_body_size: limit of the size in bytes of the whole body
+        :arg metrics: a `.metrics.ParserMetrics` to report bytes, parts and timings to
+        :arg decode_body: decode the body according to the Content-Encoding header
+        :arg decode_parts: decode the data of parts according to their Content-Encoding header
+        :arg max_decompression_ratio: limit of the ratio of decoded to encoded bytes
+        :arg checkpoint: state returned by `checkpoint` to continue parsing from
+        :arg direct_write: write file data to the file descriptors returned by
+            `~.StreamingFormDataParserDelegate.file_descriptor`
+        :arg write_batch_size: size in bytes of file data written at once with ``direct_write``
 
         :raises: TypeError
         :raises: ValueError
@@ -78,18 +242,249 @@ class StreamingFormDataParser:
         elif not isinstance(parser_delegate, StreamingFormDataParserDelegate):
             raise TypeError("parser_delegate must implement StreamingFormDataParserDelegate interface")
 
-        self.current_phase = PHASE_BOUNDARY
+        self.finished = False
         self.file_headers = []
         self.current_file = None
-        self.boundary = get_boundary(headers["Content-Type"])
-        if not self.boundary:
-            raise ValueError("Invalid multipart/form-data")
-        if self.boundary.startswith('"') and self.boundary.endswith('"'):
-            self.boundary = self.boundary[1:-1]
+        self._body_decoder = None
+        if decode_body and headers.get("Content-Encoding"):
+            self._body_decoder = get_decoder(headers["Content-Encoding"], max_ratio=max_decompression_ratio)
+        self._body_pieces = None
+        self.core = self._create_core(headers, checkpoint, dict(
+            copy_data=copy_file_data, collect_fields=collect_fields, max_field_size=max_field_size,
+            max_header_size=max_header_size, max_parts=max_parts,
+            max_part_size=max_part_size, max_body_size=max_body_size,
+        ))
+        # a checkpoint may be taken after the close delimiter
+        self.finished = self.core.finished
+        self.copy_file_data = copy_file_data
+        self.collect_fields = collect_fields
+        self.http_headers = http_headers
+        self._chunk = None
+        self._events = collections.deque()
+        self._finishing = False
+        self.decode_parts = decode_parts
+        self.max_decompression_ratio = max_decompression_ratio
+        self._part_decoder = None
+        self._part_pieces = None
+        self.direct_write = direct_write
+        self.write_batch_size = write_batch_size
+        self._file_fd = None
+        self._writes = []
+        self._writes_size = 0
+        if self.core.current_part is not None:
+            part_headers, size = self.core.current_part
+            self._events.append(_ResumeFile(part_headers, part_headers.disp_params, size))
+        self._empty_form_finished = False
+
+        self.metrics = metrics
+        if metrics is not None:
+            self.parser_delegate = TimedDelegate(parser_delegate, metrics)
+            self._parse = self._measured_parse
+            self._parse_returned_at = None
+            self._measured_bytes = 0
+            self._measured_parts = 0
+        self.max_bytes_in_flight = max_bytes_in_flight
+        if resume_bytes_in_flight is None and max_bytes_in_flight is not None:
+            resume_bytes_in_flight = max_bytes_in_flight // 2
+        self.resume_bytes_in_flight = resume_bytes_in_flight
+
+        # calls of file_data_received queued while the parser keeps parsing
+        self._file_data_serial = SerialExecutor(None) if max_bytes_in_flight is not None else None
+        self._bytes_in_flight = 0
+        self._futures_in_flight = 0
+        self._file_data_error = None
+        self._in_flight_waiter = None
+        self._in_flight_watermark = None
+
+        if hashers is not None and self.core.current_part is not None:
+            raise ValueError("a file received partially can not be hashed from a checkpoint")
+        self._hasher_factories = hasher_factories(hashers) if hashers is not None else None
+        self._hashes = []
+        self._hash_serial = None
+        if hash_executor is not None:
+            self._hash_serial = SerialExecutor(hash_executor, hash_max_pending)
+
+    def _create_core(self, headers, checkpoint, options):
+        """Returns the core parser of the body with ``headers``, restored from ``checkpoint`` if it is given"""
+        content_type = headers["Content-Type"]
+        boundary = get_boundary(content_type)
+        options["subtype"] = get_multipart_subtype(content_type) or "form-data"
+        if checkpoint is None:
+            core = MultipartParser(boundary, **options)
+        else:
+            core = MultipartParser.restore(checkpoint, **options)
+            if core.boundary != MultipartParser(boundary).boundary:
+                raise ValueError("the checkpoint is of a body with another boundary")
+        self.boundary = core.boundary
+        return core
+
+    @property
+    def current_phase(self):
+        """The phase of the `.core.MultipartParser`, one of the ``PHASE_*`` constants"""
+        return self.core.phase
+
+    @property
+    def error(self):
+        """The `.MultipartError` the parser stopped at or None"""
+        return self.core.error
+
+    @property
+    def bytes_received(self):
+        """Number of bytes of the body received, a resumed parser continues from this offset"""
+        return self.core.bytes_received
+
+    @property
+    def fields(self):
+        """Fields collected with ``collect_fields``"""
+        return self.core.fields
+
+    def _start_file(self, headers, disp_params):
+        if self._hasher_factories is not None:
+            self._hashes = [(name, factory()) for name, factory in self._hasher_factories]
+        if self.direct_write:
+            self._file_fd = _ASK_FD
+        return self.parser_delegate.start_file(headers, disp_params)
 
-        self._buffer = None
-        self._boundary_delimiter = "--{}\r\n".format(self.boundary).encode()
-        self._end_boundary = "\r\n--{}--\r\n".format(self.boundary).encode()
+    def _finish_file(self):
+        if self._hasher_factories is None:
+            return self.parser_delegate.finish_file()
+        digests = dict((name, hash_object.hexdigest()) for name, hash_object in self._hashes)
+        self._hashes = []
+        return self.parser_delegate.finish_file(digests=digests)
+
+    def _update_hashes(self, file_data):
+        """Returns a future to wait on before more data is hashed or None"""
+        if self._hash_serial is None:
+            for _, hash_object in self._hashes:
+                hash_object.update(file_data)
+            return None
+
+        for _, hash_object in self._hashes:
+            self._hash_serial.post(hash_object.update, file_data)
+        return self._hash_serial.wait_for_capacity()
+
+    def _file_data_received(self, file_data):
+        hashing = self._update_hashes(file_data) if self._hashes else None
+        if self._file_fd is _ASK_FD:
+            self._file_fd = self._call_delegate_hook("file_descriptor")
+        if self._file_fd is not None:
+            self._write_file_data(file_data)
+            return hashing
+        result = self._delegate_file_data_received(file_data)
+        if hashing is None:
+            return result
+        if not isawaitable(result):
+            return hashing
+        return multi([convert_yielded(result), hashing])
+
+    def _delegate_file_data_received(self, file_data):
+        if self._file_data_serial is None:
+            return self.parser_delegate.file_data_received(file_data)
+
+        future = self._file_data_serial.submit(self.parser_delegate.file_data_received, file_data)
+        if future.done():
+            # a synchronous call with nothing queued before it
+            future.result()
+            return None
+        self._bytes_in_flight += len(file_data)
+        self._futures_in_flight += 1
+        IOLoop.current().add_future(future, functools.partial(self._file_data_done, len(file_data)))
+        if self._bytes_in_flight > self.max_bytes_in_flight:
+            return self._wait_for_file_data(self.resume_bytes_in_flight)
+        return None
+
+    def _write_file_data(self, file_data):
+        """Queues ``file_data`` to be written to the file descriptor, writing a full batch"""
+        self._writes.append(file_data)
+        self._writes_size += len(file_data)
+        if self._writes_size >= self.write_batch_size or len(self._writes) >= IOV_MAX:
+            self._flush_writes()
+
+    def _flush_writes(self):
+        """Writes the queued file data"""
+        if self._writes:
+            writes = self._writes
+            self._writes = []
+            self._writes_size = 0
+            write_buffers(self._file_fd, writes)
+
+    def _file_data_done(self, size, future):
+        self._bytes_in_flight -= size
+        self._futures_in_flight -= 1
+        if self._file_data_error is None and future.exception() is not None:
+            self._file_data_error = future.exception()
+
+        waiter = self._in_flight_waiter
+        if waiter is None:
+            return
+        if self._file_data_error is not None:
+            self._in_flight_waiter = None
+            waiter.set_exception(self._file_data_error)
+        elif self._file_data_drained(self._in_flight_watermark):
+            self._in_flight_waiter = None
+            waiter.set_result(None)
+
+    def _file_data_drained(self, watermark):
+        if watermark is None:
+            return self._futures_in_flight == 0
+        return self._bytes_in_flight <= watermark
+
+    def _wait_for_file_data(self, watermark=None):
+        """
+        Returns a future resolved when the data of pending writes drops to ``watermark``
+        (or when all of them are done if it is None), None if there is nothing to wait for
+        """
+        if self._file_data_error is not None:
+            raise self._file_data_error
+        if self._file_data_drained(watermark):
+            return None
+        self._in_flight_watermark = watermark
+        self._in_flight_waiter = Future()
+        return self._in_flight_waiter
+
+    def checkpoint(self):
+        """
+        Returns the parser state as `bytes`, pass it as ``checkpoint`` to a new parser
+        to continue parsing the body from offset `bytes_received` on
+
+        :raises: ValueError if the parser is not between chunks, is waiting for file data
+            or hashes, decodes the body or the current part, or has stopped at an error
+        """
+        if self._events or self._chunk is not None or self._body_pieces is not None or self._part_pieces is not None:
+            raise ValueError("the parser can only be checkpointed between chunks")
+        if self._futures_in_flight or (self._hash_serial is not None and self._hash_serial.pending):
+            raise ValueError("the parser can not be checkpointed while file data is pending")
+        if self._body_decoder is not None or self._part_decoder is not None:
+            raise ValueError("a parser decoding data can not be checkpointed")
+        if self._hashes:
+            raise ValueError("a parser hashing a file can not be checkpointed")
+        self._flush_writes()
+        return self.core.checkpoint()
+
+    def _receive(self, chunk):
+        """Queues ``chunk`` to be fed to the core parser by the next `_parse`"""
+        if self.core.error is not None:
+            return
+        if self._file_data_error is not None:
+            raise self._file_data_error
+        if self._body_decoder is None:
+            self._chunk = chunk
+        else:
+            self._body_pieces = self._body_decoder.decode(chunk)
+
+    def _next_piece(self, pieces):
+        """Returns the next decoded piece or None, a decoding error stops the parser"""
+        try:
+            return next(pieces, None)
+        except MultipartError as error:
+            if error.offset is None:
+                error.offset = self.core.bytes_received
+            if error.phase is None and pieces is self._part_pieces:
+                # the core may have parsed past the part already
+                error.phase = PHASE_BODY
+            self._events.clear()
+            self._events.extend(self.core.fail(error))
+            return None
 
     @coroutine
     def data_received(self, chunk):
@@ -97,79 +492,206 @@ class StreamingFormDataParser:
         Receive chunk of multipart/form-data
         :arg chunk: chunk of data
         """
-        if not self._buffer:
-            self._buffer = chunk
-        else:
-            self._buffer += chunk
+        self._receive(chunk)
+
+        result = self._parse()
+        while result is not None:
+            yield result
+            result = self._parse()
+
+    @coroutine
+    def finish(self):
+        """
+        Call once the whole body has been received, a body that ended too early
+        is reported like invalid data
+        """
+        self._finish()
 
+        result = self._parse()
+        while result is not None:
+            yield result
+            result = self._parse()
+
+    def _finish(self):
+        if self.core.error is None and not self.core.finished and self._body_decoder is not None:
+            self._body_pieces = self._body_decoder.finish()
+        self._finishing = True
+
+    def _measured_parse(self):
+        """`_parse` reporting to ``metrics``, replaces it when the parser has ``metrics``"""
+        metrics = self.metrics
+        core = self.core
+        started = clock()
+        if self._parse_returned_at is not None:
+            metrics.wait_time(started - self._parse_returned_at)
+        pending = len(self._chunk) if self._chunk is not None else 0
+        if core.bytes_received + pending > self._measured_bytes:
+            metrics.bytes_received(core.bytes_received + pending - self._measured_bytes)
+            self._measured_bytes = core.bytes_received + pending
+        metrics.buffer_size(core.buffered + pending)
+        delegate_seconds = self.parser_delegate.sync_seconds
+
+        result = type(self)._parse(self)
+
+        finished = clock()
+        metrics.parse_time(finished - started - (self.parser_delegate.sync_seconds - delegate_seconds))
+        if core.parts_received > self._measured_parts:
+            metrics.parts_parsed(core.parts_received - self._measured_parts)
+            self._measured_parts = core.parts_received
+        self._parse_returned_at = finished if result is not None else None
+        return result
+
+    def _parse(self):
+        """
+        Feeds the queued chunk to the core parser and passes its events to the delegate
+        until a delegate method returns an awaitable
+
+        Returns that awaitable (None if there was none), parsing is resumed by calling
+        `_parse` again once it is done. An event is taken off the queue before the
+        delegate method handling it is called.
+        """
+        events = self._events
         while True:
-            if self.current_phase == PHASE_BOUNDARY:
-                if len(self._buffer) > len(self._boundary_delimiter):
-                    if self._buffer.startswith(self._boundary_delimiter):
-                        self.current_phase = PHASE_HEADERS
-                        self._buffer = self._buffer[len(self._boundary_delimiter):]
-                    elif self._buffer.startswith(self._end_boundary):
-                        result = self.parser_delegate.finish_file()
-                        if is_future(result):
-                            yield result
-                        return
-                    else:
-                        gen_log.warning("Invalid multipart/form-data")
-                        return
-                else:
-                    # wait for next chunk
-                    return
-
-            if self.current_phase == PHASE_HEADERS:
-                if b"\r\n\r\n" in self._buffer:
-                    headers, remaining_part = self._buffer.split(b"\r\n\r\n", 1)
-
-                    if headers:
-                        headers = HTTPHeaders.parse(headers.decode("utf-8"))
-                    else:
-                        gen_log.warning("multipart/form-data missing headers")
-                        return
-
-                    disp_header = headers.get("Content-Disposition", "")
-                    disposition, disp_params = _parse_header(disp_header)
-                    if disposition != "form-data":
-                        gen_log.warning("Invalid multipart/form-data")
-                        return
-                    self._buffer = remaining_part
-                    self.current_phase = PHASE_BODY
-                    result = self.parser_delegate.start_file(headers, disp_params)
-                    if is_future(result):
-                        yield result
+            if self._part_pieces is not None:
+                piece = self._next_piece(self._part_pieces)
+                if piece is None:
+                    self._part_pieces = None
+                    continue
+                result = self._file_data_received(piece)
+                if isawaitable(result):
+                    return result
+                continue
+
+            if not events:
+                if self._body_pieces is not None:
+                    chunk = self._next_piece(self._body_pieces)
+                    if chunk is None:
+                        self._body_pieces = None
+                        continue
                 else:
-                    # wait for all headers for current file
-                    return
-
-            if self.current_phase == PHASE_BODY:
-                if self._boundary_delimiter in self._buffer:
-                    data, remaining_data = self._buffer.split(self._boundary_delimiter, 1)
-                    self._buffer = remaining_data
-                    result = self.parser_delegate.file_data_received(data[:-2])
-                    if is_future(result):
-                        yield result
-                    self.current_phase = PHASE_HEADERS
-                    result = self.parser_delegate.finish_file()
-                    if is_future(result):
-                        yield result
+                    chunk = self._chunk
+                    if chunk is None:
+                        if not self._finishing:
+                            return None
+                        self._finishing = False
+                        events.extend(self.core.finish())
+                        continue
+                    self._chunk = None
+                events.extend(self.core.feed(chunk))
+                continue
+
+            event = events[0]
+            event_type = type(event)
+            if event_type is PartData:
+                events.popleft()
+                if self._part_decoder is not None:
+                    self._part_pieces = self._part_decoder.decode(event.data)
+                    continue
+                result = self._file_data_received(event.data)
+            elif event_type is PartStart:
+                events.popleft()
+                if self.decode_parts:
+                    self._part_decoder = self._get_part_decoder(event.headers)
+                headers = event.headers.to_http_headers() if self.http_headers else event.headers
+                result = self._start_file(headers, event.disp_params)
+            elif event_type is PartEnd:
+                if self._part_decoder is not None:
+                    self._part_pieces = self._part_decoder.finish()
+                    self._part_decoder = None
                     continue
-                elif self._end_boundary in self._buffer:
-                    result = self.parser_delegate.file_data_received(self._buffer.split(self._end_boundary)[0])
-                    if is_future(result):
-                        yield result
-                    result = self.parser_delegate.finish_file()
-                    if is_future(result):
-                        yield result
-
-                    return
+                self._flush_writes()
+                result = self._wait_for_file_data()
+                if result is not None:
+                    return result
+                if self._hash_serial is not None:
+                    result = self._hash_serial.flush()
+                    if result is not None:
+                        return result
+                events.popleft()
+                self._file_fd = None
+                result = self._finish_file()
+            elif event_type is FormEnd:
+                if self.core.parts_received == 0 and not self._empty_form_finished:
+                    # a form without parts has always been finished with finish_file
+                    self._empty_form_finished = True
+                    result = self._finish_file()
                 else:
-                    if self._buffer:
-                        result = self.parser_delegate.file_data_received(self._buffer)
-                        if is_future(result):
-                            yield result
-                    self._buffer = b""
+                    events.popleft()
+                    self.finished = True
+                    result = None
+                    if self.collect_fields:
+                        result = self._call_delegate_hook("form_fields_received", event.fields)
+            elif event_type is ParseError:
+                events.popleft()
+                self._flush_writes()
+                self._report_error(event.error)
+                return None
+            else:
+                events.popleft()
+                headers = event.headers.to_http_headers() if self.http_headers else event.headers
+                if self.direct_write:
+                    self._file_fd = _ASK_FD
+                result = self._call_delegate_hook("resume_file", headers, event.disp_params, event.size)
+
+            if isawaitable(result):
+                return result
+
+    def _get_part_decoder(self, headers):
+        """Returns a decoder of the part's Content-Encoding, None if it is not encoded in a supported way"""
+        encoding = headers.get("Content-Encoding")
+        if not encoding:
+            return None
+        try:
+            return get_decoder(encoding, self.core.max_part_size, self.max_decompression_ratio)
+        except ValueError:
+            return None
+
+    def _report_error(self, error):
+        """Logs an invalid body or raises an exceeded limit, reporting it to the delegate"""
+        if isinstance(error, MultipartLimitError):
+            self._call_delegate_hook("on_error", error)
+            raise error
+        gen_log.warning(error.message)
+        self._call_delegate_hook("on_error", error)
+
+    def _call_delegate_hook(self, name, *args):
+        """
+        Calls the delegate method ``name`` that a `.RequestHandler` delegate not implementing
+        `.StreamingFormDataParserDelegate` may lack, returns None if it does
+        """
+        method = getattr(self.parser_delegate, name, None)
+        if method is None:
+            return None
+        return method(*args)
+
+
+class StreamingRawBodyParser(StreamingFormDataParser):
+    """
+    Streams a body that is not multipart, like an application/octet-stream upload,
+    to a `.StreamingFormDataParserDelegate` as a single file
+
+    It takes the arguments of `.StreamingFormDataParser` and keeps its guarantees,
+    the multipart ones do not apply. `~.StreamingFormDataParserDelegate.start_file`
+    gets the Content-Type and Content-Disposition headers of the request. The file is
+    finished once Content-Length bytes have been received, call `finish` once the body
+    has been received if it has no Content-Length (or is decoded). The Content-Length
+    of a request continuing a body from a ``checkpoint`` is that of the rest of the body.
+    """
 
-                    return
+    def _create_core(self, headers, checkpoint, options):
+        items = [(name, headers[name]) for name in ("Content-Type", "Content-Disposition") if headers.get(name)]
+        length = None
+        if self._body_decoder is None and headers.get("Content-Length"):
+            length = int(headers["Content-Length"])
+        options = dict(
+            headers=PartHeaders(items), length=length,
+            copy_data=options["copy_data"], max_body_size=options["max_body_size"],
+        )
+        self.boundary = None
+        if checkpoint is None:
+            return RawParser(**options)
+        core = RawParser.restore(checkpoint, **options)
+        if length is not None:
+            # the request continuing the body sends what follows the checkpoint
+            core.length = core.bytes_received + length
+        return core
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+
+from tornado.httputil import HTTPHeaders
+from tornado.testing import AsyncTestCase
+from tornado.testing import gen_test
+
+from streamparser import AsyncStreamingFormDataParser
+from streamparser import StreamingFormDataParserDelegate
+
+try:
+    # py33+
+    from unittest import mock
+except ImportError:
+    import mock
+
+DATA = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234
+Content-Disposition: form-data; name="files2"; filename="abc.txt"
+
+Foo2
+--1234--
+""".replace(b"\n", b"\r\n")
+
+
+class AsyncSinkDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.events = []
+
+    async def start_file(self, headers, disp_params):
+        await asyncio.sleep(0)
+        self.events.append(("start", disp_params["filename"]))
+
+    async def file_data_received(self, file_data):
+        await asyncio.sleep(0)
+        self.events.append(("data", bytes(file_data)))
+
+    async def finish_file(self):
+        await asyncio.sleep(0)
+        self.events.append(("finish",))
+
+
+class AsyncStreamingFormDataParserTest(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_synchronous_delegate_returns_none(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        parser = AsyncStreamingFormDataParser(delegate, self.headers)
+
+        for i in range(len(DATA)):
+            self.assertIsNone(parser.data_received(DATA[i:i + 1]))
+
+        received = b"".join(bytes(call[0][0]) for call in delegate.file_data_received.call_args_list)
+        self.assertEqual(received, b"FooFoo2")
+        self.assertEqual(delegate.finish_file.call_count, 2)
+
+    @gen_test
+    def test_native_coroutine_delegate(self):
+        delegate = AsyncSinkDelegate()
+        parser = AsyncStreamingFormDataParser(delegate, self.headers)
+
+        for i in range(0, len(DATA), 7):
+            result = parser.data_received(DATA[i:i + 7])
+            if result is not None:
+                yield result
+
+        data = b"".join(event[1] for event in delegate.events if event[0] == "data")
+        self.assertEqual(data, b"FooFoo2")
+        self.assertEqual(
+            [event for event in delegate.events if event[0] != "data"],
+            [("start", "ab.txt"), ("finish",), ("start", "abc.txt"), ("finish",)]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
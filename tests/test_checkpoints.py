@@ -0,0 +1,182 @@
+import shutil
+import tempfile
+
+from tornado.concurrent import Future
+from tornado.httputil import HTTPHeaders
+from tornado.testing import AsyncTestCase
+
+from streamparser import StreamingFormDataParser
+from streamparser import StreamingFormDataParserDelegate
+from streamparser import StreamingRawBodyParser
+from streamparser.checkpoints import LocalCheckpointStore
+from streamparser.core import FormEnd
+from streamparser.core import MultipartParser
+from streamparser.core import PartData
+from streamparser.core import PartEnd
+from streamparser.core import PartStart
+
+DATA = b"""\
+--1234
+Content-Disposition: form-data; name="field"
+
+value
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+Content-Type: text/plain
+
+""".replace(b"\n", b"\r\n") + b"x" * 300 + b"\r\n--1234--\r\n"
+
+
+def summarize(events):
+    summary = []
+    for event in events:
+        if isinstance(event, PartStart):
+            summary.append(("start", event.disp_params["name"]))
+        elif isinstance(event, PartData):
+            if summary and summary[-1][0] == "data":
+                summary[-1] = ("data", summary[-1][1] + bytes(event.data))
+            elif event.data:
+                summary.append(("data", bytes(event.data)))
+        elif isinstance(event, PartEnd):
+            summary.append(("end",))
+        elif isinstance(event, FormEnd):
+            summary.append(("form_end", event.fields))
+    return summary
+
+
+class FileDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self, files=None):
+        self.files = files if files is not None else {}
+        self.current = None
+        self.resumed = []
+
+    def start_file(self, headers, disp_params):
+        self.current = self.files.setdefault(disp_params.get("name", "body"), bytearray())
+
+    def resume_file(self, headers, disp_params, size):
+        name = disp_params.get("name", "body")
+        self.resumed.append((name, headers["Content-Type"], size))
+        self.current = self.files[name]
+        del self.current[size:]
+
+    def file_data_received(self, file_data):
+        self.current += file_data
+
+
+class CheckpointTest(AsyncTestCase):
+
+    def setUp(self):
+        super(CheckpointTest, self).setUp()
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+
+    def test_restore_core_at_every_offset(self):
+        for collect_fields in (False, True):
+            expected = summarize(MultipartParser("1234", collect_fields=collect_fields).feed(DATA))
+            for offset in range(len(DATA)):
+                parser = MultipartParser("1234", collect_fields=collect_fields)
+                events = parser.feed(DATA[:offset])
+                checkpoint = parser.checkpoint()
+                parser = MultipartParser.restore(checkpoint, collect_fields=collect_fields)
+
+                self.assertEqual(parser.bytes_received, offset)
+                events.extend(parser.feed(DATA[offset:]))
+                self.assertEqual(summarize(events), expected, offset)
+                self.assertTrue(parser.finished)
+
+    def test_resume_in_the_middle_of_a_file(self):
+        delegate = FileDelegate()
+        parser = StreamingFormDataParser(delegate, self.headers)
+        parser.data_received(DATA[:250])
+        checkpoint = parser.checkpoint()
+
+        # the connection drops after more data, the client resends from the checkpoint offset
+        parser.data_received(DATA[250:300])
+        delegate = FileDelegate(delegate.files)
+        parser = StreamingFormDataParser(delegate, self.headers, checkpoint=checkpoint)
+        self.assertEqual(parser.bytes_received, 250)
+        parser.data_received(DATA[parser.bytes_received:])
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(delegate.resumed, [("files", "text/plain", 250 - DATA.index(b"xxx"))])
+        self.assertEqual(delegate.files, {"field": b"value", "files": b"x" * 300})
+
+    def test_resume_raw_body(self):
+        headers = HTTPHeaders({"Content-Type": "text/plain", "Content-Length": "10"})
+        delegate = FileDelegate()
+        parser = StreamingRawBodyParser(delegate, headers)
+        parser.data_received(b"01234")
+        checkpoint = parser.checkpoint()
+
+        headers = HTTPHeaders({"Content-Type": "text/plain", "Content-Length": "5"})
+        delegate = FileDelegate(delegate.files)
+        parser = StreamingRawBodyParser(delegate, headers, checkpoint=checkpoint)
+        parser.data_received(b"56789")
+
+        self.assertTrue(parser.finished)
+        self.assertIsNone(parser.error)
+        self.assertEqual(delegate.resumed, [("body", "text/plain", 5)])
+        self.assertEqual(delegate.files, {"body": b"0123456789"})
+
+    def test_resume_after_the_close_delimiter(self):
+        parser = StreamingFormDataParser(FileDelegate(), self.headers)
+        parser.data_received(DATA)
+        parser = StreamingFormDataParser(FileDelegate(), self.headers, checkpoint=parser.checkpoint())
+        self.assertTrue(parser.finished)
+
+    def test_hashers_can_not_resume_a_file(self):
+        parser = StreamingFormDataParser(FileDelegate(), self.headers, hashers=["crc32"])
+        parser.data_received(DATA[:100])
+        checkpoint = parser.checkpoint()
+        StreamingFormDataParser(FileDelegate(), self.headers, hashers=["crc32"], checkpoint=checkpoint)
+
+        parser = StreamingFormDataParser(FileDelegate(), self.headers)
+        parser.data_received(DATA[:250])
+        with self.assertRaises(ValueError):
+            StreamingFormDataParser(FileDelegate(), self.headers, hashers=["crc32"], checkpoint=parser.checkpoint())
+
+    def test_checkpoint_with_pending_writes(self):
+        class PendingDelegate(StreamingFormDataParserDelegate):
+            def file_data_received(self, file_data):
+                return Future()
+
+        parser = StreamingFormDataParser(PendingDelegate(), self.headers, max_bytes_in_flight=1024)
+        parser.data_received(DATA[:250])
+        with self.assertRaises(ValueError):
+            parser.checkpoint()
+
+    def test_invalid_checkpoint(self):
+        with self.assertRaises(ValueError):
+            StreamingFormDataParser(FileDelegate(), self.headers, checkpoint=b"{}")
+
+        other = MultipartParser("4321").checkpoint()
+        with self.assertRaises(ValueError):
+            StreamingFormDataParser(FileDelegate(), self.headers, checkpoint=other)
+
+
+class LocalCheckpointStoreTest(AsyncTestCase):
+
+    def setUp(self):
+        super(LocalCheckpointStoreTest, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_save_load_remove(self):
+        store = LocalCheckpointStore(self.dir)
+        self.assertIsNone(store.load("upload-1"))
+
+        store.save("upload-1", b"first")
+        store.save("upload-1", b"second")
+        self.assertEqual(store.load("upload-1"), b"second")
+
+        store.remove("upload-1")
+        store.remove("upload-1")
+        self.assertIsNone(store.load("upload-1"))
+
+    def test_invalid_upload_id(self):
+        store = LocalCheckpointStore(self.dir)
+        with self.assertRaises(ValueError):
+            store.save("../escape", b"data")
+        with self.assertRaises(ValueError):
+            store.path("upload\n")
@@ -0,0 +1,135 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from streamparser.core import FormEnd
+from streamparser.core import MultipartLimitError
+from streamparser.core import MultipartParser
+from streamparser.core import ParseError
+from streamparser.core import PartData
+from streamparser.core import PartEnd
+from streamparser.core import PartStart
+from streamparser.core import PHASE_BODY
+from streamparser.core import RawParser
+from streamparser.headers import PartHeaders
+
+DATA = b"""\
+--1234
+Content-Disposition: form-data; name="field"
+
+value
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+Content-Type: text/plain
+
+Foo
+--1234--
+""".replace(b"\n", b"\r\n")
+
+
+def summarize(events):
+    summary = []
+    for event in events:
+        if isinstance(event, PartStart):
+            summary.append(("start", event.disp_params.get("name")))
+        elif isinstance(event, PartData):
+            if summary and summary[-1][0] == "data":
+                summary[-1] = ("data", summary[-1][1] + bytes(event.data))
+            else:
+                summary.append(("data", bytes(event.data)))
+        elif isinstance(event, PartEnd):
+            summary.append(("end",))
+        elif isinstance(event, FormEnd):
+            summary.append(("form_end", event.fields))
+        else:
+            summary.append(("error", event.error))
+    return summary
+
+
+class MultipartParserTest(unittest.TestCase):
+
+    def test_feed_events(self):
+        parser = MultipartParser("1234")
+        events = parser.feed(DATA)
+
+        self.assertEqual(summarize(events), [
+            ("start", "field"), ("data", b"value"), ("end",),
+            ("start", "files"), ("data", b"Foo"), ("end",),
+            ("form_end", {}),
+        ])
+        self.assertEqual(events[3].headers.content_type, "text/plain")
+        self.assertTrue(parser.finished)
+        self.assertEqual(parser.feed(b"epilogue"), [])
+
+    def test_feed_split(self):
+        for chunk_size in (1, 7, 64):
+            parser = MultipartParser("1234")
+            events = []
+            for i in range(0, len(DATA), chunk_size):
+                events.extend(parser.feed(DATA[i:i + chunk_size]))
+            self.assertEqual(summarize(events), summarize(MultipartParser("1234").feed(DATA)))
+            self.assertEqual(parser.buffered, 0)
+
+    def test_collect_fields(self):
+        parser = MultipartParser('"1234"', copy_data=True, collect_fields=True)
+        events = parser.feed(DATA)
+
+        self.assertEqual(summarize(events), [
+            ("start", "files"), ("data", b"Foo"), ("end",), ("form_end", {"field": [b"value"]}),
+        ])
+        self.assertIsInstance(events[1].data, bytes)
+
+    def test_invalid_data(self):
+        parser = MultipartParser("1234")
+        events = parser.feed(DATA[:DATA.index(b"\r\n--1234\r\n") + 2] + b"--1234\r\nContent-Disposition: attachment\r\n\r\n")
+        events.extend(parser.feed(b"ignored"))
+
+        self.assertIsInstance(events[-1], ParseError)
+        self.assertIs(events[-1].error, parser.error)
+        self.assertEqual(sum(isinstance(event, ParseError) for event in events), 1)
+        self.assertEqual(summarize(events[:-1]), [("start", "field"), ("data", b"value"), ("end",)])
+        self.assertFalse(parser.finished)
+
+    def test_limit_error_follows_data(self):
+        parser = MultipartParser("1234", max_part_size=4)
+        events = parser.feed(DATA[:DATA.index(b"value") + 4])
+        self.assertEqual(summarize(events), [("start", "field"), ("data", b"valu")])
+
+        events = parser.feed(b"e")
+        self.assertIsInstance(events[0].error, MultipartLimitError)
+        self.assertEqual(events[0].error.phase, PHASE_BODY)
+
+
+class RawParserTest(unittest.TestCase):
+
+    def test_feed_events(self):
+        parser = RawParser(PartHeaders([("Content-Type", "application/octet-stream")]), length=6)
+        events = parser.feed(b"Foo")
+        self.assertEqual(summarize(events), [("start", None), ("data", b"Foo")])
+
+        parser = RawParser.restore(parser.checkpoint(), length=6)
+        self.assertEqual(parser.current_part[1], 3)
+        self.assertEqual(summarize(parser.feed(bytearray(b"Bar"))), [("data", b"Bar"), ("end",), ("form_end", {})])
+        self.assertTrue(parser.finished)
+
+    def test_longer_than_length(self):
+        parser = RawParser(length=2)
+        events = parser.feed(b"Foo")
+        self.assertIsInstance(events[-1], ParseError)
+        self.assertEqual(parser.finish(), [])
+
+
+class WithoutTornadoTest(unittest.TestCase):
+
+    def test_import_without_tornado(self):
+        code = """if True:
+            import sys
+            sys.modules["tornado"] = None
+            from streamparser.core import FormEnd, MultipartParser
+            data = b'--1234\\r\\nContent-Disposition: form-data; name="a"\\r\\n\\r\\nb\\r\\n--1234--\\r\\n'
+            assert isinstance(MultipartParser("1234").feed(data)[-1], FormEnd)
+            assert not any(name.startswith("tornado.") for name in sys.modules)
+        """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.check_call([sys.executable, "-c", code], cwd=root)
@@ -0,0 +1,216 @@
+import gzip
+import io
+import os
+import unittest
+import zlib
+
+from tornado.httputil import HTTPHeaders
+from tornado.log import gen_log
+from tornado.testing import AsyncTestCase
+from tornado.testing import ExpectLog
+
+from streamparser import MultipartError
+from streamparser import MultipartLimitError
+from streamparser import StreamingFormDataParser
+from streamparser import StreamingFormDataParserDelegate
+from streamparser.decoding import DECODE_CHUNK_SIZE
+from streamparser.core import PHASE_BODY
+from streamparser.decoding import get_decoder
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def gzip_compress(data):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode="wb") as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def form(part_data, part_headers=b""):
+    return (b"--1234\r\n"
+            b'Content-Disposition: form-data; name="files"; filename="ab.txt"\r\n' + part_headers +
+            b"\r\n" + part_data + b"\r\n--1234--\r\n")
+
+
+class RecordingDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.data = bytearray()
+        self.max_chunk = 0
+        self.finished = 0
+        self.errors = []
+
+    def file_data_received(self, file_data):
+        self.data += file_data
+        self.max_chunk = max(self.max_chunk, len(file_data))
+
+    def finish_file(self):
+        self.finished += 1
+
+    def on_error(self, error):
+        self.errors.append(error)
+
+
+class DecoderTest(AsyncTestCase):
+
+    def test_pieces_are_bounded(self):
+        data = b"\0" * (DECODE_CHUNK_SIZE * 5 + 10)
+        decoder = get_decoder("gzip")
+        pieces = list(decoder.decode(gzip_compress(data))) + list(decoder.finish())
+
+        self.assertEqual(b"".join(pieces), data)
+        self.assertLessEqual(max(len(piece) for piece in pieces), DECODE_CHUNK_SIZE)
+
+    def test_deflate(self):
+        decoder = get_decoder("Deflate")
+        self.assertEqual(b"".join(decoder.decode(zlib.compress(b"Foo"))), b"Foo")
+
+    def test_identity_and_unsupported(self):
+        self.assertIsNone(get_decoder("identity"))
+        with self.assertRaises(ValueError):
+            get_decoder("br")
+
+    def test_limits(self):
+        with self.assertRaises(MultipartLimitError) as raised:
+            list(get_decoder("gzip", max_ratio=10).decode(gzip_compress(b"\0" * 100000)))
+        self.assertEqual(raised.exception.limit_name, "max_decompression_ratio")
+
+        with self.assertRaises(MultipartLimitError) as raised:
+            list(get_decoder("gzip", max_size=1000).decode(gzip_compress(b"\0" * 100000)))
+        self.assertEqual(raised.exception.limit_name, "max_decoded_size")
+
+    def test_truncated(self):
+        decoder = get_decoder("gzip")
+        list(decoder.decode(gzip_compress(b"Foo")[:-4]))
+        with self.assertRaises(MultipartError):
+            list(decoder.finish())
+
+
+@unittest.skipIf(zstandard is None, "zstandard is not installed")
+class ZstdDecoderTest(AsyncTestCase):
+
+    def decode(self, decoder, data, chunk_size):
+        pieces = []
+        for i in range(0, len(data), chunk_size):
+            pieces.extend(decoder.decode(data[i:i + chunk_size]))
+        pieces.extend(decoder.finish())
+        return pieces
+
+    def test_pieces_are_bounded(self):
+        data = os.urandom(100000) + b"\0" * (DECODE_CHUNK_SIZE * 5 + 10) + b"abc" * 1000
+        encoded = zstandard.ZstdCompressor().compress(data)
+        for chunk_size in (1, 100, 5000, len(encoded)):
+            pieces = self.decode(get_decoder("zstd"), encoded, chunk_size)
+            self.assertEqual(b"".join(pieces), data)
+            self.assertLessEqual(max(len(piece) for piece in pieces), DECODE_CHUNK_SIZE)
+
+    def test_bomb_is_stopped_at_the_ratio(self):
+        bomb = zstandard.ZstdCompressor(level=19).compress(b"\0" * (64 * 1024 * 1024))
+        decoder = get_decoder("zstd", max_ratio=100)
+        with self.assertRaises(MultipartLimitError) as raised:
+            list(decoder.decode(bomb[:8192]))
+        self.assertEqual(raised.exception.limit_name, "max_decompression_ratio")
+        self.assertLessEqual(decoder.bytes_out, 8192 * 100 + DECODE_CHUNK_SIZE)
+
+    def test_truncated_and_invalid(self):
+        encoded = zstandard.ZstdCompressor().compress(b"Foo" * 1000)
+        with self.assertRaises(MultipartError):
+            self.decode(get_decoder("zstd"), encoded[:-4], 100)
+        with self.assertRaises(MultipartError):
+            self.decode(get_decoder("zstd"), b"not zstd data", 100)
+
+    def test_large_window_is_rejected(self):
+        params = zstandard.ZstdCompressionParameters.from_level(19, window_log=27)
+        compressor = zstandard.ZstdCompressor(compression_params=params).compressobj()
+        encoded = compressor.compress(os.urandom(1000) * 2) + compressor.flush()
+        with self.assertRaises(MultipartError):
+            self.decode(get_decoder("zstd"), encoded, len(encoded))
+
+
+class DecodingParserTest(AsyncTestCase):
+
+    def headers(self, content_encoding=None):
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        if content_encoding:
+            headers.add("Content-Encoding", content_encoding)
+        return headers
+
+    def parse(self, parser, data, chunk_size=100):
+        for i in range(0, len(data), chunk_size):
+            parser.data_received(data[i:i + chunk_size])
+
+    def test_body_is_decoded(self):
+        part_data = b"x" * (DECODE_CHUNK_SIZE * 3)
+        delegate = RecordingDelegate()
+        parser = StreamingFormDataParser(delegate, self.headers("gzip"))
+        self.parse(parser, gzip_compress(form(part_data)))
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(bytes(delegate.data), part_data)
+        self.assertLessEqual(delegate.max_chunk, DECODE_CHUNK_SIZE)
+
+    def test_truncated_body(self):
+        body = form(b"Foo")
+        parser = StreamingFormDataParser(RecordingDelegate(), self.headers("gzip"))
+        parser.data_received(gzip_compress(body)[:-20])
+        with ExpectLog(gen_log, "Truncated gzip data"):
+            parser.finish()
+
+        self.assertIsInstance(parser.error, MultipartError)
+        self.assertEqual(parser.error.offset, parser.bytes_received)
+        self.assertIsNotNone(parser.error.phase)
+
+    def test_body_is_not_decoded(self):
+        delegate = RecordingDelegate()
+        parser = StreamingFormDataParser(delegate, self.headers("gzip"), decode_body=False)
+        self.parse(parser, form(b"Foo"))
+        self.assertEqual(bytes(delegate.data), b"Foo")
+
+    def test_unsupported_body_encoding(self):
+        with self.assertRaises(ValueError):
+            StreamingFormDataParser(RecordingDelegate(), self.headers("br"))
+
+    def test_parts_are_decoded(self):
+        part_data = b"\0" * (DECODE_CHUNK_SIZE * 3)
+        delegate = RecordingDelegate()
+        parser = StreamingFormDataParser(delegate, self.headers(), decode_parts=True)
+        self.parse(parser, form(gzip_compress(part_data), b"Content-Encoding: gzip\r\n"), 10)
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(delegate.finished, 1)
+        self.assertEqual(bytes(delegate.data), part_data)
+        self.assertLessEqual(delegate.max_chunk, DECODE_CHUNK_SIZE)
+
+    def test_decompression_bomb(self):
+        delegate = RecordingDelegate()
+        parser = StreamingFormDataParser(delegate, self.headers(), decode_parts=True,
+                                         max_decompression_ratio=100)
+        with self.assertRaises(MultipartLimitError):
+            parser.data_received(form(gzip_compress(b"\0" * 10000000), b"Content-Encoding: gzip\r\n")).result()
+
+        self.assertEqual(delegate.finished, 0)
+        self.assertIs(parser.error, delegate.errors[0])
+
+    def test_max_part_size_applies_to_decoded_data(self):
+        parser = StreamingFormDataParser(RecordingDelegate(), self.headers(), decode_parts=True, max_part_size=1000)
+        with self.assertRaises(MultipartLimitError) as raised:
+            parser.data_received(form(gzip_compress(b"\0" * 2000), b"Content-Encoding: gzip\r\n")).result()
+        self.assertEqual(raised.exception.limit_name, "max_decoded_size")
+
+    def test_truncated_part(self):
+        delegate = RecordingDelegate()
+        parser = StreamingFormDataParser(delegate, self.headers(), decode_parts=True)
+        body = form(gzip_compress(b"Foo")[:-4], b"Content-Encoding: gzip\r\n")
+        with ExpectLog(gen_log, "Truncated gzip data"):
+            parser.data_received(body)
+
+        self.assertEqual(delegate.finished, 0)
+        self.assertFalse(parser.finished)
+        self.assertIsInstance(parser.error, MultipartError)
+        self.assertEqual(parser.error.offset, len(body))
+        self.assertEqual(parser.error.phase, PHASE_BODY)
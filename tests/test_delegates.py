@@ -0,0 +1,565 @@
+import os
+import shutil
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado import gen
+from tornado.httputil import HTTPHeaders
+from tornado.log import gen_log
+from tornado.testing import AsyncTestCase
+from tornado.testing import ExpectLog
+from tornado.testing import gen_test
+
+from streamparser import MultipartLimitError
+from streamparser import PartProcessor
+from streamparser import ProcessPoolDelegate
+from streamparser import RouterDelegate
+from streamparser import SpooledFileDelegate
+from streamparser import StreamingFormDataParser
+from streamparser import StreamingFormDataParserDelegate
+from streamparser import ThreadPoolDelegate
+from streamparser.delegates import SharedMemory
+
+DATA = b"""\
+--1234
+Content-Disposition: form-data; name="small"
+
+Foo
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+Content-Type: text/plain
+
+""".replace(b"\n", b"\r\n") + b"x" * 1000 + b"\r\n--1234--\r\n"
+
+
+DIGESTS = {"crc32": "%08x" % (zlib.crc32(b"x" * 1000) & 0xffffffff)}
+
+
+class DigestDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.digests = []
+
+    def finish_file(self, **kwargs):
+        self.digests.append(kwargs["digests"])
+
+
+class SpooledFileDelegateTest(AsyncTestCase):
+
+    def setUp(self):
+        super(SpooledFileDelegateTest, self).setUp()
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def parse(self, delegate, chunk_size, **kwargs):
+        parser = StreamingFormDataParser(delegate, self.headers, **kwargs)
+        for i in range(0, len(DATA), chunk_size):
+            parser.data_received(DATA[i:i + chunk_size])
+
+    def test_small_parts_stay_in_memory(self):
+        delegate = SpooledFileDelegate(max_memory_size=4096, dir=self.dir)
+        self.parse(delegate, 100)
+
+        self.assertEqual([part.name for part in delegate.parts], ["small", "files"])
+        for part in delegate.parts:
+            self.assertTrue(part.in_memory)
+        self.assertEqual(delegate.parts[0].read(), b"Foo")
+        self.assertEqual(delegate.parts[1].read(), b"x" * 1000)
+        self.assertEqual(delegate.parts[1].size, 1000)
+        self.assertEqual(delegate.parts[1].filename, "ab.txt")
+        self.assertEqual(delegate.parts[1].headers["Content-Type"], "text/plain")
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_large_parts_are_spilled(self):
+        delegate = SpooledFileDelegate(max_memory_size=256, dir=self.dir)
+        self.parse(delegate, 100)
+
+        small, large = delegate.parts
+        self.assertTrue(small.in_memory)
+        self.assertFalse(large.in_memory)
+        self.assertEqual(os.path.dirname(large.path), self.dir)
+        self.assertEqual(large.size, 1000)
+        with large.open() as f:
+            self.assertEqual(f.read(), b"x" * 1000)
+
+        delegate.cleanup()
+        self.assertFalse(os.path.exists(large.path))
+
+    def test_hashers(self):
+        delegate = SpooledFileDelegate(max_memory_size=256, dir=self.dir)
+        self.parse(delegate, 100, hashers=["crc32"])
+
+        self.assertEqual(delegate.parts[1].digests, DIGESTS)
+        delegate.cleanup()
+
+
+class BlockingDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.unblocked = threading.Event()
+        self.events = []
+        self.threads = set()
+
+    def start_file(self, headers, disp_params):
+        self.events.append("start")
+
+    def file_data_received(self, file_data):
+        self.unblocked.wait(5)
+        self.threads.add(threading.current_thread())
+        self.events.append(bytes(file_data))
+
+    def finish_file(self):
+        self.events.append("finish")
+
+
+class FailingDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.writes = []
+
+    def file_data_received(self, file_data):
+        self.writes.append(bytes(file_data))
+        raise IOError("disk full")
+
+
+class FieldsDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.fields = None
+        self.errors = []
+
+    def form_fields_received(self, fields):
+        self.fields = fields
+
+    def on_error(self, error):
+        self.errors.append(error)
+
+
+class ThreadPoolDelegateTest(AsyncTestCase):
+
+    def setUp(self):
+        super(ThreadPoolDelegateTest, self).setUp()
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        self.executor = ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+
+    @gen_test
+    def test_calls_are_ordered_and_off_the_ioloop(self):
+        wrapped = BlockingDelegate()
+        wrapped.unblocked.set()
+        delegate = ThreadPoolDelegate(wrapped, self.executor)
+        parser = StreamingFormDataParser(delegate, self.headers)
+
+        for i in range(0, len(DATA), 10):
+            yield parser.data_received(DATA[i:i + 10])
+
+        self.assertEqual(delegate.pending, 0)
+        self.assertEqual(wrapped.events[0], "start")
+        self.assertEqual(b"".join(event for event in wrapped.events if isinstance(event, bytes)),
+                         b"Foo" + b"x" * 1000)
+        self.assertEqual(wrapped.events.count("finish"), 2)
+        self.assertEqual(wrapped.events[-1], "finish")
+        self.assertNotIn(threading.current_thread(), wrapped.threads)
+
+    @gen_test
+    def test_queue_depth_pauses_parser(self):
+        wrapped = BlockingDelegate()
+        delegate = ThreadPoolDelegate(wrapped, self.executor, max_pending=2)
+        parser = StreamingFormDataParser(delegate, self.headers)
+        yield parser.data_received(b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+""".replace(b"\n", b"\r\n"))
+
+        for _ in range(10):
+            paused = parser.data_received(b"x" * 10)
+            if not paused.done():
+                break
+        self.assertFalse(paused.done())
+        self.assertEqual(delegate.pending, 3)
+
+        wrapped.unblocked.set()
+        yield paused
+        self.assertLessEqual(delegate.pending, 2)
+
+    @gen_test
+    def test_errors_are_raised(self):
+        delegate = ThreadPoolDelegate(FailingDelegate(), self.executor)
+        parser = StreamingFormDataParser(delegate, self.headers)
+
+        with self.assertRaises(IOError):
+            yield parser.data_received(DATA)
+
+    @gen_test
+    def test_calls_after_an_error_are_dropped(self):
+        wrapped = FailingDelegate()
+        delegate = ThreadPoolDelegate(wrapped, self.executor)
+        parser = StreamingFormDataParser(delegate, self.headers, max_field_size=10)
+
+        with self.assertRaises(IOError):
+            for i in range(0, len(DATA), 10):
+                yield parser.data_received(DATA[i:i + 10])
+            yield delegate._serial.flush()
+        self.assertEqual(len(wrapped.writes), 1)
+        self.assertEqual(delegate.pending, 0)
+
+    @gen_test
+    def test_fields_and_errors_are_passed_on(self):
+        wrapped = FieldsDelegate()
+        parser = StreamingFormDataParser(ThreadPoolDelegate(wrapped, self.executor), self.headers,
+                                         collect_fields=True)
+        yield parser.data_received(DATA)
+        self.assertEqual(wrapped.fields, {"small": [b"Foo"]})
+
+        wrapped = FieldsDelegate()
+        delegate = ThreadPoolDelegate(wrapped, self.executor)
+        parser = StreamingFormDataParser(delegate, self.headers)
+        with ExpectLog(gen_log, "Truncated"):
+            yield parser.data_received(DATA[:20])
+            yield parser.finish()
+        yield delegate._serial.flush()
+        self.assertEqual(len(wrapped.errors), 1)
+
+    @gen_test
+    def test_hashers(self):
+        wrapped = DigestDelegate()
+        parser = StreamingFormDataParser(ThreadPoolDelegate(wrapped, self.executor), self.headers, hashers=["crc32"])
+
+        yield parser.data_received(DATA)
+        self.assertEqual(wrapped.digests[1], DIGESTS)
+
+
+class Crc32Processor(PartProcessor):
+
+    def __init__(self):
+        self.crc = 0
+        self.batches = []
+        self.pids = set()
+
+    def process(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.batches.append(len(data))
+        self.pids.add(os.getpid())
+
+    def finish(self):
+        return self.crc, self.batches, self.pids
+
+
+class FailingProcessor(PartProcessor):
+
+    def process(self, data):
+        raise IOError("scan failed")
+
+
+class ResultDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.results = []
+        self.size = 0
+
+    def file_data_received(self, file_data):
+        self.size += len(file_data)
+
+    def finish_file(self, result=None):
+        self.results.append(result)
+
+
+class ProcessPoolDelegateTest(AsyncTestCase):
+
+    def setUp(self):
+        super(ProcessPoolDelegateTest, self).setUp()
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        self.executor = ProcessPoolExecutor(2)
+        self.addCleanup(self.executor.shutdown)
+
+    def files_only(self, headers, disp_params):
+        return Crc32Processor() if "filename" in disp_params else None
+
+    @gen_test
+    def check_batches(self, shared_memory):
+        wrapped = ResultDelegate()
+        delegate = ProcessPoolDelegate(wrapped, self.files_only, self.executor, batch_size=300,
+                                       shared_memory=shared_memory)
+        parser = StreamingFormDataParser(delegate, self.headers)
+
+        for i in range(0, len(DATA), 70):
+            yield parser.data_received(DATA[i:i + 70])
+
+        self.assertEqual(wrapped.size, 1003)
+        self.assertEqual(delegate.pending, 0)
+        self.assertIsNone(wrapped.results[0])
+        crc, batches, pids = wrapped.results[1]
+        self.assertEqual(crc, zlib.crc32(b"x" * 1000))
+        self.assertEqual(batches, [300, 300, 300, 100])
+        self.assertNotIn(os.getpid(), pids)
+
+    def test_shared_memory_batches(self):
+        self.check_batches(shared_memory=True)
+
+    def test_pickled_batches(self):
+        self.check_batches(shared_memory=False)
+
+    @gen_test
+    def test_errors_are_raised(self):
+        delegate = ProcessPoolDelegate(ResultDelegate(), lambda headers, disp_params: FailingProcessor(),
+                                       self.executor, batch_size=100)
+        parser = StreamingFormDataParser(delegate, self.headers)
+
+        with self.assertRaises(IOError):
+            yield parser.data_received(DATA)
+
+    @gen_test
+    def test_shared_memory_is_released_on_error(self):
+        wrapped = FieldsDelegate()
+        delegate = ProcessPoolDelegate(wrapped, self.files_only, self.executor, batch_size=300)
+        parser = StreamingFormDataParser(delegate, self.headers, max_part_size=500, collect_fields=True)
+        blocks = []
+        new_batch = delegate._new_batch
+
+        def record_new_batch():
+            new_batch()
+            blocks.append(delegate._block)
+
+        delegate._new_batch = record_new_batch
+        with self.assertRaises(MultipartLimitError):
+            for i in range(0, len(DATA), 70):
+                yield parser.data_received(DATA[i:i + 70])
+        self.assertEqual(len(blocks), 2)
+        self.assertEqual(len(wrapped.errors), 1)
+        self.assertIsNone(delegate._block)
+        while delegate.pending:
+            yield gen.sleep(0.01)
+        if SharedMemory is not None:
+            for block in blocks:
+                with self.assertRaises(FileNotFoundError):
+                    SharedMemory(block.name)
+
+    @gen_test
+    def test_resumed_parts_are_not_processed(self):
+        parser = StreamingFormDataParser(StreamingFormDataParserDelegate(), self.headers)
+        yield parser.data_received(DATA[:200])
+        checkpoint = parser.checkpoint()
+
+        log = []
+        wrapped = SlowSink(log, "files")
+        delegate = ProcessPoolDelegate(wrapped, self.files_only, self.executor, batch_size=300)
+        parser = StreamingFormDataParser(delegate, self.headers, checkpoint=checkpoint)
+        yield parser.data_received(DATA[200:])
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(log, [("files", "resume", "files", 200 - DATA.index(b"xxx")), ("files", "finish")])
+        self.assertEqual(bytes(wrapped.data), DATA[200:-12])
+        self.assertEqual(delegate.pending, 0)
+
+    @gen_test
+    def test_wraps_bundled_delegates(self):
+        wrapped = SpooledFileDelegate()
+        delegate = ProcessPoolDelegate(wrapped, lambda headers, disp_params: None, self.executor)
+        parser = StreamingFormDataParser(delegate, self.headers)
+
+        yield parser.data_received(DATA)
+        self.assertTrue(parser.finished)
+        self.assertEqual([part.read() for part in wrapped.parts], [b"Foo", b"x" * 1000])
+
+    @gen_test
+    def test_hashers(self):
+        wrapped = DigestDelegate()
+        delegate = ProcessPoolDelegate(wrapped, self.files_only, self.executor, batch_size=300)
+        parser = StreamingFormDataParser(delegate, self.headers, hashers=["crc32"])
+
+        yield parser.data_received(DATA)
+        self.assertEqual(wrapped.digests[1], DIGESTS)
+
+
+class SlowSink(StreamingFormDataParserDelegate):
+
+    def __init__(self, log, name, delay=0):
+        self.log = log
+        self.name = name
+        self.delay = delay
+        self.data = bytearray()
+
+    @gen.coroutine
+    def start_file(self, headers, disp_params):
+        self.log.append((self.name, "start", disp_params["name"]))
+
+    @gen.coroutine
+    def file_data_received(self, file_data):
+        yield gen.sleep(self.delay)
+        self.data += file_data
+
+    @gen.coroutine
+    def resume_file(self, headers, disp_params, size):
+        self.log.append((self.name, "resume", disp_params["name"], size))
+
+    @gen.coroutine
+    def finish_file(self):
+        yield gen.sleep(self.delay)
+        self.log.append((self.name, "finish"))
+
+    def on_error(self, error):
+        self.log.append((self.name, "error", len(self.data)))
+
+    def form_fields_received(self, fields):
+        self.log.append((self.name, "fields", fields))
+
+
+class FailingSink(StreamingFormDataParserDelegate):
+
+    def file_data_received(self, file_data):
+        raise IOError("sink failed")
+
+
+class RouterDelegateTest(AsyncTestCase):
+
+    def setUp(self):
+        super(RouterDelegateTest, self).setUp()
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+
+    def test_routes(self):
+        by_name, by_type, by_pattern, default = object(), object(), object(), object()
+        router = RouterDelegate({"avatar": by_name}, {"text/plain": by_type, "image/*": by_pattern}, default)
+
+        self.assertIs(router.route({"Content-Type": "text/plain"}, {"name": "avatar"}), by_name)
+        self.assertIs(router.route({"Content-Type": "Text/Plain; charset=utf-8"}, {"name": "doc"}), by_type)
+        self.assertIs(router.route({"Content-Type": "image/png"}, {"name": "doc"}), by_pattern)
+        self.assertIs(router.route({}, {"name": "doc"}), default)
+
+    @gen_test
+    def test_next_part_streams_while_previous_sink_is_busy(self):
+        log = []
+        slow = SlowSink(log, "slow", delay=0.02)
+        fast = SlowSink(log, "fast")
+        router = RouterDelegate({"files": slow}, default=fast)
+        parser = StreamingFormDataParser(router, self.headers)
+
+        yield parser.data_received(DATA)
+        self.assertTrue(parser.finished)
+        self.assertEqual(log[:2], [("fast", "start", "small"), ("slow", "start", "files")])
+        self.assertNotIn(("slow", "finish"), log)
+
+        yield router.flush()
+        self.assertEqual(log[2:], [("fast", "finish"), ("slow", "finish")])
+        self.assertEqual(router.pending, 0)
+        self.assertEqual(bytes(fast.data), b"Foo")
+        self.assertEqual(bytes(slow.data), b"x" * 1000)
+
+    @gen_test
+    def test_queue_depth_pauses_parser(self):
+        slow = SlowSink([], "slow", delay=0.001)
+        router = RouterDelegate(default=slow, max_pending=2)
+        parser = StreamingFormDataParser(router, self.headers)
+
+        paused = None
+        for i in range(0, len(DATA), 10):
+            result = parser.data_received(DATA[i:i + 10])
+            self.assertLessEqual(router.pending, 4)
+            if not result.done():
+                paused = result
+            yield result
+        self.assertIsNotNone(paused)
+
+    @gen_test
+    def test_sink_errors_are_raised(self):
+        router = RouterDelegate({"files": FailingSink()}, default=StreamingFormDataParserDelegate())
+        parser = StreamingFormDataParser(router, self.headers)
+
+        with self.assertRaises(IOError):
+            yield parser.data_received(DATA)
+        with self.assertRaises(IOError):
+            yield router.flush()
+
+    @gen_test
+    def test_resumed_parts_are_routed(self):
+        parser = StreamingFormDataParser(RouterDelegate(), self.headers)
+        yield parser.data_received(DATA[:200])
+        checkpoint = parser.checkpoint()
+
+        log = []
+        files = SlowSink(log, "files")
+        router = RouterDelegate({"files": files}, default=SlowSink(log, "default"))
+        parser = StreamingFormDataParser(router, self.headers, checkpoint=checkpoint)
+        yield parser.data_received(DATA[200:])
+        yield router.flush()
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(log, [("files", "resume", "files", 200 - DATA.index(b"xxx")), ("files", "finish")])
+        self.assertEqual(bytes(files.data), DATA[200:-12])
+
+    @gen_test
+    def test_errors_are_queued_after_the_sink_calls(self):
+        log = []
+        slow = SlowSink(log, "slow", delay=0.001)
+        router = RouterDelegate({"files": slow}, default=SlowSink(log, "default"))
+        parser = StreamingFormDataParser(router, self.headers, max_part_size=500)
+
+        with self.assertRaises(MultipartLimitError):
+            for i in range(0, len(DATA), 100):
+                yield parser.data_received(DATA[i:i + 100])
+        yield router.flush()
+
+        self.assertIn(("default", "error", 3), log)
+        self.assertEqual(log[-1], ("slow", "error", len(slow.data)))
+        self.assertGreater(len(slow.data), 0)
+
+    @gen_test
+    def test_fields_are_passed_to_the_default_sink(self):
+        log = []
+        router = RouterDelegate({"files": SlowSink(log, "files")}, default=SlowSink(log, "default"))
+        parser = StreamingFormDataParser(router, self.headers, collect_fields=True)
+
+        yield parser.data_received(DATA)
+        yield router.flush()
+        self.assertIn(("default", "fields", {"small": [b"Foo"]}), log)
+
+    @gen_test
+    def test_hashers(self):
+        wrapped = DigestDelegate()
+        router = RouterDelegate({"files": wrapped}, default=StreamingFormDataParserDelegate())
+        parser = StreamingFormDataParser(router, self.headers, hashers=["crc32"])
+
+        yield parser.data_received(DATA)
+        yield router.flush()
+        self.assertEqual(wrapped.digests, [DIGESTS])
+
+
+class OnErrorTest(AsyncTestCase):
+    """Every wrapper delegate passes parse errors on to the delegates it wraps"""
+
+    def setUp(self):
+        super(OnErrorTest, self).setUp()
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        self.executor = ThreadPoolExecutor(1)
+        self.addCleanup(self.executor.shutdown)
+
+    @gen_test
+    def check_on_error(self, wrapped, delegate):
+        parser = StreamingFormDataParser(delegate, self.headers, max_part_size=10)
+        with self.assertRaises(MultipartLimitError):
+            yield parser.data_received(DATA)
+        while getattr(delegate, "pending", 0):
+            yield gen.sleep(0.001)
+        self.assertEqual(len(wrapped.errors), 1)
+        self.assertIs(wrapped.errors[0], parser.error)
+
+    def test_thread_pool(self):
+        wrapped = FieldsDelegate()
+        self.check_on_error(wrapped, ThreadPoolDelegate(wrapped, self.executor))
+
+    def test_process_pool(self):
+        wrapped = FieldsDelegate()
+        self.check_on_error(wrapped, ProcessPoolDelegate(wrapped, lambda headers, disp_params: None, self.executor))
+
+    def test_router(self):
+        wrapped = FieldsDelegate()
+        self.check_on_error(wrapped, RouterDelegate(default=wrapped))
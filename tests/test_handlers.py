@@ -0,0 +1,142 @@
+from tornado.gen import coroutine
+from tornado.gen import sleep
+from tornado.log import gen_log
+from tornado.testing import AsyncHTTPTestCase
+from tornado.testing import ExpectLog
+from tornado.web import Application
+from tornado.web import RequestHandler
+from tornado.web import stream_request_body
+
+from streamparser import StreamingRawBodyParser
+from streamparser import StreamingUploadMixin
+
+DATA = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234
+Content-Disposition: form-data; name="files2"; filename="abc.txt"
+
+Foo2
+--1234--
+""".replace(b"\n", b"\r\n")
+
+HEADERS = {"Content-Type": "multipart/form-data; boundary=1234"}
+
+
+@stream_request_body
+class UploadHandler(StreamingUploadMixin, RequestHandler):
+
+    upload_max_body_size = 1000
+
+    def initialize(self, uploads, delay=0):
+        self.uploads = uploads
+        self.delay = delay
+
+    @coroutine
+    def start_file(self, headers, disp_params):
+        self.uploads.append([disp_params["filename"], b""])
+        if self.delay:
+            yield sleep(self.delay)
+
+    def file_data_received(self, file_data):
+        self.uploads[-1][1] += bytes(file_data)
+
+    @coroutine
+    def post(self):
+        if (yield self.finish_upload()):
+            self.write({"files": [name for name, data in self.uploads]})
+
+    def write_error(self, status_code, upload_error=None, **kwargs):
+        self.write({"error": str(upload_error)})
+
+
+@stream_request_body
+class RawUploadHandler(UploadHandler):
+
+    upload_parser_class = StreamingRawBodyParser
+    upload_max_body_size = None
+    upload_max_buffer_size = 16
+
+    def start_file(self, headers, disp_params):
+        self.uploads.append([headers["Content-Type"], b""])
+        self.calls = 0
+
+    @coroutine
+    def file_data_received(self, file_data):
+        # uneven waits before writing would reorder calls made while others are pending
+        self.calls += 1
+        yield sleep(0.002 if self.calls % 2 else 0)
+        super(RawUploadHandler, self).file_data_received(file_data)
+
+
+class StreamingUploadMixinTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.uploads = []
+        app = Application([
+            ("/upload", UploadHandler, {"uploads": self.uploads}),
+            ("/slow", UploadHandler, {"uploads": self.uploads, "delay": 0.01}),
+            ("/raw", RawUploadHandler, {"uploads": self.uploads}),
+        ])
+        app.io_loop = self.io_loop
+        return app
+
+    def test_upload(self):
+        response = self.fetch("/upload", method="POST", headers=HEADERS, body=DATA)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.uploads, [["ab.txt", b"Foo"], ["abc.txt", b"Foo2"]])
+
+    def test_backpressure(self):
+        """A delegate future pauses the body until it resolves"""
+        def body_producer(write):
+            for i in range(0, len(DATA), 7):
+                yield write(DATA[i:i + 7])
+
+        response = self.fetch("/slow", method="POST", headers=HEADERS, body_producer=coroutine(body_producer))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.uploads, [["ab.txt", b"Foo"], ["abc.txt", b"Foo2"]])
+
+    def test_raw_body_with_buffer_limit(self):
+        """Calls of the delegate are made in order while the parser reads ahead"""
+        body = bytes(bytearray(range(100)))
+
+        def body_producer(write):
+            for i in range(0, len(body), 5):
+                yield write(body[i:i + 5])
+
+        response = self.fetch("/raw", method="POST", headers={"Content-Type": "text/plain"},
+                              body_producer=coroutine(body_producer))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.uploads, [["text/plain", body]])
+
+    def test_content_length_is_rejected_before_the_body(self):
+        response = self.fetch("/upload", method="POST", headers=HEADERS, body=b"x" * 2000)
+        self.assertEqual(response.code, 413)
+        self.assertEqual(self.uploads, [])
+
+    def test_chunked_body_exceeding_the_limit(self):
+        """The connection's limit is lowered to ``upload_max_body_size`` too"""
+        def body_producer(write):
+            yield write(DATA[:-10] + b"x" * 2000)
+
+        response = self.fetch("/upload", method="POST", headers=HEADERS, body_producer=coroutine(body_producer))
+        self.assertEqual(response.code, 400)
+        self.assertEqual(self.uploads, [])
+
+    def test_invalid_body(self):
+        body = DATA.replace(b"form-data; name", b"attachment; name")
+        with ExpectLog(gen_log, "Invalid multipart/form-data"):
+            response = self.fetch("/upload", method="POST", headers=HEADERS, body=body)
+        self.assertEqual(response.code, 400)
+
+    def test_truncated_body(self):
+        with ExpectLog(gen_log, "Truncated multipart/form-data"):
+            response = self.fetch("/upload", method="POST", headers=HEADERS, body=DATA[:-10])
+        self.assertEqual(response.code, 400)
+        self.assertIn(b"Truncated", response.body)
+
+    def test_unsupported_content_type(self):
+        response = self.fetch("/upload", method="POST", headers={"Content-Type": "text/plain"}, body=b"x")
+        self.assertEqual(response.code, 415)
@@ -0,0 +1,83 @@
+import hashlib
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.httputil import HTTPHeaders
+from tornado.testing import AsyncTestCase
+from tornado.testing import gen_test
+
+from streamparser import StreamingFormDataParser
+from streamparser import StreamingFormDataParserDelegate
+from streamparser.hashing import Crc32
+from streamparser.hashing import hasher_factories
+
+DATA = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+""".replace(b"\n", b"\r\n") + b"x" * 1000 + b"""
+--1234
+Content-Disposition: form-data; name="files2"; filename="abc.txt"
+
+Foo2
+--1234--
+""".replace(b"\n", b"\r\n")
+
+
+class DigestsDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.digests = []
+
+    def finish_file(self, digests):
+        self.digests.append(digests)
+
+
+class HashingTest(AsyncTestCase):
+
+    def setUp(self):
+        super(HashingTest, self).setUp()
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+
+    def expected_digests(self, data):
+        return {
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "md5": hashlib.md5(data).hexdigest(),
+            "crc32": "{:08x}".format(zlib.crc32(data) & 0xffffffff),
+        }
+
+    def test_digests_are_passed_to_finish_file(self):
+        delegate = DigestsDelegate()
+        parser = StreamingFormDataParser(delegate, self.headers, hashers=["sha256", "md5", "crc32"])
+
+        for i in range(0, len(DATA), 100):
+            parser.data_received(DATA[i:i + 100])
+
+        self.assertEqual(delegate.digests, [self.expected_digests(b"x" * 1000), self.expected_digests(b"Foo2")])
+
+    @gen_test
+    def test_hashing_on_executor(self):
+        delegate = DigestsDelegate()
+        executor = ThreadPoolExecutor(4)
+        self.addCleanup(executor.shutdown)
+        parser = StreamingFormDataParser(
+            delegate, self.headers, hashers=["sha256", "md5", "crc32"], hash_executor=executor, hash_max_pending=2
+        )
+
+        for i in range(0, len(DATA), 10):
+            yield parser.data_received(DATA[i:i + 10])
+
+        self.assertEqual(delegate.digests, [self.expected_digests(b"x" * 1000), self.expected_digests(b"Foo2")])
+
+    def test_custom_hashers(self):
+        delegate = DigestsDelegate()
+        parser = StreamingFormDataParser(delegate, self.headers, hashers={"checksum": Crc32})
+
+        parser.data_received(DATA)
+
+        self.assertEqual(delegate.digests[1], {"checksum": self.expected_digests(b"Foo2")["crc32"]})
+
+    def test_unknown_hasher(self):
+        with self.assertRaises(ValueError):
+            hasher_factories(["nope"])
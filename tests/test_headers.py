@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from tornado.httputil import HTTPHeaders
+from tornado.testing import AsyncTestCase
+
+from streamparser import StreamingFormDataParser
+from streamparser.headers import PartHeaders
+from streamparser.headers import parse_content_disposition
+from streamparser.headers import parse_part_headers
+
+try:
+    # py33+
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class PartHeadersTest(AsyncTestCase):
+
+    def test_parse_part_headers(self):
+        headers = parse_part_headers(
+            b'Content-Disposition: form-data; name="files"; filename="ab.txt"\r\n'
+            b'Content-Type: text/plain\r\n'
+            b'X-Folded: a\r\n b'
+        )
+
+        self.assertEqual(headers.disposition, "form-data")
+        self.assertEqual(headers.disp_params, {"name": "files", "filename": "ab.txt"})
+        self.assertEqual(headers["content-type"], "text/plain")
+        self.assertEqual(headers.content_type, "text/plain")
+        self.assertEqual(headers.get("X-Folded"), "a b")
+        self.assertIsNone(headers.get("X-Missing"))
+        self.assertIn("CONTENT-TYPE", headers)
+        self.assertEqual(list(headers), ["Content-Disposition", "Content-Type", "X-Folded"])
+
+    def test_to_http_headers(self):
+        raw = b'Content-Disposition: form-data; name="files"; filename="ab.txt"\r\nContent-Type: text/plain'
+        self.assertEqual(
+            parse_part_headers(raw).to_http_headers(),
+            HTTPHeaders.parse(raw.decode("utf-8"))
+        )
+
+    def test_results_are_cached(self):
+        raw = b'Content-Disposition: form-data; name="cached"'
+        self.assertIs(parse_part_headers(raw), parse_part_headers(bytearray(raw)))
+
+    def test_cached_results_can_not_be_changed(self):
+        raw = b'Content-Disposition: form-data; name="shared"'
+        parse_part_headers(raw).disp_params["name"] = "changed"
+        self.assertEqual(parse_part_headers(raw).disp_params, {"name": "shared"})
+
+    def test_large_blocks_are_not_cached(self):
+        raw = b'Content-Disposition: form-data; name="' + b"x" * 2000 + b'"'
+        self.assertIsNot(parse_part_headers(raw), parse_part_headers(raw))
+        self.assertEqual(parse_part_headers(raw), parse_part_headers(raw))
+
+    def test_repeated_headers_are_joined(self):
+        headers = PartHeaders([("X-Tag", "a"), ("x-tag", "b")])
+        self.assertEqual(headers["X-Tag"], "a,b")
+        self.assertEqual(headers.items(), [("X-Tag", "a"), ("x-tag", "b")])
+
+    def test_non_utf8_headers(self):
+        headers = parse_part_headers(b'Content-Disposition: form-data; name="f"; filename="caf\xe9.txt"')
+        self.assertEqual(headers.disp_params["filename"], u"caf\xe9.txt")
+
+    def test_extended_filename(self):
+        disposition, params = parse_content_disposition(
+            "form-data; name=\"f\"; filename=\"naive.txt\"; filename*=UTF-8''na%C3%AFve%20%E2%82%AC.txt"
+        )
+        self.assertEqual(disposition, "form-data")
+        self.assertEqual(params, {"name": "f", "filename": u"na\xefve €.txt"})
+
+    def test_invalid_extended_filename_is_ignored(self):
+        _, params = parse_content_disposition("form-data; filename=\"a.txt\"; filename*=nope")
+        self.assertEqual(params, {"filename": "a.txt"})
+
+    def test_quoted_values(self):
+        _, params = parse_content_disposition('form-data; name="a;b"; filename="a\\";\\";.txt"; empty=""')
+        self.assertEqual(params, {"name": "a;b", "filename": 'a";";.txt', "empty": ""})
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_parser_passes_part_headers(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers, http_headers=False)
+        data = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        parser.data_received(data)
+
+        part_headers, disp_params = delegate.start_file.call_args[0]
+        self.assertIsInstance(part_headers, PartHeaders)
+        self.assertEqual(part_headers["Content-Disposition"], 'form-data; name="files"; filename="ab.txt"')
+        self.assertEqual(disp_params, {"name": "files", "filename": "ab.txt"})
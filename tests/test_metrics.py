@@ -0,0 +1,77 @@
+from tornado.concurrent import Future
+from tornado.gen import sleep
+from tornado.httputil import HTTPHeaders
+from tornado.testing import AsyncTestCase
+from tornado.testing import gen_test
+
+from streamparser import StreamingFormDataParser
+from streamparser import StreamingFormDataParserDelegate
+from streamparser.metrics import ParserMetrics
+from streamparser.metrics import StatsMetrics
+
+DATA = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234
+Content-Disposition: form-data; name="files2"; filename="abc.txt"
+
+Foo2
+--1234--
+""".replace(b"\n", b"\r\n")
+
+
+class SlowWriteDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.data = []
+
+    def file_data_received(self, file_data):
+        self.data.append(bytes(file_data))
+        return sleep(0.01)
+
+
+class MetricsTest(AsyncTestCase):
+
+    def setUp(self):
+        super(MetricsTest, self).setUp()
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+
+    @gen_test
+    def test_stats_metrics(self):
+        metrics = StatsMetrics()
+        delegate = SlowWriteDelegate()
+        parser = StreamingFormDataParser(delegate, self.headers, metrics=metrics)
+
+        for i in range(0, len(DATA), 50):
+            yield parser.data_received(DATA[i:i + 50])
+
+        self.assertEqual(delegate.data, [b"Foo", b"Foo2"])
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["bytes"], len(DATA))
+        self.assertEqual(snapshot["chunks"], (len(DATA) + 49) // 50)
+        self.assertEqual(snapshot["parts"], 2)
+        self.assertGreater(snapshot["buffer_high_watermark"], 50)
+        self.assertGreater(snapshot["parse_seconds"], 0)
+        self.assertGreaterEqual(snapshot["wait_seconds"], 0.02)
+        self.assertEqual(sorted(snapshot["callbacks"]), ["file_data_received", "finish_file", "start_file"])
+        self.assertEqual(snapshot["callbacks"]["start_file"]["count"], 2)
+        self.assertGreaterEqual(snapshot["callbacks"]["file_data_received"]["seconds"], 0.02)
+        self.assertGreaterEqual(snapshot["callbacks"]["file_data_received"]["max_seconds"], 0.01)
+
+    def test_snapshot_reset(self):
+        metrics = StatsMetrics()
+        parser = StreamingFormDataParser(StreamingFormDataParserDelegate(), self.headers, metrics=metrics)
+        parser.data_received(DATA)
+
+        self.assertEqual(metrics.snapshot(reset=True)["bytes"], len(DATA))
+        self.assertEqual(metrics.snapshot()["bytes"], 0)
+        self.assertEqual(metrics.snapshot()["callbacks"], {})
+
+    def test_parser_metrics_interface(self):
+        parser = StreamingFormDataParser(StreamingFormDataParserDelegate(), self.headers, metrics=ParserMetrics())
+        future = parser.data_received(DATA)
+        self.assertIsInstance(future, Future)
+        self.assertTrue(parser.finished)
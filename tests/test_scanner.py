@@ -0,0 +1,71 @@
+import random
+import unittest
+
+from streamparser import _scanner
+
+import test_streamparser
+
+try:
+    # py33+
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    from streamparser import _speedups
+except ImportError:
+    _speedups = None
+
+
+class PythonScannerStreamingFormDataParserTest(test_streamparser.StreamingFormDataParserTest):
+    """Runs the parser tests with the pure Python scanning engine"""
+
+    scanner = _scanner
+
+    def setUp(self):
+        super(PythonScannerStreamingFormDataParserTest, self).setUp()
+        patcher = mock.patch("streamparser.core.scanner", self.scanner)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@unittest.skipIf(_speedups is None, "C scanning engine is not built")
+class SpeedupsScannerStreamingFormDataParserTest(PythonScannerStreamingFormDataParserTest):
+    """Runs the parser tests with the C scanning engine"""
+
+    scanner = _speedups
+
+
+@unittest.skipIf(_speedups is None, "C scanning engine is not built")
+class ScannerParityTest(unittest.TestCase):
+
+    def test_constants(self):
+        self.assertEqual(_speedups.BODY_DATA, _scanner.BODY_DATA)
+        self.assertEqual(_speedups.BODY_PART_END, _scanner.BODY_PART_END)
+        self.assertEqual(_speedups.BODY_FORM_END, _scanner.BODY_FORM_END)
+
+    def test_scan_body(self):
+        rnd = random.Random(1234)
+        delimiter = b"\r\n--1234"
+        alphabet = [b"\r", b"\n", b"-", b"1", b"2", b"3", b"4", b"x", b"\r\n--1234"]
+        for _ in range(5000):
+            buffer = b"".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 20)))
+            start = rnd.randint(0, len(buffer))
+            for data in (buffer, bytearray(buffer), memoryview(buffer)):
+                self.assertEqual(
+                    _speedups.scan_body(data, delimiter, start),
+                    _scanner.scan_body(buffer, delimiter, start),
+                    (buffer, start)
+                )
+
+    def test_find_headers_end(self):
+        rnd = random.Random(1234)
+        alphabet = [b"\r", b"\n", b"a", b"\r\n"]
+        for _ in range(5000):
+            buffer = b"".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 20)))
+            start = rnd.randint(0, len(buffer))
+            self.assertEqual(
+                _speedups.find_headers_end(bytearray(buffer), start),
+                _scanner.find_headers_end(buffer, start),
+                (buffer, start)
+            )
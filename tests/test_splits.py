@@ -0,0 +1,285 @@
+"""
+Chunk-split and fuzz harness of the parser state machine
+
+Every body is parsed at once for reference and then again at every split point,
+at every pair of split points (for the short bodies), byte by byte and in random
+chunkings, and the delegate has to see the same calls with the same data.
+"""
+import random
+import unittest
+
+from tornado.httputil import HTTPHeaders
+from tornado.testing import AsyncTestCase
+
+from streamparser import AsyncStreamingFormDataParser
+from streamparser import StreamingFormDataParser
+from streamparser import StreamingFormDataParserDelegate
+from streamparser import _scanner
+from streamparser.core import MultipartParser
+from streamparser.core import PartData
+from streamparser.core import PartEnd
+from streamparser.core import PartStart
+from streamparser.core import FormEnd
+from streamparser.core import ParseError
+
+try:
+    # py33+
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    from streamparser import _speedups
+except ImportError:
+    _speedups = None
+
+SEED = 20240601
+RANDOM_CHUNKINGS = 200
+FUZZ_ITERATIONS = 1000
+
+
+def crlf(data):
+    return data.replace(b"\n", b"\r\n")
+
+
+BODIES = {
+    "file": crlf(b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234--
+"""),
+    "lookalikes": crlf(b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+Content-Type: text/plain
+
+""") + b"\r\n--123\r\r\n-\r\n--12345x--1234\r\n-\r\n--\r\n--1234 " + crlf(b"""
+--1234
+Content-Disposition: form-data; name="empty"; filename="empty.txt"
+
+
+--1234
+Content-Disposition: form-data; name="field"
+
+\r\n\r\n
+--1234--
+epilogue"""),
+    "fields": crlf(b"""\
+--1234
+Content-Disposition: form-data; name="a"
+
+1
+--1234
+Content-Disposition: form-data;
+ name="b"
+X-Extra: x
+
+22
+--1234
+Content-Disposition: form-data; name="c"; filename*=UTF-8''%E2%82%AC.txt
+
+333
+--1234--
+"""),
+    "binary": crlf(b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.bin"
+
+""") + bytes(bytearray(range(256))) * 3 + b"\r\n--1234--\r\n",
+}
+
+SHORT_BODIES = ("file", "fields")
+
+
+class RecordingDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.calls = []
+
+    def start_file(self, headers, disp_params):
+        self.calls.append(("start", sorted(headers.items()), sorted(disp_params.items())))
+
+    def file_data_received(self, file_data):
+        if self.calls and self.calls[-1][0] == "data":
+            self.calls[-1] = ("data", self.calls[-1][1] + bytes(file_data))
+        elif len(file_data):
+            self.calls.append(("data", bytes(file_data)))
+
+    def finish_file(self, **kwargs):
+        self.calls.append(("finish",))
+
+    def form_fields_received(self, fields):
+        self.calls.append(("fields", sorted(fields.items())))
+
+    def on_error(self, error):
+        self.calls.append(("error", error.message))
+
+
+def record_events(events, calls):
+    for event in events:
+        if isinstance(event, PartStart):
+            calls.append(("start", event.headers.items(), sorted(event.disp_params.items())))
+        elif isinstance(event, PartData):
+            if calls and calls[-1][0] == "data":
+                calls[-1] = ("data", calls[-1][1] + bytes(event.data))
+            elif len(event.data):
+                calls.append(("data", bytes(event.data)))
+        elif isinstance(event, PartEnd):
+            calls.append(("finish",))
+        elif isinstance(event, FormEnd):
+            calls.append(("fields", sorted(event.fields.items())))
+        elif isinstance(event, ParseError):
+            calls.append(("error", event.error.message))
+
+
+def split_at(body, points):
+    chunks = []
+    start = 0
+    for point in points:
+        chunks.append(body[start:point])
+        start = point
+    chunks.append(body[start:])
+    return chunks
+
+
+def random_chunkings(rnd, body, count):
+    for _ in range(count):
+        max_size = rnd.choice((2, 3, 7, 16, 64, len(body)))
+        chunks = []
+        start = 0
+        while start < len(body):
+            size = rnd.randint(1, max_size)
+            chunks.append(body[start:start + size])
+            start += size
+        yield chunks
+
+
+def chunkings(body, pairs):
+    yield [body[i:i + 1] for i in range(len(body))]
+    for point in range(len(body) + 1):
+        yield split_at(body, [point])
+    if pairs:
+        for first in range(len(body) + 1):
+            for second in range(first, len(body) + 1):
+                yield split_at(body, [first, second])
+    for chunks in random_chunkings(random.Random(SEED), body, RANDOM_CHUNKINGS):
+        yield chunks
+
+
+class CoreSplitTest(unittest.TestCase):
+    """Feeds `.core.MultipartParser` every chunking of the bodies"""
+
+    scanner = _scanner
+
+    def setUp(self):
+        patcher = mock.patch("streamparser.core.scanner", self.scanner)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def parse(self, chunks, **kwargs):
+        parser = MultipartParser("1234", **kwargs)
+        calls = []
+        for chunk in chunks:
+            record_events(parser.feed(chunk), calls)
+        record_events(parser.finish(), calls)
+        return calls
+
+    def check_body(self, name, pairs=True, **kwargs):
+        body = BODIES[name]
+        expected = self.parse([body], **kwargs)
+        self.assertNotIn("error", [call[0] for call in expected])
+        for chunks in chunkings(body, pairs and name in SHORT_BODIES):
+            self.assertEqual(self.parse(chunks, **kwargs), expected, (name, [len(chunk) for chunk in chunks]))
+
+    def test_file(self):
+        self.check_body("file")
+
+    def test_lookalikes(self):
+        self.check_body("lookalikes")
+
+    def test_fields(self):
+        self.check_body("fields")
+        self.check_body("fields", pairs=False, collect_fields=True, copy_data=True)
+
+    def test_binary(self):
+        self.check_body("binary")
+
+    def test_mixed_buffer_types(self):
+        body = BODIES["lookalikes"]
+        expected = self.parse([body])
+        rnd = random.Random(SEED)
+        for chunks in random_chunkings(rnd, body, RANDOM_CHUNKINGS):
+            chunks = [rnd.choice((bytes, bytearray))(chunk) for chunk in chunks]
+            self.assertEqual(self.parse(chunks), expected)
+
+    def test_fuzz(self):
+        """Mutated bodies end finished, stopped at a `ParseError` or waiting for data, never raising"""
+        rnd = random.Random(SEED)
+        names = sorted(BODIES)
+        for _ in range(FUZZ_ITERATIONS):
+            body = bytearray(BODIES[rnd.choice(names)])
+            for _ in range(rnd.randint(1, 4)):
+                position = rnd.randrange(len(body))
+                mutation = rnd.choice(("flip", "insert", "delete", "truncate"))
+                if mutation == "flip":
+                    body[position] = rnd.choice(b"\r\n-1234 x\"=;:")
+                elif mutation == "insert":
+                    body[position:position] = rnd.choice((b"\r\n", b"--1234", b"\r\n--1234\r\n", b"\r\n\r\n"))
+                elif mutation == "delete":
+                    del body[position:position + rnd.randint(1, 8)]
+                else:
+                    del body[position:]
+                if not body:
+                    body = bytearray(b"-")
+            body = bytes(body)
+
+            expected = self.parse([body], max_parts=20, max_header_size=1024)
+            for chunks in random_chunkings(rnd, body, 3):
+                self.assertEqual(self.parse(chunks, max_parts=20, max_header_size=1024), expected, body)
+
+
+@unittest.skipIf(_speedups is None, "C scanning engine is not built")
+class SpeedupsCoreSplitTest(CoreSplitTest):
+    """Runs the split harness with the C scanning engine"""
+
+    scanner = _speedups
+
+
+class ParserSplitTest(AsyncTestCase):
+    """Feeds the Tornado parsers single and double splits of the bodies"""
+
+    parser_class = StreamingFormDataParser
+
+    def parse(self, chunks, **kwargs):
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        delegate = RecordingDelegate()
+        parser = self.parser_class(delegate, headers, **kwargs)
+        for chunk in chunks:
+            parser.data_received(chunk)
+        parser.finish()
+        return delegate.calls
+
+    def check_body(self, name, **kwargs):
+        body = BODIES[name]
+        expected = self.parse([body], **kwargs)
+        for point in range(len(body) + 1):
+            chunks = split_at(body, [point])
+            self.assertEqual(self.parse(chunks, **kwargs), expected, (name, point))
+        for chunks in random_chunkings(random.Random(SEED), body, 20):
+            self.assertEqual(self.parse(chunks, **kwargs), expected, (name, [len(chunk) for chunk in chunks]))
+
+    def test_bodies(self):
+        for name in sorted(BODIES):
+            self.check_body(name)
+
+    def test_options(self):
+        self.check_body("fields", collect_fields=True, max_field_size=1, http_headers=False)
+        self.check_body("lookalikes", copy_file_data=True, hashers=["crc32"], max_bytes_in_flight=16)
+
+
+class AsyncParserSplitTest(ParserSplitTest):
+
+    parser_class = AsyncStreamingFormDataParser
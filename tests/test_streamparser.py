@@ -1,10 +1,27 @@
-import unittest
+import os
+import shutil
+import tempfile
 
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.gen import moment
 from tornado.httputil import HTTPHeaders
+from tornado.httputil import HTTPServerRequest
 from tornado.log import gen_log
+from tornado.testing import AsyncTestCase
 from tornado.testing import ExpectLog
+from tornado.testing import gen_test
+from tornado.web import Application
+from tornado.web import RequestHandler
 
+from streamparser import MultipartError
+from streamparser import MultipartLimitError
 from streamparser import StreamingFormDataParser
+from streamparser import StreamingFormDataParserDelegate
+from streamparser import StreamingRawBodyParser
+from streamparser import _writev
+from streamparser.streamparser import PHASE_BODY
+from streamparser.streamparser import PHASE_HEADERS
 
 try:
     # py33+
@@ -13,7 +30,7 @@ except ImportError:
     import mock
 
 
-class StreamingFormDataParserTest(unittest.TestCase):
+class StreamingFormDataParserTest(AsyncTestCase):
 
     @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
     def test_file_upload_full(self, StreamingFormDataParserDelegateMock):
@@ -390,3 +407,693 @@ Foo
         headers.add("Content-Type", "multipart/form-data;")
         with self.assertRaises(ValueError):
             StreamingFormDataParser(delegate, headers)
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_file_data_is_memoryview(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers)
+        data = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        parser.data_received(data)
+
+        file_data = delegate.file_data_received.call_args[0][0]
+        self.assertIsInstance(file_data, memoryview)
+        self.assertEqual(file_data, b"Foo")
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_copy_file_data(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers, copy_file_data=True)
+        data1 = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Fo\
+""".replace(b"\n", b"\r\n")
+
+        data2 = b"""\
+o
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        parser.data_received(data1)
+        parser.data_received(data2)
+
+        for call in delegate.file_data_received.call_args_list:
+            self.assertIsInstance(call[0][0], bytes)
+        delegate.file_data_received.assert_has_calls([mock.call(b"Fo"), mock.call(b"o")])
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_file_data_views_survive_following_chunks(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers)
+        data = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+""".replace(b"\n", b"\r\n") + b"x" * 300000 + b"\r\n--1234--\r\n"
+
+        for i in range(0, len(data), 1000):
+            parser.data_received(bytearray(data[i:i + 1000]))
+
+        received = b"".join(bytes(call[0][0]) for call in delegate.file_data_received.call_args_list)
+        self.assertEqual(received, b"x" * 300000)
+        self.assertTrue(delegate.finish_file.called)
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_delimiter_split_across_chunks(self, StreamingFormDataParserDelegateMock):
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        data = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234
+Content-Disposition: form-data; name="files2"; filename="abc.txt"
+
+Foo2
+--1234--
+""".replace(b"\n", b"\r\n")
+        first_delimiter = data.index(b"\r\n--1234\r\n")
+
+        for split in range(first_delimiter, first_delimiter + 11):
+            delegate = StreamingFormDataParserDelegateMock()
+            parser = StreamingFormDataParser(delegate, headers)
+
+            parser.data_received(data[:split])
+            parser.data_received(data[split:])
+
+            received = b"".join(bytes(call[0][0]) for call in delegate.file_data_received.call_args_list)
+            self.assertEqual(received, b"FooFoo2")
+            self.assertEqual(delegate.start_file.call_count, 2)
+            self.assertEqual(delegate.finish_file.call_count, 2)
+            delegate.reset_mock()
+            StreamingFormDataParserDelegateMock.reset_mock()
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_boundary_lookalike_in_file_data(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers)
+        data = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--12345
+--1234X
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        parser.data_received(data)
+
+        delegate.file_data_received.assert_called_once_with(b"Foo\r\n--12345\r\n--1234X")
+        self.assertEqual(delegate.finish_file.call_count, 1)
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_collect_fields(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers, collect_fields=True)
+        data = b"""\
+--1234
+Content-Disposition: form-data; name="title"
+
+Foo
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Bar
+--1234
+Content-Disposition: form-data; name="tag"
+
+a
+--1234
+Content-Disposition: form-data; name="tag"
+
+b
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        for i in range(len(data)):
+            parser.data_received(data[i:i + 1])
+
+        delegate.start_file.assert_called_once_with(mock.ANY, {"name": "files", "filename": "ab.txt"})
+        self.assertEqual(delegate.finish_file.call_count, 1)
+        received = b"".join(bytes(call[0][0]) for call in delegate.file_data_received.call_args_list)
+        self.assertEqual(received, b"Bar")
+        delegate.form_fields_received.assert_called_once_with({"title": [b"Foo"], "tag": [b"a", b"b"]})
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_collect_fields_too_large_field_is_streamed(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers, collect_fields=True, max_field_size=4)
+        data1 = b"""\
+--1234
+Content-Disposition: form-data; name="text"
+
+Foo\
+""".replace(b"\n", b"\r\n")
+        data2 = b"""\
+Bar
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        parser.data_received(data1)
+        self.assertFalse(delegate.start_file.called)
+        parser.data_received(data2)
+
+        delegate.start_file.assert_called_once_with(mock.ANY, {"name": "text"})
+        delegate.file_data_received.assert_called_once_with(b"FooBar")
+        self.assertEqual(delegate.finish_file.call_count, 1)
+        delegate.form_fields_received.assert_called_once_with({})
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_max_header_size(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers, max_header_size=100)
+
+        parser.data_received(b"--1234\r\nX-Header: ").result()
+        with self.assertRaises(MultipartLimitError) as cm:
+            for _ in range(10):
+                parser.data_received(b"x" * 20).result()
+
+        self.assertEqual(cm.exception.limit_name, "max_header_size")
+        self.assertFalse(delegate.start_file.called)
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_max_parts(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers, max_parts=1)
+        data = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234
+Content-Disposition: form-data; name="files2"; filename="abc.txt"
+
+Foo2
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        with self.assertRaises(MultipartLimitError) as cm:
+            parser.data_received(data).result()
+
+        self.assertEqual(cm.exception.limit_name, "max_parts")
+        self.assertEqual(delegate.start_file.call_count, 1)
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_max_part_size(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers, max_part_size=4)
+        data = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234
+Content-Disposition: form-data; name="files2"; filename="abc.txt"
+
+Foo2 too long
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        with self.assertRaises(MultipartLimitError) as cm:
+            parser.data_received(data).result()
+
+        self.assertEqual(cm.exception.limit_name, "max_part_size")
+        delegate.file_data_received.assert_called_once_with(b"Foo")
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_max_body_size(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers, max_body_size=100)
+
+        parser.data_received(b"--1234\r\nContent-Disposition: form-data; name=\"a\"\r\n\r\n").result()
+        with self.assertRaises(MultipartLimitError) as cm:
+            parser.data_received(b"x" * 100).result()
+
+        self.assertEqual(cm.exception.limit_name, "max_body_size")
+        self.assertEqual(cm.exception.limit, 100)
+        self.assertFalse(delegate.file_data_received.called)
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_finished(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers)
+        data = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        parser.data_received(data[:-10])
+        self.assertFalse(parser.finished)
+        parser.data_received(data[-10:])
+
+        self.assertTrue(parser.finished)
+        self.assertIsNone(parser.error)
+        self.assertFalse(delegate.on_error.called)
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_invalid_data_error(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", 'multipart/form-data; boundary=1234')
+        parser = StreamingFormDataParser(delegate, headers)
+        data = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234
+Content-Disposition: invalid; name="files"
+
+Foo
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        with ExpectLog(gen_log, "Invalid multipart/form-data"):
+            parser.data_received(data[:80])
+            parser.data_received(data[80:])
+        parser.data_received(b"ignored")
+
+        self.assertFalse(parser.finished)
+        self.assertIsInstance(parser.error, MultipartError)
+        self.assertEqual(parser.error.offset, data.index(b"Content-Disposition: invalid"))
+        self.assertEqual(parser.error.phase, PHASE_HEADERS)
+        self.assertIn("in headers phase", str(parser.error))
+        delegate.on_error.assert_called_once_with(parser.error)
+        self.assertEqual(delegate.start_file.call_count, 1)
+        self.assertEqual(delegate.finish_file.call_count, 1)
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_limit_error(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers, max_part_size=10)
+        head = b"--1234\r\nContent-Disposition: form-data; name=\"a\"; filename=\"a\"\r\n\r\n"
+
+        parser.data_received(head + b"x" * 8).result()
+        with self.assertRaises(MultipartLimitError):
+            parser.data_received(b"x" * 8).result()
+        parser.data_received(b"x" * 8).result()
+
+        self.assertEqual(parser.error.offset, len(head) + 10)
+        self.assertEqual(parser.error.phase, PHASE_BODY)
+        delegate.on_error.assert_called_once_with(parser.error)
+        delegate.file_data_received.assert_called_once_with(b"x" * 8)
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_multipart_mixed(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", 'multipart/related; boundary="1234"; type="application/json"')
+        parser = StreamingFormDataParser(delegate, headers, http_headers=False)
+        data = b"""\
+--1234
+Content-Type: application/json
+
+{}
+--1234
+
+plain
+--1234--
+""".replace(b"\n", b"\r\n")
+
+        for i in range(len(data)):
+            parser.data_received(data[i:i + 1])
+
+        self.assertTrue(parser.finished)
+        self.assertEqual([call[0][0].items() for call in delegate.start_file.call_args_list],
+                         [[("Content-Type", "application/json")], []])
+        self.assertEqual(b"".join(bytes(call[0][0]) for call in delegate.file_data_received.call_args_list),
+                         b"{}plain")
+        self.assertEqual(delegate.finish_file.call_count, 2)
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_truncated_body(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        parser = StreamingFormDataParser(delegate, headers)
+
+        parser.data_received(b"--1234\r\nContent-Disposition: form-data; name=\"a\"\r\n\r\nFoo")
+        with ExpectLog(gen_log, "Truncated multipart/form-data"):
+            parser.finish()
+
+        self.assertIsInstance(parser.error, MultipartError)
+        self.assertFalse(delegate.finish_file.called)
+        delegate.on_error.assert_called_once_with(parser.error)
+
+
+class StreamingRawBodyParserTest(AsyncTestCase):
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_content_length(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "application/octet-stream")
+        headers.add("Content-Disposition", 'attachment; filename="ab.bin"')
+        headers.add("Content-Length", "6")
+        parser = StreamingRawBodyParser(delegate, headers)
+
+        parser.data_received(b"Foo")
+        self.assertFalse(delegate.finish_file.called)
+        parser.data_received(b"Bar")
+
+        self.assertTrue(parser.finished)
+        expected_headers = HTTPHeaders()
+        expected_headers.add("Content-Type", "application/octet-stream")
+        expected_headers.add("Content-Disposition", 'attachment; filename="ab.bin"')
+        delegate.start_file.assert_called_once_with(expected_headers, {"filename": "ab.bin"})
+        self.assertEqual([bytes(call[0][0]) for call in delegate.file_data_received.call_args_list], [b"Foo", b"Bar"])
+        delegate.finish_file.assert_called_once_with()
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_finish(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "application/octet-stream")
+        parser = StreamingRawBodyParser(delegate, headers, copy_file_data=True, max_body_size=10)
+
+        parser.data_received(b"Foo")
+        parser.finish()
+
+        self.assertTrue(parser.finished)
+        delegate.file_data_received.assert_called_once_with(b"Foo")
+        delegate.finish_file.assert_called_once_with()
+
+    @mock.patch("streamparser.StreamingFormDataParserDelegate", spec=True)
+    def test_truncated_body(self, StreamingFormDataParserDelegateMock):
+        delegate = StreamingFormDataParserDelegateMock()
+        headers = HTTPHeaders()
+        headers.add("Content-Type", "application/octet-stream")
+        headers.add("Content-Length", "6")
+        parser = StreamingRawBodyParser(delegate, headers)
+
+        parser.data_received(b"Foo")
+        with ExpectLog(gen_log, "Truncated body"):
+            parser.finish()
+
+        self.assertFalse(parser.finished)
+        self.assertFalse(delegate.finish_file.called)
+
+
+class SlowSinkDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self):
+        self.writes = []
+        self.events = []
+
+    def start_file(self, headers, disp_params):
+        self.events.append("start")
+
+    def file_data_received(self, file_data):
+        future = Future()
+        self.writes.append((bytes(file_data), future))
+        self.events.append("data")
+        return future
+
+    def finish_file(self):
+        self.events.append("finish")
+
+
+class StreamingFormDataParserBackpressureTest(AsyncTestCase):
+
+    def setUp(self):
+        super(StreamingFormDataParserBackpressureTest, self).setUp()
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        self.delegate = SlowSinkDelegate()
+        self.first_chunk = b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+""".replace(b"\n", b"\r\n") + b"a" * 10
+
+    @gen_test
+    def test_keeps_parsing_below_high_watermark(self):
+        parser = StreamingFormDataParser(self.delegate, self.headers, max_bytes_in_flight=25)
+
+        yield parser.data_received(self.first_chunk)
+        yield parser.data_received(b"b" * 10)
+        self.assertEqual([data for data, _ in self.delegate.writes], [b"a" * 10])
+
+        # the next call is made once the previous one is done
+        self.delegate.writes[0][1].set_result(None)
+        yield moment
+        self.assertEqual([data for data, _ in self.delegate.writes], [b"a" * 10, b"b" * 10])
+
+    @gen_test
+    def test_writes_are_ordered(self):
+        class AsyncSinkDelegate(StreamingFormDataParserDelegate):
+            def __init__(self):
+                self.data = bytearray()
+                self.calls = 0
+
+            @gen.coroutine
+            def file_data_received(self, file_data):
+                self.calls += 1
+                yield gen.sleep(0.002 if self.calls % 2 else 0)
+                self.data += file_data
+
+        delegate = AsyncSinkDelegate()
+        parser = StreamingFormDataParser(delegate, self.headers, max_bytes_in_flight=4096)
+        data = bytes(bytearray(i % 251 for i in range(10 * 1024)))
+        body = self.first_chunk[:-10] + data + b"\r\n--1234--\r\n"
+
+        for i in range(0, len(body), 100):
+            yield parser.data_received(body[i:i + 100])
+        self.assertTrue(parser.finished)
+        self.assertEqual(bytes(delegate.data), data)
+
+    @gen_test
+    def test_pauses_above_high_watermark(self):
+        parser = StreamingFormDataParser(
+            self.delegate, self.headers, max_bytes_in_flight=25, resume_bytes_in_flight=10
+        )
+
+        yield parser.data_received(self.first_chunk)
+        yield parser.data_received(b"b" * 10)
+        paused = parser.data_received(b"c" * 10)
+        yield moment
+        self.assertFalse(paused.done())
+
+        self.delegate.writes[0][1].set_result(None)
+        yield moment
+        self.assertFalse(paused.done())
+
+        self.delegate.writes[1][1].set_result(None)
+        yield paused
+        self.assertEqual(len(self.delegate.writes), 3)
+
+    @gen_test
+    def test_finish_file_waits_for_pending_writes(self):
+        parser = StreamingFormDataParser(self.delegate, self.headers, max_bytes_in_flight=1024)
+
+        yield parser.data_received(self.first_chunk)
+        finished = parser.data_received(b"b" * 10 + b"\r\n--1234--\r\n")
+        yield moment
+        self.assertEqual(self.delegate.events, ["start", "data"])
+
+        self.delegate.writes[0][1].set_result(None)
+        yield moment
+        self.assertEqual(self.delegate.events, ["start", "data", "data"])
+        self.delegate.writes[1][1].set_result(None)
+        yield finished
+        self.assertEqual(self.delegate.events, ["start", "data", "data", "finish"])
+
+    @gen_test
+    def test_write_error_is_raised(self):
+        parser = StreamingFormDataParser(self.delegate, self.headers, max_bytes_in_flight=1024)
+
+        yield parser.data_received(self.first_chunk)
+        self.delegate.writes[0][1].set_exception(IOError("disk full"))
+        yield moment
+        yield moment
+
+        with self.assertRaises(IOError):
+            yield parser.data_received(b"b" * 10)
+
+
+class FileDescriptorDelegate(StreamingFormDataParserDelegate):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.fd = None
+        self.events = []
+
+    def start_file(self, headers, disp_params):
+        self.events.append(("start", disp_params["filename"]))
+        self.fd = os.open(os.path.join(self.directory, disp_params["filename"]), os.O_WRONLY | os.O_CREAT)
+
+    def file_descriptor(self):
+        return self.fd if not self.events[-1][1].endswith(".mem") else None
+
+    def file_data_received(self, file_data):
+        self.events.append(("data", bytes(file_data)))
+
+    def finish_file(self):
+        os.close(self.fd)
+        self.events.append(("finish",))
+
+
+class DirectWriteTest(AsyncTestCase):
+
+    def setUp(self):
+        super(DirectWriteTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.headers = HTTPHeaders()
+        self.headers.add("Content-Type", "multipart/form-data; boundary=1234")
+        self.delegate = FileDescriptorDelegate(self.directory)
+        self.data = (
+            b"--1234\r\n"
+            b'Content-Disposition: form-data; name="files"; filename="ab.txt"\r\n\r\n' +
+            b"".join(str(i).encode() for i in range(1000)) + b"\r\n--1234\r\n"
+            b'Content-Disposition: form-data; name="files"; filename="ab.mem"\r\n\r\n'
+            b"Foo\r\n--1234--\r\n"
+        )
+
+    def read(self, filename):
+        with open(os.path.join(self.directory, filename), "rb") as f:
+            return f.read()
+
+    def parse(self, parser, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            parser.data_received(self.data[i:i + chunk_size])
+
+    def test_file_data_is_written_in_batches(self):
+        parser = StreamingFormDataParser(self.delegate, self.headers, direct_write=True, write_batch_size=1000)
+        with mock.patch("streamparser.streamparser.write_buffers", wraps=_writev.write_buffers) as write_buffers:
+            self.parse(parser, 100)
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(self.read("ab.txt"), b"".join(str(i).encode() for i in range(1000)))
+        self.assertEqual(self.delegate.events, [
+            ("start", "ab.txt"), ("finish",), ("start", "ab.mem"), ("data", b"Foo"), ("finish",),
+        ])
+        # 2890 bytes in slices of at most 100 bytes
+        self.assertEqual(write_buffers.call_count, 3)
+
+    def test_without_writev(self):
+        parser = StreamingFormDataParser(self.delegate, self.headers, direct_write=True, copy_file_data=True)
+        with mock.patch("streamparser._writev._writev", None):
+            self.parse(parser, 7)
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(self.read("ab.txt"), b"".join(str(i).encode() for i in range(1000)))
+
+    def test_partial_writes(self):
+        def writev(fd, buffers):
+            return os.write(fd, bytes(buffers[0][:3]))
+
+        buffers = [b"abcd", memoryview(b"ef"), b"", b"ghijk"]
+        fd = os.open(os.path.join(self.directory, "partial"), os.O_WRONLY | os.O_CREAT)
+        with mock.patch("streamparser._writev._writev", writev):
+            _writev.write_buffers(fd, buffers)
+        os.close(fd)
+        self.assertEqual(self.read("partial"), b"abcdefghijk")
+
+    def test_pending_data_is_written_before_an_error(self):
+        parser = StreamingFormDataParser(self.delegate, self.headers, direct_write=True)
+        parser.data_received(self.data[:500])
+        with ExpectLog(gen_log, "Truncated"):
+            parser.finish()
+
+        start = self.data.index(b"\r\n\r\n") + 4
+        self.assertEqual(self.read("ab.txt"), self.data[start:500])
+
+
+class HandlerDelegate(RequestHandler):
+    """A delegate only implementing the methods the parser has always called"""
+
+    def initialize(self):
+        self.files = []
+
+    def start_file(self, headers, disp_params):
+        self.files.append([disp_params["name"], b""])
+
+    def file_data_received(self, file_data):
+        self.files[-1][1] += bytes(file_data)
+
+    def finish_file(self):
+        pass
+
+
+class RequestHandlerDelegateTest(AsyncTestCase):
+
+    def create_handler(self):
+        headers = HTTPHeaders({"Content-Type": "multipart/form-data; boundary=1234"})
+        request = HTTPServerRequest(method="POST", uri="/", headers=headers, connection=mock.Mock())
+        return HandlerDelegate(Application(), request)
+
+    @gen_test
+    def test_optional_methods_are_not_called(self):
+        handler = self.create_handler()
+        parser = StreamingFormDataParser(handler, collect_fields=True)
+        yield parser.data_received(b"""\
+--1234
+Content-Disposition: form-data; name="field"
+
+value
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234--
+""".replace(b"\n", b"\r\n"))
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(parser.fields, {"field": [b"value"]})
+        self.assertEqual(handler.files, [["files", b"Foo"]])
+
+    @gen_test
+    def test_invalid_data(self):
+        handler = self.create_handler()
+        parser = StreamingFormDataParser(handler, direct_write=True)
+        with ExpectLog(gen_log, "Invalid multipart/form-data"):
+            yield parser.data_received(b"""\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234
+Content-Disposition: invalid; name="files"
+
+""".replace(b"\n", b"\r\n"))
+
+        self.assertIsInstance(parser.error, MultipartError)
+        self.assertEqual(handler.files, [["files", b"Foo"]])